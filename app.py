@@ -1,217 +1,598 @@
 # Run this app with `python app.py` and
 # visit http://127.0.0.1:8050/ in your web browser.
 
-# Throughout the code, there are commented lines that can be uncommented to enable discharge graphing,
-# this comes at a significant performance cost and will require other modifications.
-# So it's left as an exercise for the reader ;)  *(you can check out the github commit history for a hint)*
+# The site's discharge readings can be overlaid on the graph with the switch under it. They are only queried once the
+# overlay is switched on, so the pressure-only workflow never pays for them.
+
+# To see where a slow request spends its time, start the app with PRESSUREGUI_METRICS=1 and open
+# http://127.0.0.1:8050/metrics, see instrumentation.py (PRESSUREGUI_PROFILE also saves profiles of slow callbacks).
 
 # Import dash modules
 from dash import Dash, dcc, html, dash_table
-from dash.dependencies import Output, Input, State
+from dash.dependencies import Output, Input, State, ALL
+from dash import ctx, no_update, Patch
+from dash.exceptions import PreventUpdate
 from dash_extensions.enrich import Output, DashProxy, Input, MultiplexerTransform
 import dash_bootstrap_components as dbc
+from flask import Response, abort, request, stream_with_context
+from werkzeug.utils import secure_filename
 
 # Import plotly modules
 import plotly.express as px
-# from plotly.subplots import make_subplots
-# import plotly.graph_objects as go
 
 # Import data modules
 import json
+import os
+import time
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from urllib.parse import quote
 import statistics as stat
-import sqlite3
 
 # Import custom modules
-from run_query import get_pressure, get_discharge
+from run_query import working_frame
 from layout import layout
-from changes import apply_changes, log_changes, Change
+from changes import apply_changes, log_changes, matching_positions, Change
+from session_store import SessionStore, ClientStore, SessionExpired
+from figures import build_figure, patch_figure, window_from_relayout, rows_in_window, discharge_trace, DISCHARGE_AXIS, \
+    build_overview
+from stats import selection_stats
+from selection import has_region, has_time_range, rows_in_region, rows_from_points
+from database import ConnectionPool
+from table import display_order, table_page, page_of_row, page_records
+from site_cache import SiteCache
+from autosave import Autosave
+from bulk_export import csv_chunks
+from jobs import JobManager, JobCancelled
+from summaries import Summaries
+from instrumentation import ENABLED as metrics_enabled, metrics, instrumented, instrument_callbacks
 
 # Declare the database file name here
 db_name = "copy.db"
 
+# Where the working data lives between callbacks: "server" keeps it in this process and gives the browser a token,
+# "client" sends the whole (binary encoded) dataset to the browser's store like the app used to
+store_mode = os.environ.get("PRESSUREGUI_STORE", "server")
+
+# Read-only connections to the database, opened the first time a site is queried and reused after that
+pool = ConnectionPool(db_name)
+
+# Parsed sites are cached so switching back to one is instant, set PRESSUREGUI_CACHE_DIR to keep them across restarts
+site_cache = SiteCache(memory_limit=int(os.environ.get("PRESSUREGUI_CACHE_MB", "256")) * 1024 ** 2,
+                       directory=os.environ.get("PRESSUREGUI_CACHE_DIR"))
+
+# Every callback reads and writes the working dataframe through this store, never through read_json/to_json
+store = ClientStore() if store_mode == "client" else SessionStore()
+
+# Edits are saved to this SQLite file as they happen, so a session can be resumed after a refresh or a crash.
+# Set PRESSUREGUI_AUTOSAVE to another file, or to nothing to turn autosaving off. The file is created on first use.
+autosave_path = os.environ.get("PRESSUREGUI_AUTOSAVE", "autosave.db")
+autosave = Autosave(autosave_path) if autosave_path else None
+
+# Hourly, daily and weekly summaries of each site, drawn while its readings load. Set PRESSUREGUI_SUMMARIES to another
+# file, or to nothing to turn them off. `python summaries.py` fills them in for every site ahead of time.
+summaries_path = os.environ.get("PRESSUREGUI_SUMMARIES", "summaries.db")
+summaries = Summaries(summaries_path) if summaries_path else None
+
+# Zooming the overview in to a window with at most this many readings draws the window's raw readings, read by rowid
+# from the log rows that cover it, while the rest of the site is still loading
+WINDOW_ROWS = 50000
+
+# Slow callbacks (loading a site) run as background jobs on this many threads, the page polls for their progress
+jobs = JobManager(os.environ.get("PRESSUREGUI_JOBS_DIR"), workers=int(os.environ.get("PRESSUREGUI_JOB_WORKERS", "2")))
+
 # app = Dash(external_stylesheets=[dbc.themes.FLATLY])
 app = DashProxy(external_stylesheets=[dbc.themes.FLATLY],
                 prevent_initial_callbacks=True, transforms=[MultiplexerTransform()])
 
+# time every callback defined below, when PRESSUREGUI_METRICS is set
+instrument_callbacks(app)
+
 # layout is stored in the layout.py file
 app.layout = layout
 
 
 @app.callback(
-    Output('mean', 'children'),
-    Output('variance', 'children'),
+    Output('selection-stats', 'children'),
+    Input('indicator-graphic', 'selectedData'),
+    State('memory-output', 'data'),
+    State('view-window', 'data'))
+def display_selected(selection, data, view):
+    """
+        This function is called when the user selects a region on the graph. It will display the count, mean,
+        standard deviation, range, median, time span and trend of the selected readings, overall and per batch.
+
+    :param selection: the graph's selectedData
+    :param data: session store token for the pressure data
+    :param view: the visible time window of the graph
+    :return: the statistics panel
+    """
+
+    if selection is None or data is None:
+        return "No points selected"
+
+    # look the selected rows up by id against the stored frame, so points hidden by downsampling count too
+    overall, batches = selection_stats(dataframe_from_selection(store.get(data), selection, view))
+    if overall['count'] == 0:
+        return "No points selected"
+    return stats_panel(overall, batches)
+
+
+def stats_panel(overall, batches):
+    """
+        Lays out the statistics of a selection
+    :param overall: dict of statistics from selection_stats
+    :param batches: per batch dataframe from selection_stats
+    :return: list of dash components
+    """
+    def number(value):
+        return "-" if pd.isna(value) else f"{value:.4f}"
+
+    rows = [("Count", overall['count']), ("Mean", number(overall['mean'])), ("Std. dev.", number(overall['std'])),
+            ("Min", number(overall['min'])), ("Max", number(overall['max'])), ("Median", number(overall['median'])),
+            ("From", f"{overall['first']:%Y-%m-%d %H:%M}"), ("To", f"{overall['last']:%Y-%m-%d %H:%M}"),
+            ("Span", str(overall['span'])), ("Slope per day", number(overall['slope_per_day']))]
+    per_batch = pd.DataFrame({
+        'Batch': batches['batch_id'],
+        'Count': batches['count'],
+        'Mean': batches['mean'].map(number),
+        'Std.': batches['std'].map(number),
+        'Slope/day': batches['slope_per_day'].map(number),
+    })
+    return [
+        dbc.Table([html.Tbody([html.Tr([html.Th(name), html.Td(value)]) for name, value in rows])], size="sm"),
+        html.H6("Per batch"),
+        dbc.Table.from_dataframe(per_batch, size="sm", striped=True),
+    ]
+
+
+@app.callback(
+    Output('range_start', 'value'),
+    Output('range_end', 'value'),
     Input('indicator-graphic', 'selectedData'))
-def display_selected(selection):
+def clear_time_range(selection):
     """
-        This function is called when the user selects a region on the graph. It will display the mean and variance
+        This function is called when the user selects a region on the graph. It empties the typed time range, so the
+        edits act on the new selection rather than on a range typed before it.
+    :param selection: the graph's selectedData
+    :return: empty start and end of the time range
     """
+    if selection is None:
+        raise PreventUpdate  # the selection was cleared, a typed range stays
+    return "", ""
 
-    if selection is not None:
-        pressures_selected = []
-        for point in selection['points']:
-            pressures_selected.append(point['y'])  # the y value is the pressure, append all to a list
 
-        pressures_selected = pd.DataFrame(pressures_selected)  # convert to a dataframe for easy statistics
+@app.callback(
+    Output('edit-target', 'children'),
+    Input('indicator-graphic', 'selectedData'),
+    Input('range_start', 'value'),
+    Input('range_end', 'value'))
+def show_edit_target(selection, t0, t1):
+    """
+        Says what Shift, Compress and Delete will act on: the typed time range while both ends are filled in,
+        otherwise the selection on the graph (see dataframe_from_selection)
+    :param selection: the graph's selectedData
+    :param t0: start of the typed time range
+    :param t1: end of the typed time range
+    :return: the text under the editor
+    """
+    if has_time_range(t0, t1):
+        return f"Edits apply to the typed time range {t0} to {t1}"
+    if selection is not None:
+        return "Edits apply to the points selected on the graph"
+    return "Select points on the graph, or type a time range, to edit them"
 
-        return pressures_selected.mean(), pressures_selected.var()  # return the mean and variance
 
-    else:
-        return 0, 0
+@app.callback(
+    Output('query-job', 'data'),
+    Output('job-poll', 'disabled'),
+    Output('query-status', 'children'),
+    Output('overview-site', 'data'),
+    Output('resume', 'value'),
+    Input('query', 'n_clicks'),
+    State('site_id', 'value'),
+    State('user', 'value'),
+    State('resume', 'value'),
+    State('window-only', 'value'),
+    State('view-window', 'data'),
+    State('memory-output', 'data'),
+    State('query-job', 'data'))
+def start_query(n_clicks, site_id, user, resume, window_only, view, token, running):
+    """
+        This function is called when the user clicks the "Query" button. It starts loading the site in the background
+        (see main_query) and has the page poll for it, so the request returns at once. Clicking again for the same site
+        while it loads just keeps waiting for the same job, asking for another site cancels the old one.
+
+    :param n_clicks: clicks of the query button
+    :param site_id: the site to load
+    :param user: who is cleaning it, autosaved sessions are kept per site and user so it can't be blank
+    :param resume: whether to pick up the user's autosaved session, or start over from the database
+    :param window_only: whether to load only the time window the graph is zoomed in to (see main_query)
+    :param view: the visible time window of the graph
+    :param token: session store token of the data loaded now, if any, it keeps pages apart in the job key
+    :param running: the query job the page is waiting for, if any
+    :return: the job to poll, whether polling is off, a status message, the site to draw an overview of, and the
+        resume switch (back on after starting over, so the next query doesn't throw the new session away too)
+    """
+    user = (user or "").strip()
+    if not user:
+        if autosave is not None:  # everyone without a name would share, and resume, one session
+            return no_update, no_update, "Enter your name first, autosaved edits are kept per user", no_update, \
+                no_update
+        user = "anonymous"
+    window = view.get('window') if window_only and view else None  # zoomed out: the whole site
+    session = token.get('session') if isinstance(token, dict) else None
+    job = jobs.submit(('query', site_id, user, session, bool(resume), str(window)), main_query, site_id, user,
+                      bool(resume), window)
+    if running and running['id'] != job.id:
+        jobs.cancel(running['id'])  # superseded, its result would be thrown away anyway
+    loading = f"Loading {site_id} from {window[0]} to {window[1]}..." if window else f"Loading {site_id}..."
+    return {'id': job.id}, False, loading, {'site_id': site_id, 'job': job.id}, True
 
 
 @app.callback(
     Output('memory-output', 'data'),
-    # Output('discharge', 'data'),
     Output('history', 'data'),
-    Input('query', 'n_clicks'),
-    State('site_id', 'value'))
-def main_query(n_clicks, site_id):
+    Output('redo-history', 'data'),
+    Output('view-window', 'data'),
+    Output('session-key', 'data'),
+    Output('job-poll', 'disabled'),
+    Output('query-status', 'children'),
+    Input('job-poll', 'n_intervals'),
+    State('query-job', 'data'),
+    State('memory-output', 'data'))
+def poll_query(n_intervals, running, token):
     """
-        This function is called when the user clicks the "Query" button. It will query the database and return the data
-        for the selected site_id. This data is stored in the local storage of the browser, and triggers an update to the
-        graph and table through the stores's callbacks.
+        This function is called every poll interval while a query job runs. It shows the job's progress, and once it is
+        done hands the loaded data to the stores, which updates the graph and table. The job loaded the site into a
+        session of its own, which replaces the page's old one only here, once it is known to be the job the page is
+        waiting for.
+
+    :param n_intervals: number of polls so far
+    :param running: the query job the page is waiting for
+    :param token: session store token of the data loaded before, dropped once the new data is handed over
+    :return: the data token, change log, redo list, view and session key once loaded, whether polling is off, and a
+        status message
     """
-    try:
-        assert db_name.endswith(".db")
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()  # This object will allow queries to be run on the database
-    except sqlite3.Error as e:
-        print("Cannot open database file")
+    state = jobs.state(running['id']) if running else None
+    waiting = [no_update] * 5
+    if state is None:
+        return *waiting, True, ""
+    if state['status'] in ("queued", "running"):
+        return *waiting, False, f"{state['message']} ({state['progress']:.0%})"
+    if state['status'] != "done":
+        if state['status'] == "cancelled" and state['result']:  # superseded as it finished, don't swap its data in
+            store.drop(state['result'][0])
+        return *waiting, True, f"Query {state['status']}: {state['error']}" if state['error'] else ""
+
+    data = state['result'][0]
+    if token in store and token.get('session') != data.get('session'):
+        store.drop(token)  # so the old site's data doesn't linger on the server
+    seconds = state['finished'] - state['submitted']
+    return *state['result'], True, f"Loaded in {seconds:.1f} s"
+
+
+@instrumented("job")
+def main_query(job, site_id, user, resume=True, window=None):
+    """
+        Loads a site as a background job (see start_query). It will query the database for the selected site_id. This
+        data is kept in the server side session store, the browser only gets a token for it, and the new token triggers
+        an update to the graph and table through the stores's callbacks.
+        If this user has an autosaved session for the site, it picks up where they left off instead, unless they chose
+        to start over, which also deletes the autosaved session.
+        Given a time window, only the site's readings in it are loaded and edited (see Summaries.window_frame), in a
+        session that is autosaved apart from the whole site's.
+
+    :param job: the Job, for reporting progress
+    :param site_id: the site to load
+    :param user: who is cleaning it
+    :param resume: False to load the site from the database even if there is an autosaved session
+    :param window: [t0, t1] to load only the readings in it, None for the whole site
+    :return: the data token, change log, redo list, view window and session key
+    """
+    window = window if summaries is not None else None  # the window is found through the summaries
+    key = {'site_id': site_id, 'user': user, 'window': window}
+    job.report(0.05, "looking for an autosaved session")
+    resumed = autosave.resume(saved_as(key), user) if autosave is not None and resume else None
+    if resumed is not None:
+        table, step, change_log, redo = resumed  # the newest checkpoint, and the changes made since it
+        job.report(0.5, f"replaying {len(change_log) - step - 1} autosaved changes")
+        data = replay_changes(store.create(table), change_log[step + 1:], base=step)  # a new session, see poll_query
+        return unless_superseded(job, data), change_log, redo, None, key
 
     # SQL query on the database -- Depending on your database, this will need to be formatted
-    # to fit your system requirements
-    pressure_data = get_pressure(cursor, site_id)
+    # to fit your system requirements. The cursor's connection goes back to the pool afterwards.
+    if window:
+        job.report(0.1, f"querying {site_id} from {window[0]} to {window[1]}")
+        with pool.cursor() as cursor:  # the summaries find the window's rows, so they have to be up to date first
+            summaries.update(cursor, site_id)
+            table = summaries.window_frame(cursor, site_id, window)
+    else:
+        job.report(0.1, f"querying {site_id}")
+        with pool.cursor() as cursor:  # raises DatabaseError if the database can't be opened
+            pressure_data = site_cache.get(cursor, site_id)  # only reruns get_pressure if the site's batches changed
 
-    table = pd.DataFrame(pressure_data)  # make sure the data is in a dataframe
-    table['pressure_hobo'].replace('', np.nan, inplace=True)  # replace empty values with NaN
-    table.dropna(subset=['pressure_hobo'], inplace=True)  # drop rows with NaN values
-    table.drop('index', axis=1, inplace=True)  # drop the index column  # TODO probably not necessary, but it's here
+        if summaries is not None:  # new batches are added to the summaries in the background, for the next overview
+            jobs.submit(('summaries', site_id), update_summaries, site_id)
 
-    # discharge_data = get_discharge(cursor, site_id)
-    # discharge_df = pd.DataFrame(discharge_data)
-    # discharge_df['discharge_measured'].replace('', np.nan, inplace=True)
-    # discharge_df.dropna(subset=['discharge_measured'], inplace=True)
-    # discharge_df.drop('index', axis=1, inplace=True)
+        job.report(0.8, f"preparing {len(pressure_data)} readings")
+        table = working_frame(pressure_data)  # drop readings without a value and number the rows in time order
+    if autosave is not None and not resume:
+        autosave.forget(saved_as(key), user)  # the new change log starts the saved session over
 
-    data = table.to_json()  # convert the dataframe to json for storage in the browser
-    # discharge = discharge_df.to_json()
+    # stored in a new session, never the page's current one: a newer query may already have replaced that. poll_query
+    # swaps it in if this is still the job the page waits for, and drops the old one.
+    job.report(0.9, "storing the working data")  # stops here if a newer query superseded this one
+    data = unless_superseded(job, store.create(table))
 
     # initialize the change log for undo functionality
-    change_log = log_changes([], "init", pd.DataFrame(), f"Initialized with site_id: {site_id}")
-    return data, change_log
+    description = f"Initialized with site_id: {site_id}"
+    if window:
+        description += f", readings from {window[0]} to {window[1]}"
+    change_log = log_changes([], "init", pd.DataFrame(), description)
+    return data, change_log, [], None, key  # a new site starts zoomed out
+
+
+def saved_as(key):
+    """
+        Names a session in the autosave file, a window of a site is saved apart from the whole site
+    :param key: the session key, its site, user and window
+    :return: the site name to autosave the session under
+    """
+    window = key.get('window')
+    return f"{key['site_id']} {window[0]} to {window[1]}" if window else key['site_id']
+
+
+def unless_superseded(job, data):
+    """
+        Drops the session a query job just stored if the job was cancelled while storing it, nobody would pick it up
+    :param job: the Job
+    :param data: session store token the job stored its frame under
+    :return: data, if the job is still wanted
+    """
+    if not job.in_flight():
+        store.drop(data)
+        raise JobCancelled(job.id)
+    return data
+
+
+@instrumented("job")
+def update_summaries(job, site_id):
+    """
+        Adds a site's new batches to its summaries, as a background job
+    :param job: the Job, for reporting progress
+    :param site_id: the site
+    :return: number of new batches summarized
+    """
+    job.report(0.1, f"summarizing {site_id}")
+    with pool.cursor() as cursor:
+        return summaries.update(cursor, site_id)
 
 
 @app.callback(
-    Output('update-table', 'children'),
+    Output('pressure-table', 'data'),
+    Output('pressure-table', 'page_count'),
+    Output('pressure-table', 'style_data_conditional'),
+    Output('pressure-table', 'page_current'),
+    Input('memory-output', 'data'),
+    Input('pressure-table', 'page_current'),
+    Input('pressure-table', 'page_size'),
+    Input('pressure-table', 'sort_by'),
+    Input('pressure-table', 'filter_query'),
     Input('indicator-graphic', 'selectedData'),
-    State('memory-output', 'data'),
-    State('updated-table', 'data')
+    State('view-window', 'data')
 )
-def display_selected_data(selectedData, data, updatedData):
+def update_table(data, page_current, page_size, sort_by, filter_query, selectedData, view):
     """
-        This function is called when the user selects a region on the graph. It will display the selected data in a
-        table below the graph.
+        This function is called when the data changes, the user pages, sorts or filters the table, or selects a region
+        on the graph. Only the rows on the current page are sent to the browser. A new selection jumps to the page
+        holding its first point, and selected rows are highlighted.
+
+    :param data: session store token for the pressure data
+    :param page_current: the page the table is on
+    :param page_size: rows per page
+    :param sort_by: the table's sort columns
+    :param filter_query: the table's filter
+    :param selectedData: the currently selected data
+    :param view: the visible time window of the graph
+    :return: the page's rows, the number of pages, the highlight styles and the page shown
     """
+    if data is None:
+        raise PreventUpdate
 
-    pressure_table = pd.read_json(data)  # read the data from the local storage
-    if selectedData is not None:
-        selected_styles = update_table_style(selectedData)  # update the styling of the table based on the selection
-        if updatedData is not None:
-            pressure_table = pd.read_json(updatedData)  # used the updated data if it exists  # TODO this is a bit jank
-        return html.Div(
-            [
-                dash_table.DataTable(
-                    data=pressure_table.to_dict('rows'),
-                    columns=[{'id': x, 'name': x} for x in pressure_table.columns],
-                    style_data_conditional=selected_styles,
-                )
-            ]
-        )
-    else:
-        pass
+    df = store.get(data)  # read the data from the session store
+    order = display_order(df, sort_by, filter_query, data)  # None when the table is in time order
 
+    selected = pd.Index([])
+    if selectedData is not None:
+        selected = dataframe_from_selection(df, selectedData, view).index
+        if ctx.triggered_id == 'indicator-graphic' and len(selected):
+            page = page_of_row(df, selected[0], page_size, order)
+            if page is not None:
+                page_current = page  # show where the selection starts
 
-def update_table_style(selectedData):
-    """
-        This function is called when the user selects a region on the graph. It will update the styling of the table
-        based on the selection. There's proabably a better way to do this, but it works for now.
-    """
+    page, page_count = table_page(df, page_current or 0, page_size, order)
+    if page_current and page_current >= page_count:  # the data shrank or the filter narrowed, go to the last page
+        page_current = page_count - 1
+        page, page_count = table_page(df, page_current, page_size, order)
 
-    points_selected = []
-    for point in selectedData['points']:
-        points_selected.append(point['pointIndex'])
     selected_styles = [{'if': {'row_index': i},
-                        'backgroundColor': 'pink'} for i in points_selected]  # make the selected rows pink
+                        'backgroundColor': 'pink'} for i in np.flatnonzero(page.index.isin(selected)).tolist()]
 
-    return selected_styles
+    return page_records(page), page_count, selected_styles, page_current or 0
 
 
-def dataframe_from_selection(data, selection):
+def dataframe_from_selection(df, selection, view=None, time_range=None):
     """
         Returns a dataframe that contains only the points selected on the graph.
-    :param data: A JSON string containing the data from the local storage
+    :param df: The working dataframe from the session store
     :param selection: A dictionary from the selectedData property of the graph
-    :return:
+    :param view: The view-window store, says whether the graph was downsampled
+    :param time_range: [t0, t1] typed into the range inputs, used instead of the selection when both are filled in
+    :return: the selected rows, in time order
     """
-    df = pd.read_json(data)  # read the data from the local storage
+    if view and view.get('overview'):
+        return df.iloc[0:0]  # the graph shows the summaries of a site that is still loading, nothing to select
+
+    if time_range is not None and has_time_range(*time_range):
+        try:
+            # the frame is sorted by datetime, so a time range is two binary searches and a slice
+            return rows_in_window(df, sorted(time_range, key=pd.Timestamp)).copy()
+        except ValueError:
+            print(f"ERROR: couldn't read the time range {time_range}, try something like 2019-06-01 12:00")
+            return df.iloc[0:0]
+
+    if selection is not None and 'range' in selection:
+        # a box is a time range plus a pressure range, find its rows by binary search rather than by the points sent
+        return rows_in_region(df, selection).copy()
+
+    if view and view.get('downsampled') and has_region(selection):
+        # the graph only drew some of the points, so take every row inside the lasso rather than the drawn ones
+        return rows_in_region(df, selection).copy()
 
     if selection is not None:
-        datetimes_selected = []  # initialize empty lists, datetimes are the x-values
-        pressures_selected = []  # pressures are the y-values
-        # Add points from the selection
-        for point in selection['points']:
-            datetimes_selected.append(point['x'])
-            pressures_selected.append(point['y'])
-        # Search data for datetime matches
-        datetimes_series = df['datetime'].isin(datetimes_selected)  # returns a boolean series
-        matched_datetimes = df[datetimes_series]  # returns a dataframe of only the matched datetimes
-        # Search datetime matches for y-value matches
-        pressures_series = matched_datetimes['pressure_hobo'].isin(pressures_selected)  # returns a boolean series
-        matched_points = matched_datetimes[pressures_series]  # returns a dataframe of only the matched pressures
-
-        return matched_points  # return the dataframe of points that matched both x and y
+        return rows_from_points(df, selection).copy()  # each point carries its row id, so no searching is needed
+
+    return df.iloc[0:0]
+
+
+def session_log(data, history):
+    """
+        Returns the session's edit log (see edit_log.py) if it has recorded exactly the changes in the change log. The
+        browser side store has none, and the server side store loses it if the session was spilled to disk.
+    :param data: session store token for the pressure data
+    :param history: local storage of the change log
+    :return: EditLog or None
+    """
+    log = store.edit_log(data)
+    if log is not None and log.base + log.position == len(history) - 1:  # the first entry is the site being loaded
+        return log
+    return None
+
+
+def replay_changes(data, changes, base=0):
+    """
+        Applies saved changes to the working data again, eg. the ones made after a resumed session's checkpoint. In the
+        server side store they go through the session's edit log, so they can still be undone exactly.
+    :param data: session store token for the pressure data
+    :param changes: change log entries to apply, oldest first
+    :param base: number of changes already applied to the stored frame
+    :return: the new token
+    """
+    log = store.edit_log(data)
+    if log is None:
+        df = store.get(data)
+        for change in changes:
+            df = Change(change).apply(df)
+        return store.put(data, df)
+
+    log.base = base
+    for change in changes:
+        log_change(log, change)
+    return store.commit(data, None)
+
+
+def log_change(log, change):
+    """
+        Applies a change log entry through an edit log
+    :param log: the session's EditLog
+    :param change: change log entry (json string)
+    :return: the edit for store.commit
+    """
+    change = Change(change)
+    changes_df = change.changes_for(log.frame)
+    positions, found = matching_positions(log.frame, changes_df)
+    rows = log.frame.index[positions]
+    if change.type == 'delete':
+        return log.delete(rows)
+    return log.set_values(rows, log.frame['pressure_hobo'].values[positions]
+                          + changes_df['pressure_hobo'].values[found])
+
+
+def add_to_pressure(data, df, change_df, history):
+    """
+        Adds the pressures in change_df to the same rows of the working data and stores the result. In the server side
+        store this goes through the session's edit log, so it can be undone exactly.
+    :param data: session store token for the pressure data
+    :param df: the working dataframe from the session store
+    :param change_df: the selected rows, with the amount to add to each in pressure_hobo
+    :param history: local storage of the change log, before this change
+    :return: the new token
+    """
+    log = session_log(data, history)
+    if log is None:  # the browser holds the data, undo goes through the change log instead
+        return store.put(data, apply_changes(df, change_df), edit={'kind': 'update', 'rows': change_df.index})
+
+    values = df.loc[change_df.index, 'pressure_hobo'].values + change_df['pressure_hobo'].values
+    return store.commit(data, log.set_values(change_df.index, values))
+
+
+def delete_rows(data, df, change_df, history):
+    """
+        Deletes the rows in change_df from the working data and stores the result. In the server side store the rows
+        are only marked deleted in the session's edit log, so undoing it doesn't have to put them back.
+    :param data: session store token for the pressure data
+    :param df: the working dataframe from the session store
+    :param change_df: the selected rows
+    :param history: local storage of the change log, before this change
+    :return: the new token
+    """
+    log = session_log(data, history)
+    if log is None:
+        df.drop(change_df.index, axis=0, inplace=True)
+        return store.put(data, df, edit={'kind': 'delete', 'rows': change_df.index})
+
+    return store.commit(data, log.delete(change_df.index))
 
 
 @app.callback(
     Output('memory-output', 'data'),
     Output('history', 'data'),
+    Output('redo-history', 'data'),
     Input('shift_button', 'n_clicks'),
     State('memory-output', 'data'),
     State('history', 'data'),
     State('shift_amount', 'value'),
-    State('indicator-graphic', 'selectedData')
+    State('indicator-graphic', 'selectedData'),
+    State('view-window', 'data'),
+    State('range_start', 'value'),
+    State('range_end', 'value')
 )
-def shift_selected_data(n_clicks, data, history, shift, selectedData):
+def shift_selected_data(n_clicks, data, history, shift, selectedData, view, t0, t1):
     """
         This function is called when the user clicks the shift button. It will shift the selected data by the amount
         specified in the shift_amount input box. It will also update the change log.
 
     :param n_clicks: used to determine if the button has been clicked
-    :param data: local storage of the pressure data
+    :param data: session store token for the pressure data
     :param history: local storage of the change log
     :param shift: the amount to shift the data by
     :param selectedData: the currently selected data
-    :return: the updated data and change log
+    :param view: the visible time window of the graph
+    :param t0: start of the typed in time range, if any
+    :param t1: end of the typed in time range, if any
+    :return: the updated data, change log and (emptied) redo list
     """
-    if n_clicks > 0 and shift is not None and selectedData is not None:
-        data_df = pd.read_json(data)  # read the data from the local storage
-        change_df = dataframe_from_selection(data, selectedData)  # get the selected data as a dataframe
+    if n_clicks > 0 and shift is not None and (selectedData is not None or has_time_range(t0, t1)):
+        data_df = store.get(data)  # read the data from the session store
+        change_df = dataframe_from_selection(data_df, selectedData, view, [t0, t1])  # get the selected data
+        if change_df.empty:
+            raise PreventUpdate  # nothing in the selection
 
         if shift is not None:
             change_df['pressure_hobo'] = shift  # set the pressure column to the shift amount
-            changed_df = apply_changes(data_df, change_df)  # apply the changes to the data
+            data = add_to_pressure(data, data_df, change_df, history)  # apply the changes to the data
 
             start = change_df.iloc[0, 1]  # get the start and end values for the change log
             end = change_df.iloc[-1, 1]
 
             dir = "up" if (shift > 0) else "down"  # determine if the shift was up or down
             change_log = log_changes(history, "shift", change_df,
-                                     f"shifted {dir} by {abs(shift)} from {start} to {end}")
+                                     f"shifted {dir} by {abs(shift)} from {start} to {end}", data=data_df)
 
-            return changed_df.to_json(), change_log  # return the updated data and change log
+            # return the updated data and change log, there is nothing to redo after a new change
+            return data, change_log, []
     else:
         pass
 
@@ -219,42 +600,51 @@ def shift_selected_data(n_clicks, data, history, shift, selectedData):
 @app.callback(
     Output('memory-output', 'data'),
     Output('history', 'data'),
+    Output('redo-history', 'data'),
     Input('compress_button', 'n_clicks'),
     State('memory-output', 'data'),
     State('history', 'data'),
     State('compression_factor', 'value'),
-    State('indicator-graphic', 'selectedData')
+    State('indicator-graphic', 'selectedData'),
+    State('view-window', 'data'),
+    State('range_start', 'value'),
+    State('range_end', 'value')
 )
-def compress_selected_data(n_clicks, data, history, expcomp, selectedData):
+def compress_selected_data(n_clicks, data, history, expcomp, selectedData, view, t0, t1):
     """
         This function is called when the user clicks the compress button. It will compress the selected data by the
         amount specified in the compression_factor input box. It will also update the change log.
 
     :param n_clicks:  used to determine if the button has been clicked
-    :param data:  local storage of the pressure data
+    :param data:  session store token for the pressure data
     :param history:  local storage of the change log
     :param expcomp:  the amount to expand/compress the data by
     :param selectedData:  the currently selected data
-    :return:  the updated data and change log
+    :param view:  the visible time window of the graph
+    :param t0:  start of the typed in time range, if any
+    :param t1:  end of the typed in time range, if any
+    :return:  the updated data, change log and (emptied) redo list
     """
-    data_df = pd.read_json(data)  # read the data from the local storage
-    if n_clicks > 0 and expcomp is not None and selectedData is not None:
-        change_df = dataframe_from_selection(data, selectedData)  # get the selected data as a dataframe
+    if n_clicks > 0 and expcomp is not None and (selectedData is not None or has_time_range(t0, t1)):
+        data_df = store.get(data)  # read the data from the session store
+        change_df = dataframe_from_selection(data_df, selectedData, view, [t0, t1])  # get the selected data
+        if change_df.empty:
+            raise PreventUpdate  # nothing in the selection
 
         if expcomp is not None:
             change_df_mean = stat.mean(change_df['pressure_hobo'])  # get the mean of the selected data
 
             #  shift down by the expansion/compression factor multiplied by the height above the mean (whew, confusing)
             change_df['pressure_hobo'] = -(change_df['pressure_hobo'] - change_df_mean) / expcomp
-
-            changed_df = apply_changes(data_df, change_df)  # apply the changes to the data
+            data = add_to_pressure(data, data_df, change_df, history)  # apply the changes to the data
 
             start = change_df.iloc[0, 1]  # get the start and end values for the change log
             end = change_df.iloc[-1, 1]
             change_log = log_changes(history, "compression", change_df,
                                      f"compressed by factor of {expcomp} around the mean of {change_df_mean} from {start} to {end}")
 
-            return changed_df.to_json(), change_log  # return the updated data and change log
+            # return the updated data and change log, there is nothing to redo after a new change
+            return data, change_log, []
     else:
         pass
 
@@ -262,109 +652,217 @@ def compress_selected_data(n_clicks, data, history, expcomp, selectedData):
 @app.callback(
     Output('memory-output', 'data'),
     Output('history', 'data'),
+    Output('redo-history', 'data'),
     Input('delete', 'n_clicks'),
     State('indicator-graphic', 'selectedData'),
     State('memory-output', 'data'),
-    State('history', 'data')
+    State('history', 'data'),
+    State('view-window', 'data'),
+    State('range_start', 'value'),
+    State('range_end', 'value')
 )
-def delete_button(n_clicks, selection, data, history):
+def delete_button(n_clicks, selection, data, history, view, t0, t1):
     """
         This function is called when the user clicks the delete button. It will delete the selected data from the
         graph and update the change log.
 
     :param n_clicks:  used to determine if the button has been clicked
     :param selection:  the currently selected data
-    :param data:  local storage of the pressure data
+    :param data:  session store token for the pressure data
     :param history: local storage of the change log
-    :return:  the updated data and change log
+    :param view:  the visible time window of the graph
+    :param t0:  start of the typed in time range, if any
+    :param t1:  end of the typed in time range, if any
+    :return:  the updated data, change log and (emptied) redo list
     """
 
-    # Read in dataframe from local JSON store.
-    df = pd.read_json(data)
+    # Read in dataframe from the session store.
+    df = store.get(data)
 
-    if selection is not None:
-        change_df = dataframe_from_selection(data, selection)  # get the selected data as a dataframe
+    if selection is not None or has_time_range(t0, t1):
+        change_df = dataframe_from_selection(df, selection, view, [t0, t1])  # get the selected data as a dataframe
+        if change_df.empty:
+            raise PreventUpdate  # nothing in the selection
 
-        # remove the data points from the data frame
-        df.drop(change_df.index, axis=0, inplace=True)
+        data = delete_rows(data, df, change_df, history)  # remove the data points from the data frame
 
         start = change_df.iloc[0, 1]  # get the start and end values for the change log
         end = change_df.iloc[-1, 1]
         change_log = log_changes(history, "delete", change_df,
                                  f"deleted {change_df.shape[0]} points from {start} to {end}")
 
-        # Save the data into the Local json store and trigger the graph update.
-        return df.to_json(), change_log
+        # Return the new token to trigger the graph update, there is nothing to redo after a new change
+        return data, change_log, []
     else:
         pass
 
 
 @app.callback(
     Input('memory-output', 'data'),
-    # State('discharge', 'data'),
+    Input('indicator-graphic', 'relayoutData'),
+    Input('discharge-toggle', 'value'),
+    Input('overview-site', 'data'),
+    State('view-window', 'data'),
+    State('session-key', 'data'),
     Output('indicator-graphic', 'figure'),
-    Output('update-table', 'children'))
-def update_on_new_data(data):
+    Output('view-window', 'data'),
+    Output('render-stats', 'children'))
+def update_on_new_data(data, relayoutData, show_discharge, overview, view, session):
     """
-        This function is called when the data is updated. It will update the graph and the table.
-
-    :param data: local storage of the pressure data
-    :return: the updated graph and table
+        This function is called when the data is updated, when the user zooms or pans the graph, when the discharge
+        overlay is switched on or off, or when a site starts loading. It will update the graph (the table pages itself,
+        see update_table). After an edit, only the changed points are sent to the graph when possible; after a zoom,
+        just the visible time window is redrawn, at full resolution once few enough points are in view. Switching the
+        overlay only adds or removes its trace. While a site loads, its summaries are drawn instead (see summaries.py).
+
+    :param data: session store token for the pressure data
+    :param relayoutData: the graph's new axis ranges
+    :param show_discharge: whether the discharge overlay is switched on
+    :param overview: the site that is loading
+    :param view: the visible time window of the graph and the row ids drawn by each trace
+    :param session: the site and user of the loaded session
+    :return: the updated graph, the new view, and how long the graph update took
     """
+    start = time.perf_counter()
+    if ctx.triggered_id == 'overview-site' or (view and view.get('overview') and ctx.triggered_id != 'memory-output'):
+        return update_overview(overview, relayoutData, view, start)  # the site's readings haven't arrived yet
+
+    if data is None:
+        raise PreventUpdate
+
+    df = store.get(data)  # Read in dataframe from the session store
+    window = view['window'] if view else None
+    overlay = bool(show_discharge and session)  # discharge is only queried while the overlay is on
+
+    if ctx.triggered_id == 'discharge-toggle':
+        if not view or bool(view.get('discharge')) == overlay:
+            raise PreventUpdate  # nothing drawn yet, or the overlay is already as asked
+        discharge = load_discharge(session['site_id']) if overlay else None
+        patch = Patch()
+        if discharge is not None:
+            patch['data'].append(discharge_trace(discharge, df, window))
+            patch['layout']['yaxis2'] = DISCHARGE_AXIS
+        else:
+            del patch['data'][len(view['traces'])]  # the overlay is always drawn after the pressure traces
+        return patch, dict(view, discharge=discharge is not None), render_report("discharge overlay", patch, start)
+
+    if ctx.triggered_id == 'indicator-graphic':
+        window = window_from_relayout(relayoutData)
+        if window is False:
+            raise PreventUpdate  # not a change of the time axis (eg. a selection), nothing to redraw
+        discharge = load_discharge(session['site_id']) if overlay else None
+        fig, view = build_figure(df, window, discharge=discharge)
+        return fig, view, render_report("zoom redraw", fig, start)
+
+    patched = patch_figure(df, view, store.last_edit(data))  # only touch the points the edit changed
+    if patched is not None:
+        fig, view = patched
+        return fig, view, render_report("partial update", fig, start)
+
+    discharge = load_discharge(session['site_id']) if overlay else None
+    fig, view = build_figure(df, window, discharge=discharge)  # a scatterplot, downsampled if there are many points
+
+    # return the graph, the table keeps its own page
+    return fig, view, render_report("full redraw", fig, start)
+
+
+def update_overview(overview, relayoutData, view, start):
+    """
+        Draws the summaries of a site that is still loading, at a finer level as the user zooms in, and the raw
+        readings once few enough are in view. Those are read for the window alone, the points can't be edited until
+        the whole site is in.
+    :param overview: the site that is loading
+    :param relayoutData: the graph's new axis ranges
+    :param view: the view of the graph currently shown
+    :param start: time.perf_counter() from when the update started
+    :return: the overview figure, its view, and how long it took
+    """
+    window = view['window'] if view else None
+    if ctx.triggered_id == 'indicator-graphic':
+        window = window_from_relayout(relayoutData)
+        if window is False:
+            raise PreventUpdate
+    elif ctx.triggered_id != 'overview-site':
+        raise PreventUpdate  # eg. the discharge switch, it is drawn once every reading is in
+
+    summary, level = summaries.overview(overview['site_id'], window) if summaries and overview else (None, None)
+    if summary is None:
+        raise PreventUpdate  # not summarized yet, the graph waits for the readings
+    if window and level == "hour" and 0 < summary['count'].sum() <= WINDOW_ROWS:
+        with pool.cursor() as cursor:
+            in_view = summaries.window_frame(cursor, overview['site_id'], window)
+        fig, view = build_figure(in_view, window)
+        fig.update_layout(title=f"{len(in_view)} readings in view, loading the rest of the site to edit them...")
+        view['overview'] = "window"  # the session doesn't hold these rows yet, so nothing can be selected
+        return fig, view, render_report("window readings", fig, start)
+
+    fig, view = build_overview(summary, level, window)
+    return fig, view, render_report(f"{level} overview", fig, start)
+
+
+def load_discharge(site_id):
+    """
+        Gets a site's discharge readings through the same connection pool and site cache as the pressure data
+    :param site_id: three char site id that matches the database
+    :return: dataframe of the site's discharge readings with a value, sorted by datetime
+    """
+    with pool.cursor() as cursor:
+        discharge = site_cache.get(cursor, site_id, "discharge")  # only queried again if the site's batches changed
+    discharge['discharge_measured'] = pd.to_numeric(discharge['discharge_measured'].replace('', np.nan),
+                                                    errors='coerce')
+    return discharge.dropna(subset=['discharge_measured'])
 
-    # Read in dataframe from JSON
-    df = pd.read_json(data)
-
-    # discharge = pd.read_json(discharge)
-
-    # Convert batch_id to strings
-    df['batch_id'] = df['batch_id'].apply(lambda x: str(x))  # TODO theres a better way to do this
-
-    # discharge['batch_id'] = df['batch_id'].apply(lambda x: str(x))
-
-    # Create a scatterplot figure from the dataframe with discharge data
-    # figure = px.scatter(df, x=df.datetime, y=df.pressure_hobo,
-    #                     color=df.batch_id)
 
-    # Create figure with secondary y-axis
-    # fig = make_subplots(specs=[[{"secondary_y": True}]])
-    #
-    # # Add traces
-    # fig.add_trace(
-    #     go.Scatter(x=df.datetime, y=df.pressure_hobo,  # replace with your own data source
-    #                name="pressure", mode='markers'),
-    #     secondary_y=False
-    # )
-    #
-    # fig.add_trace(
-    #     go.Scatter(x=discharge.datetime, y=discharge.discharge_measured, name="discharge", mode="lines+markers"),
-    #     secondary_y=True,
-    # )
+def render_report(kind, fig, start):
+    """
+        Describes how long a graph update took to build and how many points it draws. The figure isn't serialized
+        again to weigh it, start the app with PRESSUREGUI_METRICS for the bytes sent (see instrumentation.py).
+    :param kind: what kind of update it was
+    :param fig: the figure or Patch being sent
+    :param start: time.perf_counter() from when the update started
+    :return: text for the render-stats element
+    """
+    build_ms = (time.perf_counter() - start) * 1000
+    if isinstance(fig, Patch):
+        return f"{kind}: built in {build_ms:.0f} ms, only the changes sent"
+    points = sum(len(trace.x) for trace in fig.data if trace.x is not None)
+    return f"{kind}: built in {build_ms:.0f} ms, {points} points drawn"
 
-    fig = px.scatter(df, x=df.datetime, y=df.pressure_hobo, color=df.batch_id)  # create a scatterplot figure
 
-    # create a DashTable from the data
-    table = html.Div(
-        [
-            dash_table.DataTable(
-                data=df.to_dict('rows'),
-                columns=[{'id': x, 'name': x} for x in df.columns],
-            )
-        ]
-    )
+@app.callback(
+    Input('history', 'data'),
+    Input('redo-history', 'data'),
+    Input('memory-output', 'data'),
+    State('session-key', 'data'),
+    Output('autosave-status', 'children')
+)
+def autosave_session(history, redo, data, key):
+    """
+        This function is called whenever the change log or the data changes. It queues whatever changed to be written
+        to the autosave file, the writing itself happens in the background.
+    :param history:  local storage of the change log
+    :param redo:  local storage of the undone changes
+    :param data:  session store token for the pressure data
+    :param key:  the site and user the session belongs to
+    :return:  the autosave status line
+    """
+    if autosave is None or not key or not history or data is None:
+        raise PreventUpdate
 
-    # return objects into the graph and table
-    return fig, table
+    autosave.save(saved_as(key), key['user'], history, redo or [], store.get(data))
+    return f"Autosaved {len(history) - 1} changes for {key['user']} at {time.strftime('%H:%M:%S')}"
 
 
 @app.callback(
     Input('history', 'data'),
+    Input('redo-history', 'data'),
     Output('history_log', 'children')
 )
-def display_changelog(history):
+def display_changelog(history, redo):
     """
         This function is called when the change log is updated. It will update the change log display.
     :param history:  local storage of the change log
+    :param redo:  local storage of the undone changes, the next one to redo last
     :return:  the updated change log display
     """
 
@@ -374,45 +872,185 @@ def display_changelog(history):
             history = json.loads(history)  # parse the json string
         except:
             print("ERROR: couldn't parse json history string, save your work and run while you still can")
-    for change in history:
-        change = Change(change)  # create a change object from the dictionary
+    timeline = history + list(reversed(redo or []))  # everything done, then everything that can be redone in order
+    for step, change in enumerate(timeline):
+        change = Change(change)  # create a change object from the dictionary, only the description is read
+        undone = step >= len(history)
         children.append(
             dbc.AccordionItem([
-                change.description  # add the description to the accordion item
-            ], title=change.type)  # add the type to the accordion title
+                change.description,  # add the description to the accordion item
+                html.Br(),
+                dbc.Button("Redo up to here" if undone else "Go back to here",
+                           id={'type': 'history-jump', 'index': step}, color="link", size="sm", n_clicks=0),
+            ], title=f"{change.type} (undone)" if undone else change.type)  # add the type to the accordion title
         )
 
     return children  # return the change log display
 
 
+def move_history(data, history, redo, step):
+    """
+        Undoes or redoes changes until just the first step changes after loading the site are applied. The session's
+        edit log does it when there is one, taking time proportional to the rows the steps touched, otherwise the
+        change records are undone or replayed one by one.
+
+    :param data: session store token for the pressure data
+    :param history: local storage of the change log, the load ("init") first
+    :param redo: local storage of the undone changes, the next one to redo last
+    :param step: number of changes to have applied
+    :return: the new token, change log and redo list
+    """
+    timeline = history + list(reversed(redo))
+    step = min(max(step, 0), len(timeline) - 1)
+    if step == len(history) - 1:
+        raise PreventUpdate  # already there
+
+    log = session_log(data, history)
+    if log is not None and step >= log.base:
+        end = log.base + len(log)  # the furthest step the log has recorded
+        if step == len(history) - 2:
+            edit = log.undo()
+        elif step == len(history) and step <= end:
+            edit = log.redo()
+        elif step <= end:
+            edit = log.jump(step - log.base)  # from the nearest checkpoint
+        else:  # redoing changes undone before the session was resumed, the log hasn't seen them yet
+            edit = log.jump(len(log)) if log.position < len(log) else None
+            for change in timeline[end + 1:step + 1]:
+                edit = log_change(log, change)
+            if step > len(history):
+                edit = None  # several changes, redraw everything
+        return store.commit(data, edit), timeline[:step + 1], list(reversed(timeline[step + 1:]))
+
+    df = store.get(data)
+    edit = None
+    for change in reversed(timeline[step + 1:len(history)]):  # undo, newest first
+        change = Change(change)
+        edit = {'kind': 'insert' if change.type == 'delete' else 'update', 'rows': change.changes_for(df).index}
+        df = change.revert(df)
+    for change in timeline[len(history):step + 1]:  # redo, oldest first
+        change = Change(change)
+        edit = {'kind': 'delete' if change.type == 'delete' else 'update', 'rows': change.changes_for(df).index}
+        df = change.apply(df)
+    if abs(step - (len(history) - 1)) > 1:
+        edit = None  # several changes, redraw everything
+
+    return store.put(data, df, edit=edit), timeline[:step + 1], list(reversed(timeline[step + 1:]))
+
+
 @app.callback(
     Input('undoChange', 'n_clicks'),
     State('history', 'data'),
+    State('redo-history', 'data'),
     State('memory-output', 'data'),
     Output('memory-output', 'data'),
-    Output('history', 'data')
+    Output('history', 'data'),
+    Output('redo-history', 'data')
 )
-def undo(n_clicks, history, data):
+def undo(n_clicks, history, redo, data):
     """
-        This function is called when the user clicks the undo button. It will undo the last change and update the
-        change log.
+        This function is called when the user clicks the undo button. It will undo the last change and move it to
+        the redo list.
 
     :param n_clicks: used to determine if the button has been clicked
     :param history:  local storage of the change log
-    :param data:  local storage of the pressure data
-    :return:  the updated data and change log
+    :param redo:  local storage of the undone changes
+    :param data:  session store token for the pressure data
+    :return:  the updated data, change log and redo list
     """
     # if already initialized
     if len(history) > 1:  # there has to be at least one change to undo and one to fall back on
-        change = Change(history.pop())  # get the last change from the history
-        data = change.undoFunc(data, change.changes_df)  # undo the change
-        return data.to_json(), history  # return the updated data and change log
+        return move_history(data, history, redo or [], len(history) - 2)
     else:
-        pass
+        raise PreventUpdate
+
+
+@app.callback(
+    Input('redoChange', 'n_clicks'),
+    State('history', 'data'),
+    State('redo-history', 'data'),
+    State('memory-output', 'data'),
+    Output('memory-output', 'data'),
+    Output('history', 'data'),
+    Output('redo-history', 'data')
+)
+def redo(n_clicks, history, redo, data):
+    """
+        This function is called when the user clicks the redo button. It will apply the last undone change again.
+
+    :param n_clicks: used to determine if the button has been clicked
+    :param history:  local storage of the change log
+    :param redo:  local storage of the undone changes
+    :param data:  session store token for the pressure data
+    :return:  the updated data, change log and redo list
+    """
+    if redo:
+        return move_history(data, history, redo, len(history))
+    else:
+        raise PreventUpdate
+
+
+@app.callback(
+    Input({'type': 'history-jump', 'index': ALL}, 'n_clicks'),
+    State('history', 'data'),
+    State('redo-history', 'data'),
+    State('memory-output', 'data'),
+    Output('memory-output', 'data'),
+    Output('history', 'data'),
+    Output('redo-history', 'data')
+)
+def jump_in_history(n_clicks, history, redo, data):
+    """
+        This function is called when the user clicks "Go back to here" or "Redo up to here" on a change in the change
+        log. It will undo or redo changes until that change is the last one applied.
+
+    :param n_clicks: clicks of every change's button
+    :param history:  local storage of the change log
+    :param redo:  local storage of the undone changes
+    :param data:  session store token for the pressure data
+    :return:  the updated data, change log and redo list
+    """
+    if not ctx.triggered_id or not ctx.triggered[0]['value']:
+        raise PreventUpdate  # the buttons were just drawn, not clicked
+    return move_history(data, history, redo or [], ctx.triggered_id['index'])
+
+
+@app.server.route("/metrics")
+def show_metrics():
+    """
+        Sums up the instrumented calls per function (see instrumentation.py), with the database and site cache
+        counters. Only there when the app was started with PRESSUREGUI_METRICS set.
+    :return: JSON of functions, database and site_cache
+    """
+    if not metrics_enabled:
+        abort(404)
+    database = pool.stats()
+    database['recent'] = database['recent'][-10:]
+    summary = {"functions": metrics.summary(), "database": database, "site_cache": site_cache.stats()}
+    return Response(json.dumps(summary, default=str), mimetype="application/json")  # slowest function first
+
+
+@app.server.route("/export/<session>/<filename>")
+def stream_export(session, filename):
+    """
+        Sends a session's working data as a CSV file, formatted and sent a chunk of rows at a time so the whole file is
+        never built in memory. The export button points a hidden frame here.
+    :param session: the session id from the store token, its version is in the query string
+    :param filename: name for the downloaded file
+    :return: a streamed CSV response, or 404 if the session is gone or was edited since the export was asked for
+    """
+    token = {"session": session, "version": request.args.get("version", type=int)}
+    try:
+        pressure_table = store.snapshot(token)  # edits made while the file streams don't end up half in it
+    except SessionExpired:
+        abort(404)
+    return Response(stream_with_context(csv_chunks(pressure_table)), mimetype="text/csv",
+                    headers={"Content-Disposition": f'attachment; filename="{secure_filename(filename)}"'})
 
 
 @app.callback(
     Output('download-csv', 'data'),
+    Output('export-frame', 'src'),
     Output('changes-csv', 'data'),
     Input('exportDF', 'n_clicks'),
     State('memory-output', 'data'),
@@ -423,21 +1061,28 @@ def undo(n_clicks, history, data):
 def export(n_clicks, data, changes, filename):
     """
         This function is called when the user clicks the export button. It will export the data to CSV and the change
-        log to a JSON file.
+        log to a JSON file. With the server side store, the CSV is streamed by stream_export through a hidden frame
+        instead of being built here and sent through the callback.
     :param n_clicks:  used to determine if the button has been clicked
-    :param data:  local storage of the pressure data
+    :param data:  session store token for the pressure data
     :param changes:  local storage of the change log
     :param filename:  the name of the file to export to
-    :return:  a CSV file of the data and a JSON file of the change log
+    :return:  a CSV file of the data (or the address to stream it from) and a JSON file of the change log
     """
 
     if data is not None:
-        pressure_table = pd.read_json(data)  # read in the data from the local storage
+        filename = filename or "export"
         changestr = json.dumps(changes)  # convert the change log to a string
+        changes_file = dict(content=changestr, filename=f"{filename}.json")
+
+        if isinstance(store, SessionStore):
+            # the version makes every export a new address, so the frame loads it again
+            src = f"/export/{data['session']}/{quote(filename)}.csv?version={data['version']}&n={n_clicks}"
+            return no_update, src, changes_file
 
+        pressure_table = store.get(data)  # read in the data from the browser's store
         # return the data as a CSV file and the change log as a JSON file to the dcc.Download component
-        return dcc.send_data_frame(pressure_table.to_csv, f"{filename}.csv"), \
-               dict(content=changestr, filename=f"{filename}.json")
+        return dcc.send_data_frame(pressure_table.to_csv, f"{filename}.csv"), no_update, changes_file
 
 
 if __name__ == '__main__':
@@ -0,0 +1,231 @@
+# Keeps every site's cleaning session in a local SQLite file next to the app, so a refresh or a crash doesn't lose it.
+#
+# The change log is saved one change per row, keyed by site and user, along with how many of the changes are applied
+# (the rest were undone and can be redone). Every so often the working frame itself is saved as a checkpoint, so a
+# session can be resumed by loading the newest checkpoint and replaying only the changes made after it.
+#
+# Callbacks never wait for the disk: save() only works out what changed and queues it, and a writer thread commits
+# whatever has queued up in one transaction. The file and the writer are only created the first time a session is saved
+# or resumed, so importing the app leaves the disk alone.
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from codec import encode_frame, decode_frame
+
+# Changes between checkpoints of the working frame
+CHECKPOINT_EVERY = 20
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        site_id TEXT, user TEXT, position INTEGER, updated REAL, PRIMARY KEY (site_id, user));
+    CREATE TABLE IF NOT EXISTS changes (
+        site_id TEXT, user TEXT, step INTEGER, change TEXT, PRIMARY KEY (site_id, user, step));
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        site_id TEXT, user TEXT, step INTEGER, frame TEXT, PRIMARY KEY (site_id, user, step));
+"""
+
+
+class Autosave:
+    """
+        Saves edit sessions to a SQLite sidecar file in the background
+
+        Attributes
+        ----------
+        path : pathlib.Path
+            The sidecar database file
+        checkpoint_every : int
+            Changes between saved copies of the working frame
+        linger : float
+            Seconds the writer waits for more work before committing, so bursts of edits share a transaction
+        saves, transactions : int
+            Counters, how many saves were queued and how many transactions wrote them
+
+        Methods
+        -------
+        save(site_id, user, history, redo, df)
+            Queues whatever changed since the last save of this site and user
+        resume(site_id, user)
+            Loads the saved session, or returns None if there isn't one
+        forget(site_id, user)
+            Deletes the saved session, so the next save starts a new one
+        flush()
+            Waits until everything queued is written
+        close()
+            Writes what is queued and stops the writer
+    """
+
+    def __init__(self, path, checkpoint_every=CHECKPOINT_EVERY, linger=0.25):
+        self.path = Path(path)
+        self.checkpoint_every = checkpoint_every
+        self.linger = linger
+        self.saves = 0
+        self.transactions = 0
+
+        self._lock = threading.Lock()
+        self._saved = {}  # (site_id, user) -> the timeline (changes done, then undone) as last saved
+        self._checkpoints = {}  # (site_id, user) -> steps with a saved frame
+        self._queue = queue.Queue()
+        self._writer = None  # started by the first save, resume or forget
+
+    def _start(self):
+        with self._lock:
+            if self._writer is not None:
+                return
+            with sqlite3.connect(self.path) as connection:
+                connection.executescript(SCHEMA)
+            self._writer = threading.Thread(target=self._run, name="autosave", daemon=True)
+            self._writer.start()
+        atexit.register(self.close)
+
+    def save(self, site_id, user, history, redo, df):
+        """
+            Queues the session's changes for writing. Only the changes that differ from the last save are written, and
+            the frame is checkpointed every checkpoint_every changes.
+        :param site_id: the site being cleaned
+        :param user: who is cleaning it
+        :param history: the change log, the load ("init") first
+        :param redo: the undone changes, the next one to redo last
+        :param df: the working dataframe after the changes in history
+        """
+        self._start()
+        key = (site_id, user)
+        timeline = history + list(reversed(redo))
+        position = len(history) - 1
+
+        with self._lock:
+            saved = self._saved.get(key)
+            same = 0  # length of the part of the timeline that is already saved
+            if saved is not None:
+                while same < min(len(saved), len(timeline)) and saved[same] == timeline[same]:
+                    same += 1
+            self._saved[key] = timeline
+
+            work = []
+            if saved is None or same < len(saved):  # changes were undone and replaced, or nothing is known yet
+                work.append(("truncate", key, same))
+                self._checkpoints[key] = {step for step in self._checkpoints.get(key, ()) if step < same}
+            if same < len(timeline):
+                work.append(("changes", key, [(step, timeline[step]) for step in range(same, len(timeline))]))
+            work.append(("position", key, position, time.time()))
+
+            if position % self.checkpoint_every == 0 and position not in self._checkpoints.setdefault(key, set()):
+                self._checkpoints[key].add(position)
+                work.append(("checkpoint", key, position, df.copy()))  # encoded by the writer, off the callback
+            self.saves += 1
+
+        self._queue.put(work)
+
+    def resume(self, site_id, user):
+        """
+            Loads a saved session
+        :param site_id: the site
+        :param user: the user
+        :return: None if nothing was saved, otherwise (frame, step, history, redo): the newest checkpoint at or
+            before the saved position, the step it was taken at, and the change log and redo list. The changes
+            history[step + 1:] still have to be replayed onto the frame.
+        """
+        self._start()
+        self.flush()
+        key = (site_id, user)
+        with sqlite3.connect(self.path) as connection:
+            row = connection.execute("SELECT position FROM sessions WHERE site_id = ? AND user = ?", key).fetchone()
+            if row is None:
+                return None
+            position, = row
+            timeline = [change for change, in connection.execute(
+                "SELECT change FROM changes WHERE site_id = ? AND user = ? ORDER BY step", key)]
+            checkpoint = connection.execute(
+                "SELECT step, frame FROM checkpoints WHERE site_id = ? AND user = ? AND step <= ? "
+                "ORDER BY step DESC LIMIT 1", (*key, position)).fetchone()
+            steps = [step for step, in connection.execute(
+                "SELECT step FROM checkpoints WHERE site_id = ? AND user = ?", key)]
+        if checkpoint is None or len(timeline) <= position:
+            print(f"ERROR: the saved session for {site_id} ({user}) is incomplete, starting over")
+            return None
+
+        with self._lock:
+            self._saved[key] = timeline
+            self._checkpoints[key] = set(steps)
+        step, frame = checkpoint
+        return decode_frame(frame), step, timeline[:position + 1], list(reversed(timeline[position + 1:]))
+
+    def forget(self, site_id, user):
+        """
+            Deletes a saved session, eg. when the user starts the site over from the database
+        :param site_id: the site
+        :param user: the user
+        """
+        self._start()
+        key = (site_id, user)
+        with self._lock:
+            self._saved.pop(key, None)
+            self._checkpoints.pop(key, None)
+        self._queue.put([("forget", key)])
+
+    def flush(self):
+        """
+            Waits until everything queued so far is written
+        """
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self):
+        """
+            Writes everything queued and stops the writer thread
+        """
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _run(self):
+        connection = sqlite3.connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.linger
+            while batch[-1] is not None:  # collect everything else that arrives while lingering
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                with connection:  # one transaction for the whole batch
+                    for work in batch:
+                        for task in work or []:
+                            self._write(connection, *task)
+                self.transactions += 1
+            except Exception as error:
+                print(f"ERROR: couldn't autosave to {self.path}: {error}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if batch[-1] is None:
+                connection.close()
+                return
+
+    @staticmethod
+    def _write(connection, kind, key, *args):
+        if kind == "truncate":
+            step, = args
+            connection.execute("DELETE FROM changes WHERE site_id = ? AND user = ? AND step >= ?", (*key, step))
+            connection.execute("DELETE FROM checkpoints WHERE site_id = ? AND user = ? AND step >= ?", (*key, step))
+        elif kind == "forget":
+            for table in ("sessions", "changes", "checkpoints"):
+                connection.execute(f"DELETE FROM {table} WHERE site_id = ? AND user = ?", key)
+        elif kind == "changes":
+            changes, = args
+            connection.executemany("INSERT OR REPLACE INTO changes VALUES (?, ?, ?, ?)",
+                                   [(*key, step, change) for step, change in changes])
+        elif kind == "position":
+            position, updated = args
+            connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", (*key, position, updated))
+        elif kind == "checkpoint":
+            step, df = args
+            connection.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                               (*key, step, encode_frame(df)))
@@ -0,0 +1,163 @@
+# Reapplies exported change logs to the current database without starting the app.
+#
+# `python batch_clean.py logs/ --db copy.db --out cleaned` reads every change log (the .json files the Export button
+# downloads) in logs/, queries each site's pressure data as it is now, replays the site's changes on it and writes the
+# cleaned data to cleaned/<site>.csv, the same CSV the Export button gives. Sites run in parallel in a process pool,
+# and a timing summary for every site is printed and written to cleaned/summary.csv.
+#
+# Changes find their rows by datetime, so they still land on the right readings after new batches were uploaded.
+# Changes for readings that no longer exist are skipped and counted in the summary.
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from changes import Change, matching_positions
+from database import ConnectionPool
+from run_query import get_pressure, working_frame
+
+# Columns of summary.csv
+SUMMARY_COLUMNS = ['site_id', 'status', 'rows', 'changes', 'skipped', 'query_s', 'replay_s', 'write_s', 'total_s']
+
+_pool = None  # each worker process opens its own connections
+
+
+def _open_pool(db_name):
+    global _pool
+    _pool = ConnectionPool(db_name, size=1)
+
+
+def read_logs(paths):
+    """
+        Reads change logs and groups their changes by site. A directory stands for every .json file in it. The site
+        of a log is taken from its "init" entry, or from the file name if it has none. Several logs for one site are
+        replayed one after the other, in the order given.
+    :param paths: change log files or directories of them
+    :return: dict of site id to the list of change log entries (json strings) to replay, oldest first
+    """
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.json")) if path.is_dir() else [path])
+
+    sites = {}
+    for file in files:
+        history = json.loads(file.read_text())
+        if isinstance(history, str):  # a log saved as one json string
+            history = json.loads(history)
+
+        site_id = file.stem
+        changes = []
+        for entry in history:
+            change = json.loads(entry)
+            if change['type'] == "init":  # "Initialized with site_id: BEN"
+                found = re.search(r"site_id: (\w+)", change['description'])
+                site_id = found.group(1) if found else site_id
+            else:
+                changes.append(entry)
+        sites.setdefault(site_id, []).extend(changes)
+    return sites
+
+
+def replay(df, changes):
+    """
+        Applies change log entries to a site's working frame
+    :param df: working dataframe from working_frame
+    :param changes: change log entries (json strings), oldest first
+    :return: the cleaned dataframe, and the number of changed rows that weren't found in it
+    """
+    skipped = 0
+    for entry in changes:
+        change = Change(entry)
+        if change.type not in ("delete", "shift", "compression"):
+            print(f"ERROR: can't replay a change of type {change.type!r}, skipping it")
+            continue
+        _, found = matching_positions(df, change.changes_for(df))
+        skipped += int((~found).sum())
+        df = change.apply(df)
+    return df, skipped
+
+
+def clean_site(site_id, changes, out_dir):
+    """
+        Queries one site, replays its changes and writes the cleaned CSV. Runs in a worker process.
+    :param site_id: three char site id that matches the database
+    :param changes: change log entries (json strings) for the site, oldest first
+    :param out_dir: directory to write <site_id>.csv to
+    :return: the site's row of the summary as a dict
+    """
+    summary = {'site_id': site_id, 'status': "ok", 'rows': 0, 'changes': len(changes), 'skipped': 0}
+    start = time.perf_counter()
+    try:
+        with _pool.cursor() as cursor:
+            df = working_frame(get_pressure(cursor, site_id))
+        queried = time.perf_counter()
+
+        df, summary['skipped'] = replay(df, changes)
+        replayed = time.perf_counter()
+
+        df.to_csv(Path(out_dir) / f"{site_id}.csv")
+        written = time.perf_counter()
+    except Exception as error:
+        summary['status'] = f"failed: {error}"
+        summary['total_s'] = time.perf_counter() - start
+        return summary
+
+    summary.update(rows=len(df), query_s=queried - start, replay_s=replayed - queried, write_s=written - replayed,
+                   total_s=written - start)
+    return summary
+
+
+def clean_sites(db_name, sites, out_dir, workers=None):
+    """
+        Cleans every site in a process pool
+    :param db_name: path to the database
+    :param sites: dict of site id to change log entries, from read_logs
+    :param out_dir: directory for the cleaned CSVs and summary.csv
+    :param workers: number of worker processes, None for one per CPU
+    :return: dataframe with one summary row per site, in site order
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_pool, initargs=(db_name,)) as executor:
+        futures = [executor.submit(clean_site, site_id, changes, out_dir) for site_id, changes in sites.items()]
+        for future in as_completed(futures):
+            summary = future.result()
+            if summary['status'] != "ok":
+                print(f"ERROR: {summary['site_id']} {summary['status']}")
+            rows.append(summary)
+
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS).sort_values('site_id', ignore_index=True)
+    summary.to_csv(Path(out_dir) / "summary.csv", index=False, float_format="%.3f")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay exported change logs against the current database")
+    parser.add_argument("logs", nargs="+", help="change log .json files, or directories of them")
+    parser.add_argument("--db", default="copy.db", help="path to the database (default: copy.db)")
+    parser.add_argument("--out", default="cleaned", help="directory for the cleaned CSVs (default: cleaned)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    sites = read_logs(args.logs)
+    if not sites:
+        print("ERROR: no change logs found")
+        return
+
+    start = time.perf_counter()
+    summary = clean_sites(args.db, sites, args.out, args.workers)
+    elapsed = time.perf_counter() - start
+
+    print(summary.to_string(index=False, float_format=lambda seconds: f"{seconds:.3f}"))
+    print(f"{(summary['status'] == 'ok').sum()} of {len(summary)} sites cleaned in {elapsed:.2f} s "
+          f"with {args.workers or os.cpu_count()} workers, {summary['total_s'].sum():.2f} s of work")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,537 @@
+# Opt-in checks and timings that are too slow (or too noisy) to run every time the app starts.
+#
+# Run everything with `python benchmarks.py`, or pick sections: `python benchmarks.py startup index`
+# The query, store and callbacks sections run on a synthetic database (see synth_db.py), so no copy of the real one is
+# needed. `--json results.json` also writes every number measured, and `--compare results.json` flags timings that got
+# slower than those of an earlier run (the exit status is 1 if any did).
+
+import argparse
+import functools
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Directory holding app.py, so the startup timings import the same modules the app does
+APP_DIR = Path(__file__).resolve().parent
+
+# Size of the synthetic database the query, store and callbacks sections use
+SYNTHETIC_SITES = 3
+SYNTHETIC_YEARS = 3
+
+# A timing counts as a regression when it is this much slower than the one it is compared with, and slower by more
+# than NOISE_MS, since a few milliseconds either way is just the machine being busy
+REGRESSION = 0.25
+NOISE_MS = 5
+
+# section -> {metric: value}, everything the sections measured, for --json
+RESULTS = {}
+
+
+def record(section, metric, value):
+    """
+        Keeps a measurement for the --json output. Timings are named with their unit, eg. "get_pressure_ms".
+    :param section: the benchmark section
+    :param metric: name of the measurement
+    :param value: the number
+    """
+    RESULTS.setdefault(section, {})[metric] = round(float(value), 6)
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_database(sites=SYNTHETIC_SITES, years=SYNTHETIC_YEARS):
+    """
+        Writes a synthetic database to a temporary directory, once per run
+    :param sites: number of sites
+    :param years: years of readings per site
+    :return: path of the database file
+    """
+    from synth_db import build
+
+    path = Path(tempfile.mkdtemp(prefix="pressuregui_bench_")) / "synthetic.db"
+    start = time.perf_counter()
+    readings = build(path, sites, years, indexes=True)
+    print(f"synthetic database: {readings} readings for {sites} sites in {time.perf_counter() - start:.1f} s")
+    return str(path)
+
+
+def time_import(module, repeats=5):
+    """
+        Measures the cold start of a module by importing it in a fresh interpreter
+    :param module: name of the module to import (eg. "index" or "app")
+    :param repeats: number of fresh interpreters to start, the fastest one is reported
+    :return: best wall time in seconds, or None if the import failed
+    """
+    baseline = _best_of(repeats, [sys.executable, "-c", "pass"])
+    best = _best_of(repeats, [sys.executable, "-c", f"import {module}"])
+    if best is None:
+        return None
+    return max(best - baseline, 0.0)  # subtract the cost of starting python itself
+
+
+def _best_of(repeats, command):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=APP_DIR, capture_output=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            print(result.stderr.decode().strip().splitlines()[-1])
+            return None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_startup():
+    """
+        Prints how long `import index` and `import app` take on a cold start
+    """
+    for module in ["index", "app"]:
+        elapsed = time_import(module)
+        if elapsed is None:
+            print(f"import {module}: failed")
+        else:
+            print(f"import {module}: {elapsed * 1000:.1f} ms")
+            record("startup", f"import_{module}_ms", elapsed * 1000)
+
+
+def bench_index():
+    """
+        Runs the index round-trip self check that used to run on every import, and times it
+    """
+    from index import validateRoundTrip
+
+    start = time.perf_counter()
+    numOff = validateRoundTrip()
+    elapsed = time.perf_counter() - start
+    print(f"index round trip: {numOff} indices off, {elapsed:.2f} s")
+    record("index", "indices_off", numOff)
+    record("index", "round_trip_s", elapsed)
+
+
+def bench_calendar(size=1_000_000):
+    """
+        Times converting a million timestamps to indices and back
+    """
+    import numpy as np
+    import calendar_index
+
+    datetimes = calendar_index.EPOCH + (np.arange(size) * 15 * 60).astype("timedelta64[s]")
+
+    start = time.perf_counter()
+    indices = calendar_index.to_index(datetimes)
+    to_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calendar_index.to_fields(calendar_index.from_index(indices))
+    from_elapsed = time.perf_counter() - start
+
+    record("calendar", "to_index_ms", to_elapsed * 1000)
+    record("calendar", "from_index_ms", from_elapsed * 1000)
+    print(f"calendar: {size} datetimes to index in {to_elapsed * 1000:.1f} ms, "
+          f"back to calendar fields in {from_elapsed * 1000:.1f} ms")
+
+
+def synthetic_frame(years=5, seed=0):
+    """
+        Builds a working dataframe shaped like a pressure query result, without needing the database
+    :param years: years of 15 minute readings
+    :param seed: random seed
+    :return: pandas.DataFrame with batch_id, datetime and pressure_hobo columns
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    size = int(years * 365 * 96)
+    return pd.DataFrame({
+        "batch_id": np.arange(size) // (96 * 90) + 1,  # a new batch roughly every three months
+        "datetime": pd.date_range("2018-10-01", periods=size, freq="15min"),
+        "pressure_hobo": 10 + np.cumsum(rng.normal(0, 0.01, size)),
+    })
+
+
+def bench_codec(years=5):
+    """
+        Compares the payload size and round trip time of to_json/read_json against codec.py
+    """
+    from io import StringIO
+    import pandas as pd
+    from codec import encode_frame, decode_frame
+
+    df = synthetic_frame(years)
+    print(f"codec: {len(df)} rows")
+
+    start = time.perf_counter()
+    payload = df.to_json()
+    encoded = time.perf_counter() - start
+    start = time.perf_counter()
+    pd.read_json(StringIO(payload))
+    decoded = time.perf_counter() - start
+    _print_codec("to_json/read_json", payload, encoded, decoded)
+
+    for compress in [False, True]:
+        start = time.perf_counter()
+        payload = encode_frame(df, compress=compress)
+        encoded = time.perf_counter() - start
+        start = time.perf_counter()
+        round_trip = decode_frame(payload)
+        decoded = time.perf_counter() - start
+        pd.testing.assert_frame_equal(round_trip, df)  # dtypes have to survive the round trip
+        _print_codec(f"codec compress={compress}", payload, encoded, decoded)
+
+
+def _print_codec(name, payload, encoded, decoded):
+    metric = name.replace("/", "_").replace(" ", "_").replace("=", "_").lower()
+    record("codec", f"{metric}_mb", len(payload) / 1024 ** 2)
+    record("codec", f"{metric}_encode_ms", encoded * 1000)
+    record("codec", f"{metric}_decode_ms", decoded * 1000)
+    print(f"  {name:<22} {len(payload) / 1024 ** 2:7.2f} MB  "
+          f"encode {encoded * 1000:7.1f} ms  decode {decoded * 1000:7.1f} ms")
+
+
+def bench_undo(years=5, edits=200, seed=0):
+    """
+        Times undoing, redoing and jumping through the edit log, each step followed by reading the frame as the next
+        callback would. That they give back exactly the right frames is checked by tests/test_edit_log.py.
+    """
+    import numpy as np
+    from edit_log import EditLog
+
+    rng = np.random.default_rng(seed)
+    log = EditLog(synthetic_frame(years))
+    rows_loaded = log.rows
+    for number in range(edits):
+        start = int(rng.integers(0, log.rows - 3000))
+        rows = log.frame.index[start:start + int(rng.integers(1, 3000))]
+        if number % 4 == 3:
+            log.delete(rows)
+        else:
+            log.set_values(rows, log.frame.loc[rows, "pressure_hobo"].values + rng.normal(0, 0.1, len(rows)))
+
+    def timed_steps(step, count):
+        start = time.perf_counter()
+        for _ in range(count):
+            step()
+            log.frame
+        return (time.perf_counter() - start) / count
+
+    undo_elapsed = timed_steps(log.undo, edits)
+    redo_elapsed = timed_steps(log.redo, edits)
+    jumps = iter(rng.integers(0, edits + 1, 20))
+    jump_elapsed = timed_steps(lambda: log.jump(int(next(jumps))), 20)
+
+    record("undo", "undo_ms", undo_elapsed * 1000)
+    record("undo", "redo_ms", redo_elapsed * 1000)
+    record("undo", "jump_ms", jump_elapsed * 1000)
+    print(f"undo: {edits} edits of a {rows_loaded} row frame, undo {undo_elapsed * 1000:.2f} ms, "
+          f"redo {redo_elapsed * 1000:.2f} ms, jump {jump_elapsed * 1000:.1f} ms on average")
+
+
+def bench_stats(rows=100_000):
+    """
+        Times the selection statistics of a hundred thousand selected readings, and checks them against pandas
+    """
+    import numpy as np
+    from stats import selection_stats
+
+    selected = synthetic_frame(5).iloc[:rows]
+    overall, batches = selection_stats(selected)
+    elapsed = min(_timed(selection_stats, selected)[1] for _ in range(5))
+
+    assert np.isclose(overall['std'], selected['pressure_hobo'].std())
+    assert np.allclose(batches['std'], selected.groupby('batch_id')['pressure_hobo'].std())
+    record("stats", "selection_stats_ms", elapsed * 1000)
+    print(f"stats: {rows} selected readings in {len(batches)} batches summarized in {elapsed * 1000:.1f} ms")
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_query():
+    """
+        Times querying every site of the synthetic database, turning the result into the working frame, and getting a
+        site again from the site cache
+    """
+    from database import ConnectionPool
+    from run_query import get_pressure, get_discharge, working_frame
+    from site_cache import SiteCache
+
+    pool = ConnectionPool(synthetic_database(), size=1)
+    cache = SiteCache()
+    with pool.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT site_id FROM hobo_pressure_batches_1 ORDER BY site_id")
+        sites = [row[0] for row in cursor.fetchall()]
+
+        totals = {"get_pressure": 0.0, "get_discharge": 0.0, "working_frame": 0.0}
+        rows = 0
+        for site_id in sites:
+            pressure, elapsed = _timed(get_pressure, cursor, site_id)
+            totals["get_pressure"] += elapsed
+            totals["get_discharge"] += _timed(get_discharge, cursor, site_id)[1]
+            df, elapsed = _timed(working_frame, pressure)
+            totals["working_frame"] += elapsed
+            rows += len(df)
+
+        cache.get(cursor, sites[0])
+        cached = _timed(cache.get, cursor, sites[0])[1]
+
+    for name, total in totals.items():
+        record("query", f"{name}_ms", total / len(sites) * 1000)
+    record("query", "rows_per_site", rows / len(sites))
+    record("query", "cache_hit_ms", cached * 1000)
+    print(f"query: {len(sites)} sites of {rows / len(sites):.0f} rows, per site get_pressure "
+          f"{totals['get_pressure'] / len(sites) * 1000:.0f} ms, get_discharge "
+          f"{totals['get_discharge'] / len(sites) * 1000:.1f} ms, working_frame "
+          f"{totals['working_frame'] / len(sites) * 1000:.0f} ms, cache hit {cached * 1000:.1f} ms")
+
+
+def bench_store():
+    """
+        Times putting a site's working frame in each kind of session store and getting it back, including from disk
+        after the server side store spilled it
+    """
+    import pandas as pd
+    from database import ConnectionPool
+    from run_query import get_pressure, working_frame
+    from session_store import SessionStore, ClientStore
+
+    with ConnectionPool(synthetic_database(), size=1).cursor() as cursor:
+        cursor.execute("SELECT MIN(site_id) FROM hobo_pressure_batches_1")
+        df = working_frame(get_pressure(cursor, cursor.fetchone()[0]))
+
+    server = SessionStore(tempfile.mkdtemp(prefix="pressuregui_bench_"), memory_limit=0)  # keeps only the newest
+    token, created = _timed(server.create, df)
+    token, put = _timed(server.put, token, df)
+    _, got = _timed(server.get, token)
+    other = server.create(df)  # writes the first session's frame to disk
+    _, spilled = _timed(server.get, token)  # and reads it back
+    server.drop(token)
+    server.drop(other)
+
+    client = ClientStore()
+    token, client_put = _timed(client.put, None, df)
+    round_trip, client_got = _timed(client.get, token)
+    pd.testing.assert_frame_equal(round_trip, df)
+    size = len(json.dumps(token))
+
+    for name, elapsed in [("server_create", created), ("server_put", put), ("server_get", got),
+                          ("server_get_spilled", spilled), ("client_put", client_put), ("client_get", client_got)]:
+        record("store", f"{name}_ms", elapsed * 1000)
+    record("store", "client_token_mb", size / 1024 ** 2)
+    print(f"store: {len(df)} rows, server put {put * 1000:.1f} ms, get {got * 1000:.2f} ms, get after spilling "
+          f"{spilled * 1000:.0f} ms; client put {client_put * 1000:.0f} ms, get {client_got * 1000:.0f} ms, "
+          f"token {size / 1024 ** 2:.2f} MB")
+
+
+def _call(callbacks, name, trigger, *args, metric=None, value=1):
+    """
+        Calls a Dash callback of app.py directly, as if trigger had fired it, and records how long it took
+    :param callbacks: the app's callbacks by function name
+    :param name: the callback's function name
+    :param trigger: the component id (or pattern-matching id) that fired it
+    :param metric: what to record the time as, the callback's name if None
+    :param value: the new value of the triggering property
+    :return: what the callback returned
+    """
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+
+    prop_id = json.dumps(trigger, separators=(",", ":"), sort_keys=True) if isinstance(trigger, dict) else trigger
+    context_value.set(AttributeDict(triggered_inputs=[{"prop_id": f"{prop_id}.n_clicks", "value": value}]))
+    result, elapsed = _timed(callbacks[name], *args)
+    record("callbacks", f"{metric or name}_ms", elapsed * 1000)
+    return result
+
+
+def _payload_kb(output):
+    from plotly.utils import PlotlyJSONEncoder
+
+    return len(json.dumps(output, cls=PlotlyJSONEncoder)) / 1024
+
+
+def bench_callbacks():
+    """
+        Runs a whole session through the app's callbacks against the synthetic database, calling each one directly
+        the way Dash would: load a site (from its summaries first), zoom, page the table, select, shift, compress and
+        delete, undo, redo, export, and switch the discharge overlay. Each callback's time is recorded under its name,
+        or under what it was doing for the graph and table callbacks, which do several things.
+    """
+    import os
+    import pandas as pd
+
+    # keep the app's autosave, summaries and job files out of the working directory
+    scratch = Path(tempfile.mkdtemp(prefix="pressuregui_bench_"))
+    os.environ["PRESSUREGUI_AUTOSAVE"] = str(scratch / "autosave.db")
+    os.environ["PRESSUREGUI_SUMMARIES"] = str(scratch / "summaries.db")
+    os.environ["PRESSUREGUI_JOBS_DIR"] = str(scratch / "jobs")
+    sys.path.insert(0, str(APP_DIR))
+    import app
+
+    app.pool = app.ConnectionPool(synthetic_database())
+    callbacks = {callback.f.__name__: callback.f for callback in app.app.blueprint.callbacks}
+
+    with app.pool.cursor() as cursor:
+        cursor.execute("SELECT MIN(site_id) FROM hobo_pressure_batches_1")
+        site_id = cursor.fetchone()[0]
+        _, summarized = _timed(app.summaries.update, cursor, site_id)
+    record("callbacks", "summaries_update_ms", summarized * 1000)
+
+    # plotly builds its validators on the first figure, keep that out of the first timing
+    app.build_figure(synthetic_frame(0.01))
+
+    # load the site as a background job and poll until it is in
+    start = time.perf_counter()
+    job, _, _, overview, _ = _call(callbacks, "start_query", "query", 1, site_id, "bench", True, False, None,
+                                   None, None)
+    figure, view, _ = _call(callbacks, "update_on_new_data", "overview-site", None, None, False, overview, None, None,
+                            metric="overview")
+    overview_kb = _payload_kb(figure)
+    while True:
+        data, history, redo, _, session, done, _ = _call(callbacks, "poll_query", "job-poll", 1, job, None)
+        if done:
+            break
+        time.sleep(0.01)
+    record("callbacks", "query_job_ms", (time.perf_counter() - start) * 1000)
+    if isinstance(data, dict) and "error" in data:
+        sys.exit(f"the query failed: {data}")
+
+    df = app.store.get(data)
+    figure, view, _ = _call(callbacks, "update_on_new_data", "memory-output", data, None, False, overview, view,
+                            session, metric="full_redraw")
+    record("callbacks", "full_redraw_kb", _payload_kb(figure))
+
+    # zoom to a month in the middle, where the graph draws every point
+    middle = df["datetime"].iloc[len(df) // 2]
+    window = [str(middle), str(middle + pd.Timedelta(days=30))]
+    figure, view, _ = _call(callbacks, "update_on_new_data", "indicator-graphic", data,
+                            {"xaxis.range[0]": window[0], "xaxis.range[1]": window[1]}, False, overview, view, session,
+                            metric="zoom_redraw")
+    record("callbacks", "zoom_redraw_kb", _payload_kb(figure))
+
+    # page, sort and filter the table, then box select a day of the zoomed window
+    _call(callbacks, "update_table", "pressure-table", data, 100, 25, [], "", None, view, metric="table_page")
+    _call(callbacks, "update_table", "pressure-table", data, 0, 25,
+          [{"column_id": "pressure_hobo", "direction": "desc"}], "", None, view, metric="table_sort")
+    _call(callbacks, "update_table", "pressure-table", data, 0, 25, [], "{pressure_hobo} > 10", None, view,
+          metric="table_filter")
+    selection = {"range": {"x": [window[0], str(middle + pd.Timedelta(days=1))], "y": [-1e9, 1e9]}}
+    _call(callbacks, "update_table", "indicator-graphic", data, 0, 25, [], "", selection, view,
+          metric="table_selection")
+    _call(callbacks, "display_selected", "indicator-graphic", selection, data, view)
+
+    # edit the selection, redrawing the graph after each edit like Dash would
+    data, history, redo = _call(callbacks, "shift_selected_data", "shift_button", 1, data, history, 0.5, selection,
+                                view, None, None)
+    figure, view, _ = _call(callbacks, "update_on_new_data", "memory-output", data, None, False, overview, view,
+                            session, metric="partial_update")
+    record("callbacks", "partial_update_kb", _payload_kb(figure))
+    data, history, redo = _call(callbacks, "compress_selected_data", "compress_button", 1, data, history, 1.1,
+                                selection, view, None, None)
+    data, history, redo = _call(callbacks, "delete_button", "delete", 1, selection, data, history, view, None, None)
+    _, view, _ = _call(callbacks, "update_on_new_data", "memory-output", data, None, False, overview, view, session,
+                       metric="delete_update")
+    _call(callbacks, "autosave_session", "history", history, redo, data, session)
+
+    data, history, redo = _call(callbacks, "undo", "undoChange", 1, history, redo, data)
+    data, history, redo = _call(callbacks, "redo", "redoChange", 1, history, redo, data)
+    data, history, redo = _call(callbacks, "jump_in_history", {"index": 0, "type": "history-jump"},
+                                [0] * (len(history) + len(redo)), history, redo, data)
+    _call(callbacks, "display_changelog", "history", history, redo)
+
+    # export, and stream the file the hidden frame would download
+    _, source, _ = _call(callbacks, "export", "exportDF", 1, data, history, "bench")
+    if isinstance(source, str):
+        start = time.perf_counter()
+        with app.app.server.test_client() as client:
+            response = client.get(source)
+            size = len(response.get_data())
+        record("callbacks", "stream_export_ms", (time.perf_counter() - start) * 1000)
+        record("callbacks", "stream_export_mb", size / 1024 ** 2)
+
+    # switch the discharge overlay on and off
+    patch, view, _ = _call(callbacks, "update_on_new_data", "discharge-toggle", data, None, True, overview, view,
+                           session, metric="discharge_on")
+    record("callbacks", "discharge_on_kb", _payload_kb(patch))
+    _call(callbacks, "update_on_new_data", "discharge-toggle", data, None, False, overview, view, session,
+          metric="discharge_off")
+
+    # a second analyst opens the same site, it comes from the site cache
+    start = time.perf_counter()
+    job, *_ = _call(callbacks, "start_query", "query", 1, site_id, "bench2", True, False, None, None, None)
+    while not _call(callbacks, "poll_query", "job-poll", 1, job, data)[5]:
+        time.sleep(0.01)
+    record("callbacks", "cached_query_job_ms", (time.perf_counter() - start) * 1000)
+
+    print(f"callbacks: {site_id}, {len(df)} rows, overview {overview_kb:.0f} kB")
+    for metric, value in RESULTS["callbacks"].items():
+        print(f"  {metric:<32} {value:10.1f}")
+
+
+# Every section that can be run, in the order they run by default
+SECTIONS = {
+    "startup": bench_startup,
+    "index": bench_index,
+    "calendar": bench_calendar,
+    "codec": bench_codec,
+    "undo": bench_undo,
+    "stats": bench_stats,
+    "query": bench_query,
+    "store": bench_store,
+    "callbacks": bench_callbacks,
+}
+
+def compare(baseline, results):
+    """
+        Lists the timings that got more than REGRESSION slower than in an earlier run
+    :param baseline: results of the earlier run, as written by --json
+    :param results: results of this run
+    :return: list of (section, metric, before, now)
+    """
+    slower = []
+    for section, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(section, {}).get(metric)
+            if not before or not metric.endswith(("_ms", "_s")):
+                continue
+            to_ms = 1 if metric.endswith("_ms") else 1000
+            if value > before * (1 + REGRESSION) and (value - before) * to_ms > NOISE_MS:
+                slower.append((section, metric, before, value))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the slow parts of PressureGUI")
+    parser.add_argument("sections", nargs="*", help=f"sections to run (default: all of {', '.join(SECTIONS)})")
+    parser.add_argument("--json", help="also write every measurement to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to flag slower timings against")
+    args = parser.parse_args()
+
+    for name in args.sections:
+        if name not in SECTIONS:
+            sys.exit(f"unknown section {name!r}, choose from: {', '.join(SECTIONS)}")
+    for name in args.sections or list(SECTIONS):
+        SECTIONS[name]()
+
+    if args.json:
+        meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                "machine": platform.machine(), "synthetic": {"sites": SYNTHETIC_SITES, "years": SYNTHETIC_YEARS}}
+        Path(args.json).write_text(json.dumps({"meta": meta, "results": RESULTS}, indent=2))
+
+    if args.compare:
+        slower = compare(json.loads(Path(args.compare).read_text())["results"], RESULTS)
+        for section, metric, before, now in slower:
+            print(f"SLOWER: {section} {metric} {before:.2f} -> {now:.2f}")
+        if slower:
+            sys.exit(1)
+        print(f"no timing more than {REGRESSION:.0%} slower than {args.compare}")
+
+
+if __name__ == '__main__':
+    main()
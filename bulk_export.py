@@ -0,0 +1,180 @@
+# Exports the pressure data of many sites at once, without starting the app.
+#
+# `python bulk_export.py --db copy.db --out export` writes export/<site>.csv for every site (or only the --site ones),
+# `--format parquet` writes .parquet files instead (needs pyarrow). Each site is read with fetchmany and written a chunk
+# at a time, so a worker only ever holds --chunk-rows readings however long the site's record is. Sites run in parallel
+# in a process pool, and the rows written per second are reported for each site and overall.
+#
+# Rows are written in the order the database returns them. They aren't sorted by time, since that would need a whole
+# site in memory; sort by datetime after reading a file if the order matters.
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from database import ConnectionPool
+from datetime_modifications import correct_datetimes
+from run_query import pressure_query
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet export is optional
+    pa = pq = None
+
+# Readings fetched and written at a time by default
+CHUNK_ROWS = 100_000
+
+# Columns of every exported file
+EXPORT_COLUMNS = ['site_id', 'batch_id', 'datetime', 'pressure_hobo']
+
+_pool = None  # each worker process opens its own connections
+
+
+def _open_pool(db_name):
+    global _pool
+    _pool = ConnectionPool(db_name, size=1)
+
+
+def site_chunks(cursor, site_id, chunk_rows=CHUNK_ROWS):
+    """
+        Reads one site's pressure readings a chunk at a time, the same readings get_pressure returns
+    :param cursor: cursor object from the database
+    :param site_id: three char site id that matches the database
+    :param chunk_rows: readings per chunk
+    :return: generator of dataframes with EXPORT_COLUMNS, readings without a value are left out
+    """
+    cursor.execute(pressure_query(cursor), (site_id,))
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        result = pd.DataFrame.from_records(rows)
+        chunk = pd.DataFrame({
+            'site_id': site_id,
+            'batch_id': result[3],
+            'datetime': correct_datetimes(result[0], result[1]),
+            'pressure_hobo': pd.to_numeric(result[2].replace('', np.nan), errors='coerce'),
+        })
+        yield chunk.dropna(subset=['pressure_hobo'])
+
+
+def csv_chunks(df, chunk_rows=CHUNK_ROWS, index=True):
+    """
+        Formats a dataframe as CSV a chunk of rows at a time, so a large frame is never one big string
+    :param df: the dataframe
+    :param chunk_rows: rows per chunk
+    :param index: write the index as the first column, like DataFrame.to_csv does
+    :return: generator of CSV text, the header first
+    """
+    yield df.iloc[:0].to_csv(index=index)
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(header=False, index=index)
+
+
+def export_site(site_id, out_dir, file_format="csv", chunk_rows=CHUNK_ROWS):
+    """
+        Writes one site's readings to <out_dir>/<site_id>.<file_format>, a chunk at a time. Runs in a worker process.
+    :param site_id: three char site id that matches the database
+    :param out_dir: directory to write to
+    :param file_format: "csv" or "parquet"
+    :param chunk_rows: readings fetched and written at a time
+    :return: dict of site_id, status, rows and seconds
+    """
+    path = Path(out_dir) / f"{site_id}.{file_format}"
+    temporary = path.with_suffix(".tmp")
+    start = time.perf_counter()
+    rows = 0
+    try:
+        with _pool.cursor() as cursor:
+            if file_format == "parquet":
+                writer = None
+                for chunk in site_chunks(cursor, site_id, chunk_rows):
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(temporary, table.schema)
+                    writer.write_table(table.cast(writer.schema))
+                    rows += len(chunk)
+                if writer is None:  # no readings, still write a file with the columns
+                    pd.DataFrame(columns=EXPORT_COLUMNS).to_parquet(temporary, index=False)
+                else:
+                    writer.close()
+            else:
+                with open(temporary, "w", newline="") as file:
+                    file.write(",".join(EXPORT_COLUMNS) + "\n")
+                    for chunk in site_chunks(cursor, site_id, chunk_rows):
+                        chunk.to_csv(file, header=False, index=False)
+                        rows += len(chunk)
+        temporary.replace(path)  # so a failed export never leaves half a file behind
+    except Exception as error:
+        temporary.unlink(missing_ok=True)
+        return {'site_id': site_id, 'status': f"failed: {error}", 'rows': rows,
+                'seconds': time.perf_counter() - start}
+
+    return {'site_id': site_id, 'status': "ok", 'rows': rows, 'seconds': time.perf_counter() - start}
+
+
+def export_sites(db_name, sites, out_dir, file_format="csv", chunk_rows=CHUNK_ROWS, workers=None):
+    """
+        Exports every site in a process pool
+    :param db_name: path to the database
+    :param sites: site ids to export
+    :param out_dir: directory to write the files to
+    :param file_format: "csv" or "parquet"
+    :param chunk_rows: readings fetched and written at a time by each worker
+    :param workers: number of worker processes, None for one per CPU
+    :return: dataframe with site_id, status, rows, seconds and rows_per_s for each site, in site order
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_pool, initargs=(db_name,)) as executor:
+        futures = [executor.submit(export_site, site_id, out_dir, file_format, chunk_rows) for site_id in sites]
+        for future in as_completed(futures):
+            result = future.result()
+            if result['status'] != "ok":
+                print(f"ERROR: {result['site_id']} {result['status']}")
+            results.append(result)
+
+    summary = pd.DataFrame(results).sort_values('site_id', ignore_index=True)
+    summary['rows_per_s'] = (summary['rows'] / summary['seconds']).round().astype(int)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export every site's pressure data to CSV or Parquet files")
+    parser.add_argument("--db", default="copy.db", help="path to the database (default: copy.db)")
+    parser.add_argument("--out", default="export", help="directory for the exported files (default: export)")
+    parser.add_argument("--site", action="append", help="site id to export, repeat for more (default: every site)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="file format (default: csv)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                        help=f"readings each worker holds at a time (default: {CHUNK_ROWS})")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    if args.format == "parquet" and pq is None:
+        print("ERROR: Parquet export needs pyarrow, install it or use --format csv")
+        return
+
+    sites = args.site
+    if not sites:
+        with ConnectionPool(args.db, size=1).cursor() as cursor:
+            cursor.execute("SELECT DISTINCT site_id FROM hobo_pressure_batches_1 ORDER BY site_id")
+            sites = [row[0] for row in cursor.fetchall()]
+
+    start = time.perf_counter()
+    summary = export_sites(args.db, sites, args.out, args.format, args.chunk_rows, args.workers)
+    elapsed = time.perf_counter() - start
+
+    print(summary.to_string(index=False, float_format=lambda seconds: f"{seconds:.3f}"))
+    print(f"{summary['rows'].sum()} rows from {(summary['status'] == 'ok').sum()} of {len(summary)} sites in "
+          f"{elapsed:.2f} s, {summary['rows'].sum() / elapsed:.0f} rows/s with {args.workers or os.cpu_count()} "
+          f"workers")
+
+
+if __name__ == '__main__':
+    main()
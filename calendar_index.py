@@ -0,0 +1,108 @@
+# Closed-form conversions between datetimes and the "days since October 1, 2018" index used throughout the app.
+#
+# Everything here is built on numpy datetime64 arithmetic, so every function accepts a single value or a whole
+# array and costs the same per element regardless of how far the date is from the start of the project.
+
+import numpy as np
+
+# The index counts days since this moment, fractions of a day are the time of day
+EPOCH = np.datetime64("2018-10-01T00:00:00", "ns")
+
+ONE_DAY = np.timedelta64(1, "D")
+ONE_SECOND = np.timedelta64(1, "s")
+
+
+def full_year(year):
+    """
+        Expands two digit years (eg. 19) into four digit years (2019), four digit years are returned unchanged
+    :param year: int or array of ints
+    :return: int or array of ints
+    """
+    year = np.asarray(year, dtype=np.int64)
+    return _unwrap(np.where(year < 100, year + 2000, year))
+
+
+def origin(startYear):
+    """
+        Returns October 1 of startYear, the moment index 0 refers to
+    :param startYear: int (two or four digits)
+    :return: numpy datetime64
+    """
+    return from_fields(full_year(startYear), 10, 1)
+
+
+def is_leap_year(year):
+    """
+        Gregorian leap year rule
+    :param year: int or array of ints (two or four digits)
+    :return: bool or array of bools
+    """
+    year = np.asarray(full_year(year))
+    return _unwrap((year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0)))
+
+
+def from_fields(year, month, day, hour=0, minute=0, second=0):
+    """
+        Builds datetimes from their calendar fields
+    :param year: int or array (two or four digits)
+    :param month: int or array (1 - 12)
+    :param day: int or array (1 - 31)
+    :param hour: int or array
+    :param minute: int or array
+    :param second: number or array, fractions of a second are kept to the nanosecond
+    :return: numpy datetime64 or array of datetime64
+    """
+    year = np.asarray(full_year(year), dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+    day = np.asarray(day, dtype=np.int64)
+
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    days = months.astype("datetime64[D]") + (day - 1)
+    seconds = (np.asarray(hour, dtype=np.float64) * 3600 + np.asarray(minute, dtype=np.float64) * 60
+               + np.asarray(second, dtype=np.float64))
+    return _unwrap(days.astype("datetime64[ns]") + np.round(seconds * 1e9).astype("timedelta64[ns]"))
+
+
+def to_fields(datetimes):
+    """
+        Splits datetimes into their calendar fields, the inverse of from_fields
+    :param datetimes: datetime64 or array of datetime64
+    :return: year, month, day, hour, minute, second (four digit years, whole seconds)
+    """
+    datetimes = np.asarray(datetimes, dtype="datetime64[s]")
+    months = datetimes.astype("datetime64[M]")
+    days = datetimes.astype("datetime64[D]")
+
+    year = months.astype(np.int64) // 12 + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months.astype("datetime64[D]")).astype(np.int64) + 1
+    seconds = (datetimes - days.astype("datetime64[s]")).astype(np.int64)
+
+    return tuple(_unwrap(field) for field in (year, month, day, seconds // 3600, seconds // 60 % 60, seconds % 60))
+
+
+def to_index(datetimes, start=EPOCH):
+    """
+        Converts datetimes to days since start (negative before start)
+    :param datetimes: datetime64 or array of datetime64 (anything numpy or pandas can turn into one)
+    :param start: the moment index 0 refers to
+    :return: float or array of floats
+    """
+    datetimes = np.asarray(datetimes, dtype="datetime64[ns]")
+    return _unwrap((datetimes - np.datetime64(start, "ns")) / ONE_DAY)
+
+
+def from_index(index, start=EPOCH):
+    """
+        Converts days since start back into datetimes, rounded to the nearest second
+    :param index: float or array of floats
+    :param start: the moment index 0 refers to
+    :return: datetime64 or array of datetime64
+    """
+    seconds = np.round(np.asarray(index, dtype=np.float64) * 86400).astype(np.int64)
+    return _unwrap(np.datetime64(start, "s") + seconds.astype("timedelta64[s]"))
+
+
+def _unwrap(value):
+    # hand single values back as numpy scalars rather than 0-d arrays
+    return value[()] if isinstance(value, np.ndarray) and value.ndim == 0 else value
@@ -1,23 +1,50 @@
+import numpy as np
 import pandas as pd
 import json
+from codec import encode_frame, decode_frame
+
+
+def matching_positions(data, changes):
+    """
+        Finds the rows of data that the rows of changes refer to, by datetime. data is kept sorted by datetime, so each
+        one is found with a binary search. Readings that share a datetime are told apart by row id.
+    :param data: dataframe sorted by datetime
+    :param changes: dataframe of changed rows
+    :return: positions in data, and a boolean array of which rows of changes were found
+    """
+    times = data['datetime'].values
+    wanted = changes['datetime'].values
+    positions = np.searchsorted(times, wanted, side='left')
+    repeated = np.searchsorted(times, wanted, side='right') - positions > 1
+    if repeated.any():  # several readings at the same time, tell them apart by row id
+        positions[repeated] = data.index.get_indexer(changes.index[repeated])
+    found = (positions >= 0) & (positions < len(times))
+    found[found] = times[positions[found]] == wanted[found]  # changes for rows that no longer exist are skipped
+    return positions[found], found
 
 
 def apply_changes(data, changes):
     """
-        Applies the values of changes to data by matching on datetime
-    :param data: dataframe to be changed
+        Adds the values of changes to data by matching on datetime. A change covering consecutive rows (eg. a time
+        range) is added as one slice.
+    :param data: dataframe to be changed, sorted by datetime
     :param changes: dataframe with changes to be applied
     :return: updated dataframe
     """
-    bool_selection = data['datetime'].isin(changes['datetime'])
-    changed_data = data.loc[bool_selection]["pressure_hobo"].add(changes["pressure_hobo"].values)
+    positions, found = matching_positions(data, changes)
+    deltas = changes['pressure_hobo'].values[found]
 
-    data.update(changed_data)
+    column = data.columns.get_loc('pressure_hobo')
+    if len(positions) and positions[-1] - positions[0] + 1 == len(positions) and np.all(np.diff(positions) == 1):
+        rows = slice(positions[0], positions[-1] + 1)  # one contiguous run
+    else:
+        rows = positions
+    data.iloc[rows, column] = data.iloc[rows, column].values + deltas
 
     return data
 
 
-def log_changes(history, type, changes_df, description):
+def log_changes(history, type, changes_df, description, data=None):
     """
         Logs a change to the history log
 
@@ -25,9 +52,11 @@ def log_changes(history, type, changes_df, description):
     :param type: type of change
     :param changes_df: dataframe with the changes
     :param description: text description of the change
+    :param data: the working dataframe the change was made to, lets a uniform shift of consecutive rows be logged as
+        just its time range
     :return: updated history log
     """
-    newChange = Change(des=description, type=type, changes_df=changes_df)  # create a new change object
+    newChange = Change(des=description, type=type, changes_df=changes_df, data=data)  # create a new change object
 
     if isinstance(history, str):  # if history is a string, parse it into a list
         try:
@@ -39,54 +68,38 @@ def log_changes(history, type, changes_df, description):
     return history  # return the updated history log (list of change objects)
 
 
-def undo_delete(data, changes):
-    """
-        Undoes a delete change by adding the changes back to the data
-    :param data:
-    :param changes:
-    :return:
-    """
-
-    data = pd.read_json(data)  # convert data to a dataframe #TODO is this necessary? does the changes var need this?
-    return pd.concat([data, changes], join="inner")  # TODO is join inner really necessary?
-
-
-def undo_shift(data, changes):
-    """
-        Undoes a shift change by shifting the data in the opposite direction
-    :param data:  a dataframe with the data to be undone
-    :param changes:  a dataframe with the shifts to be undone
-    :return: a dataframe with the changes undone
-    """
-    data = pd.read_json(data)  # convert data to a dataframe
-    changes.pressure_hobo *= -1  # invert the changes
-    return apply_changes(data, changes)  # return the data after applying the inverted changes
-
-
-def undo_add(data, changes):
-    """
-        !!! UNIMPLEMENTED !!! Undoes an add change by deleting the changes from the data
-    """
-    pass
-
-
 class Change:
     """
         A class to represent a change to the data
 
+        The record is kept small: only the row ids and datetimes of the affected rows, plus what the change did to
+        them. A uniform shift stores just its amount, a compression stores the per-row deltas, and a delete stores the
+        deleted rows so they can be put back. These are packed with the codec, and only unpacked the first time
+        changes_df is used, so listing the history only reads the description and type. A uniform shift of
+        consecutive rows stores no rows at all, only its time range, and changes_for finds the rows again.
+
         Attributes
         ----------
         description : str
             Text description of the change
         type : str
             Type of change corresponds to how the change was made: eg. Delete, Shift, Expcomp, etc.
-        undoFunc : function
-            A function that we can call to undo this change (eg. undo_delete, undo_shift, etc.)
         changes_df : pandas.DataFrame
-            A data frame with the affected changes
+            A data frame with the affected changes, unpacked on first use (empty for a change stored as a time range)
+        count : int
+            Number of affected rows
+        params : dict
+            Parameters that stand in for per-row values, eg. {'shift': 0.5} for a uniform shift, and
+            {'shift': 0.5, 'range': [t0, t1]} for a uniform shift of every row from t0 to t1
 
         Methods
         -------
+        changes_for(data)
+            Returns the change's rows in a working dataframe, with what the change did to each
+        apply(data)
+            Makes the change to a working dataframe again (redo, or a replay onto a fresh load)
+        revert(data)
+            Takes the change back out of a working dataframe (undo)
         to_json()
             Returns a json string representation of the change
     """
@@ -96,44 +109,131 @@ class Change:
     # Type of change corresponds to how the change was made: eg. Delete, Shift, Expcomp, etc.
     type = ""
 
-    # A function that we can call to undo this change
-    undoFunc = None
-
-    # A data frame with the affected changes
-    changes_df = pd.DataFrame
-
-    def __init__(self, jsonIn='', des='', type='', changes_df=''):
+    def __init__(self, jsonIn='', des='', type='', changes_df='', data=None):
         if jsonIn != '':  # if we are initializing from a json string
-            data = json.loads(jsonIn)  # parse the json string
-            self.changes_df = pd.read_json(data['changes_df'])  # convert the changes_df to a dataframe
+            data = json.loads(jsonIn)  # parse the json string, the packed rows stay packed until they're needed
             self.description = data['description']  # set the description
             self.type = data['type']  # set the type
+            self.params = data.get('params', {})
+            self._payload = data.get('payload', data.get('changes_df'))  # older records kept the whole frame
+            self._changes_df = None
+            self.count = data.get('count')
         else:
             self.description = des  # set the description
             self.type = type  # set the type
-            self.changes_df = changes_df  # set the changes_df
-
-        match self.type:
-            case "delete":  # if the type is delete
-                self.undoFunc = undo_delete  # set the undo function to undo_delete
-
-            case "shift":  # if the type is shift
-                self.undoFunc = undo_shift  # set the undo function to undo_shift
-            case "compression":  # if the type is compression
-                self.undoFunc = undo_shift  # set the undo function to undo_shift
-
-            case "add":  # if the type is add
-                self.undoFunc = undo_add  # set the undo function to undo_add
+            self._changes_df = changes_df  # set the changes_df
+            self._payload = None  # packed when the change is first saved
+            self.params = uniform_params(type, changes_df, data)
+            self.count = len(changes_df)
+
+    @property
+    def changes_df(self):
+        if self._changes_df is None:
+            self._changes_df = decode_frame(self._payload) if self._payload else pd.DataFrame()
+            if 'shift' in self.params:
+                self._changes_df['pressure_hobo'] = self.params['shift']  # the same amount for every row
+        return self._changes_df
+
+    def changes_for(self, data):
+        """
+            Returns the rows of data the change applies to, like changes_df. A change stored as a time range is looked
+            up in data by binary search, the others are their changes_df.
+        :param data: working dataframe sorted by datetime
+        :return: dataframe of the changed rows, with the amount added to each in pressure_hobo
+        """
+        if 'range' not in self.params:
+            return self.changes_df
+        times = data['datetime'].values
+        t0, t1 = (np.datetime64(pd.Timestamp(t), 'ns') for t in self.params['range'])
+        rows = data.iloc[np.searchsorted(times, t0, side='left'):np.searchsorted(times, t1, side='right')]
+        return pd.DataFrame({'datetime': rows['datetime'].values, 'pressure_hobo': self.params['shift']},
+                            index=rows.index)
+
+    def apply(self, data):
+        """
+            Makes the change to data again. Sessions with an EditLog undo and redo through it instead, this is for the
+            browser side store, sessions that lost their log, and replaying saved changes.
+        :param data: working dataframe sorted by datetime
+        :return: the changed dataframe
+        """
+        changes_df = self.changes_for(data)
+        if self.type == "delete":
+            positions, found = matching_positions(data, changes_df)
+            return data.drop(data.index[positions])
+        if self.type in ("shift", "compression"):
+            return apply_changes(data, changes_df)
+        raise ValueError(f"can't replay a change of type {self.type!r}")
+
+    def revert(self, data):
+        """
+            Takes the change back out of data, the data has to be as the change left it
+        :param data: working dataframe sorted by datetime
+        :return: the dataframe as it was before the change
+        """
+        changes_df = self.changes_for(data)
+        if self.type == "delete":
+            return pd.concat([data, changes_df], join="inner").sort_index()  # row ids count up in time order
+        if self.type in ("shift", "compression"):
+            return apply_changes(data, changes_df.assign(pressure_hobo=-changes_df['pressure_hobo']))
+        raise ValueError(f"can't undo a change of type {self.type!r}")
 
     def to_json(self):
         """
             Returns a json string representation of the change
         :return:  json string representation of the change
         """
+        packed = self._payload is not None or self._changes_df is None  # eg. read back from a json string
+        if not packed and len(self._changes_df) and 'range' not in self.params:
+            self._payload = encode_frame(self._changes_df[kept_columns(self.type, self._changes_df, self.params)])
+
         export = {
-            "changes_df": self.changes_df.to_json(),  # convert the changes_df to a json string
             "description": self.description,  # set the description
-            "type": self.type  # set the type
+            "type": self.type,  # set the type
+            "count": self.count,  # number of affected rows, so the history can be listed without unpacking
+            "params": self.params,  # eg. the amount of a uniform shift
+            "payload": self._payload,  # row ids, datetimes and whatever else undoing needs, packed
         }  # create a dictionary with the change data
 
         return json.dumps(export)  # return the dictionary as a json string
+
+
+def uniform_params(type, changes_df, data=None):
+    """
+        Finds parameters that describe a change without per-row values
+    :param type: type of change
+    :param changes_df: dataframe with the changes
+    :param data: the working dataframe the change was made to, if known
+    :return: {'shift': amount} if every row was shifted by the same amount, with 'range': [t0, t1] too if the rows
+        were every row of data from t0 to t1, else {}
+    """
+    if type == "delete" or len(changes_df) == 0 or 'pressure_hobo' not in changes_df:
+        return {}
+    values = changes_df['pressure_hobo'].values
+    if not (values == values[0]).all():
+        return {}
+    params = {"shift": float(values[0])}
+
+    if data is not None:
+        positions = data.index.get_indexer(changes_df.index)
+        times = data['datetime'].values
+        first, last = positions[0], positions[-1]
+        if (last - first + 1 == len(positions) and (positions >= 0).all() and (np.diff(positions) == 1).all()
+                and (first == 0 or times[first - 1] != times[first])  # no other reading shares the range's ends
+                and (last == len(times) - 1 or times[last + 1] != times[last])):
+            params["range"] = [pd.Timestamp(times[first]).isoformat(), pd.Timestamp(times[last]).isoformat()]
+    return params
+
+
+def kept_columns(type, changes_df, params):
+    """
+        The columns of changes_df a change needs to keep to be undone or replayed
+    :param type: type of change
+    :param changes_df: dataframe with the changes
+    :param params: parameters from uniform_params
+    :return: list of column names
+    """
+    if type == "delete":
+        return list(changes_df.columns)  # the whole rows, to put them back
+    if 'shift' in params:
+        return ['datetime']  # which rows, the amount is in params
+    return ['datetime', 'pressure_hobo']  # which rows and each row's delta
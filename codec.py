@@ -0,0 +1,139 @@
+# Compact binary encoding of dataframes for dcc.Store components, the change history and files on disk.
+#
+# Each column is packed as its raw numpy buffer, the buffers are concatenated, optionally compressed with zlib, and
+# base64 encoded so the result is still a plain string that can sit in a store. A small JSON header records the
+# column names and dtypes, so ints stay ints and datetimes stay datetimes on the way back (unlike to_json/read_json).
+# Time zone aware datetimes are packed as UTC with their zone in the header, and pandas' nullable dtypes (Int64,
+# Float64, boolean) as their values plus a mask of the missing ones.
+
+import base64
+import json
+import struct
+import zlib
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+# Every encoded payload starts with this, anything else is treated as a legacy pandas JSON string
+MAGIC = "pgf1:"
+
+
+def encode_frame(df, compress=True):
+    """
+        Packs a dataframe into a compact string
+    :param df: the dataframe to encode
+    :param compress: zlib compress the packed columns (smaller, slightly slower)
+    :return: string starting with MAGIC
+    """
+    buffers = []
+    header = {
+        "compressed": bool(compress),
+        "index": dict(_pack(df.index, buffers, compress), name=df.index.name),
+        "columns": [dict(_pack(df[name], buffers, compress), name=name) for name in df.columns],
+    }
+
+    header_bytes = json.dumps(header).encode()
+    body = b"".join([struct.pack("<I", len(header_bytes)), header_bytes, *buffers])
+    if compress:
+        body = zlib.compress(body, 1)
+    return MAGIC + ("z" if compress else "r") + base64.b64encode(body).decode("ascii")
+
+
+def decode_frame(payload):
+    """
+        Unpacks a string from encode_frame. Legacy pandas JSON strings (from to_json) are still accepted.
+    :param payload: the encoded string
+    :return: pandas.DataFrame
+    """
+    if not payload.startswith(MAGIC):
+        return pd.read_json(StringIO(payload))
+
+    body = base64.b64decode(payload[len(MAGIC) + 1:])
+    if payload[len(MAGIC)] == "z":
+        body = zlib.decompress(body)
+
+    header_length, = struct.unpack_from("<I", body)
+    header = json.loads(body[4:4 + header_length])
+    view = memoryview(body)[4 + header_length:]
+
+    index, offset = _unpack(header["index"], view, 0)  # same order as encode_frame packed them
+    columns = {}
+    for spec in header["columns"]:
+        columns[spec["name"]], offset = _unpack(spec, view, offset)
+
+    index = index if isinstance(index, pd.RangeIndex) else pd.Index(index)
+    return pd.DataFrame(columns, index=index.rename(header["index"].get("name")))
+
+
+def _pack(values, buffers, compress):
+    # describe one column (or the index) and add its raw bytes to buffers
+    if isinstance(values, pd.RangeIndex):
+        return {"kind": "range", "start": values.start, "stop": values.stop, "step": values.step}
+
+    dtype = values.dtype
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return dict(_pack(pd.DatetimeIndex(values).tz_convert(None), buffers, compress), tz=str(dtype.tz))
+    if isinstance(dtype, pd.StringDtype):
+        return dict(_pack(np.asarray(values, dtype=object), buffers, compress), extension=dtype.name)
+    if pd.api.types.is_extension_array_dtype(dtype):
+        if not hasattr(dtype, "numpy_dtype"):  # eg. category or period, no plain array to pack them as
+            raise TypeError(f"can't encode values of dtype {dtype}, convert them to a numpy dtype first")
+        spec = _pack(values.to_numpy(dtype=dtype.numpy_dtype, na_value=dtype.numpy_dtype.type(0)), buffers, compress)
+        return dict(spec, extension=dtype.name, mask=_pack(np.asarray(values.isna()), buffers, compress))
+
+    array = np.asarray(values)
+    if array.dtype.kind in "biufcmM":
+        spec = {"kind": "array", "dtype": array.dtype.str, "length": len(array), "filter": None}
+        raw = np.ascontiguousarray(array).view(np.uint8).reshape(len(array), array.dtype.itemsize)
+
+        if compress and array.dtype.kind in "iumM" and array.dtype.itemsize == 8 and len(array):
+            # timestamps, row ids and batch ids mostly go up in even steps, so their differences compress to nothing
+            deltas = np.diff(array.view(np.int64), prepend=np.int64(0))
+            raw = deltas.view(np.uint8).reshape(len(array), 8)
+            spec["filter"] = "delta"
+        if compress:
+            # group the n-th byte of every value together, zlib finds far more repeats in the high bytes that way
+            raw = raw.T
+            spec["filter"] = (spec["filter"] or "") + "shuffle"
+
+        buffers.append(np.ascontiguousarray(raw).tobytes())
+        return spec
+
+    # strings and other python objects don't have a fixed width, store them in the header instead
+    return {"kind": "object", "values": [None if pd.isna(value) else value for value in array.tolist()]}
+
+
+def _unpack(spec, view, offset):
+    # the inverse of _pack, returns the values and the offset of the next buffer
+    values, offset = _unpack_values(spec, view, offset)
+    if "tz" in spec:
+        values = pd.DatetimeIndex(values).tz_localize("UTC").tz_convert(spec["tz"]).array
+    if "extension" in spec:
+        values = pd.array(values, dtype=spec["extension"])
+    if "mask" in spec:
+        mask, offset = _unpack_values(spec["mask"], view, offset)
+        values[mask] = pd.NA
+    return values, offset
+
+
+def _unpack_values(spec, view, offset):
+    if spec["kind"] == "range":
+        return pd.RangeIndex(spec["start"], spec["stop"], spec["step"]), offset
+    if spec["kind"] == "object":
+        return np.array(spec["values"], dtype=object), offset
+
+    dtype = np.dtype(spec["dtype"])
+    length = spec["length"]
+    nbytes = dtype.itemsize * length
+    raw = np.frombuffer(view[offset:offset + nbytes], dtype=np.uint8)
+
+    filters = spec.get("filter") or ""
+    if filters.endswith("shuffle"):
+        raw = raw.reshape(dtype.itemsize, length).T
+    array = np.ascontiguousarray(raw).view(dtype).reshape(length)
+    if filters.startswith("delta"):
+        array = np.cumsum(array.view(np.int64)).view(dtype)
+    if not array.flags.writeable:
+        array = array.copy()
+    return array, offset + nbytes
@@ -0,0 +1,189 @@
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import quote
+
+
+class DatabaseError(Exception):
+    """
+        Raised when the database can't be opened or a query on it fails
+    """
+
+
+class ConnectionPool:
+    """
+        A pool of reusable, read-only SQLite connections to the logger database
+
+        Connections are opened lazily (the first time they are needed), tuned once, and then handed out again and
+        again, so a query doesn't pay for opening the file and warming up SQLite's page cache. At most size
+        connections are open at a time; callbacks running on other Flask worker threads wait for one to be returned.
+
+        Attributes
+        ----------
+        path : str
+            Path to the SQLite database file
+        size : int
+            Maximum number of open connections
+        timings : collections.deque
+            The most recent queries as dicts of sql, params, seconds and rows
+
+        Methods
+        -------
+        connection()
+            Context manager that borrows a connection from the pool
+        cursor()
+            Context manager that borrows a connection and yields a cursor that times every query
+        stats()
+            Returns a summary of the recorded query timings
+        close()
+            Closes every idle connection
+    """
+
+    def __init__(self, path, size=4, mmap_size=256 * 1024 ** 2, cache_size=64 * 1024, history=100):
+        self.path = str(path)
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size  # in KiB
+        self.timings = deque(maxlen=history)
+
+        self._idle = queue.LifoQueue()  # most recently used first, its cache is the warmest
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """
+            Borrows a connection, it goes back into the pool when the with block ends
+        :return: sqlite3.Connection
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @contextmanager
+    def cursor(self):
+        """
+            Borrows a connection and yields a cursor for it that records how long each query takes
+        :return: TimedCursor
+        """
+        with self.connection() as conn:
+            cursor = TimedCursor(conn.cursor(), self.timings)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def stats(self):
+        """
+            Returns a summary of the recorded query timings
+        :return: dict with the number of queries, total and slowest time, and the recent queries themselves
+        """
+        timings = list(self.timings)
+        return {
+            "open_connections": self._opened,
+            "queries": len(timings),
+            "total_seconds": sum(timing["seconds"] for timing in timings),
+            "slowest_seconds": max((timing["seconds"] for timing in timings), default=0.0),
+            "recent": timings,
+        }
+
+    def close(self):
+        """
+            Closes every idle connection, borrowed connections are left alone
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if not can_open:
+            return self._idle.get()  # every connection is busy, wait for one to come back
+
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _open(self):
+        if not Path(self.path).is_file():
+            raise DatabaseError(f"Cannot open database file {self.path!r}: it does not exist")
+        try:
+            conn = sqlite3.connect(f"file:{quote(self.path)}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+            conn.execute(f"PRAGMA cache_size = {-int(self.cache_size)}")  # negative means KiB rather than pages
+            conn.execute("PRAGMA query_only = ON")
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Cannot open database file {self.path!r}: {e}") from e
+        return conn
+
+
+class TimedCursor:
+    """
+        Wraps a sqlite3.Cursor, recording the time spent executing and fetching each query
+    """
+
+    def __init__(self, cursor, timings):
+        self._cursor = cursor
+        self._timings = timings
+        self._current = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            self._cursor.execute(sql, parameters)
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Query failed: {e}\n{sql}") from e
+        self._current = {"sql": sql, "params": list(parameters), "seconds": time.perf_counter() - start, "rows": 0}
+        self._timings.append(self._current)
+        return self
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def fetchmany(self, size=None):
+        return self._timed(self._cursor.fetchmany, size if size is not None else self._cursor.arraysize)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)  # description, rowcount, close, etc.
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            result = fetch(*args)
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Query failed: {e}") from e
+        if self._current is not None:
+            self._current["seconds"] += time.perf_counter() - start
+            if isinstance(result, list):
+                self._current["rows"] += len(result)
+            elif result is not None:
+                self._current["rows"] += 1
+        return result
@@ -1,5 +1,7 @@
-import datetime
-from index import datetimeToIndex, dayToIndexRatio, startIndex, indexToDatetime
+import numpy as np
+import pandas as pd
+import calendar_index
+from index import dayToIndexRatio, indexToDatetime, startYear
 
 def correct_datetime(datetime):
     date, time = datetime.split(" ")
@@ -25,31 +27,45 @@ def correct_datetime(datetime):
 
     return year, month, day, hour, minute, second
 
-def getIndexList():
-    # go from the start date to now
-    # gets today's datetime
-    now = str(datetime.datetime.now())
-    date, time = now.split(" ")
-    year, month, day = date.split("-")
-    year = year[2:]
-    hour, minute, second = time.split(":")
-    second = second[:2]
-
-    # gives todays date a value, or endIndex number
-    endIndex = datetimeToIndex(year, month, day, hour, minute, second)
-    endIndex = round(endIndex / dayToIndexRatio) * dayToIndexRatio
-
-    # calculates the number of entries (numIndices) since the project start date
-    diff = endIndex - startIndex
-    numIndices = diff / dayToIndexRatio
-
-    # creates the indexList by multiplying the ith entry by the dayToIndexRatio one by one and making the list.
-    indexList = []
-    for i in range(0, int(numIndices)):
-        newVal = startIndex + (i * dayToIndexRatio)
-        indexList.append(newVal)
-
-    return indexList
+def correct_datetimes(dates, times):
+    """
+        Vectorized version of correct_datetime for whole columns of dates and times
+    :param dates: Series of date strings (M-D-Y or Y-M-D, optionally followed by a time)
+    :param times: Series of time strings (H:M:S or H:M)
+    :return: Series of datetime64 values
+    """
+    # loggers repeat the same few thousand dates and 96 times, so only the unique strings get parsed
+    date_codes, unique_dates = pd.factorize(dates.astype(str), sort=False)
+    time_codes, unique_times = pd.factorize(times.astype(str), sort=False)
+
+    date_parts = pd.Series(unique_dates).str.split(" ").str[0].str.split("-", expand=True)
+    first, second, third = date_parts[0], date_parts[1], date_parts[2]
+    swapped = first.astype(int) > 12  # probably year, month, day
+    month = second.where(swapped, first).astype(int)
+    day = third.where(swapped, second).astype(int)
+    year = first.where(swapped, third).str[-2:].astype(int)
+    year = year + np.where(year < 69, 2000, 1900)  # same pivot as the %y directive
+    days = pd.to_datetime(pd.DataFrame({"year": year, "month": month, "day": day})).to_numpy()
+
+    time_parts = pd.Series(unique_times).str.split(":", expand=True)
+    if time_parts.shape[1] < 3:
+        time_parts[2] = None
+    seconds = (time_parts[0].astype(int) * 3600 + time_parts[1].astype(int) * 60
+               + time_parts[2].fillna("00").astype(int)).to_numpy()
+    offsets = seconds.astype("timedelta64[s]")
+
+    return pd.Series(days[date_codes] + offsets[time_codes], index=dates.index)
+
+
+def snap_to_grid(datetimes):
+    """
+        Returns the index (days since October 1, startYear) of each datetime, rounded to the nearest 15 minutes
+    :param datetimes: Series of datetime64 values
+    :return: Series of float indices
+    """
+    index = calendar_index.to_index(datetimes.to_numpy(), calendar_index.origin(startYear))
+    return pd.Series(np.round(index / dayToIndexRatio) * dayToIndexRatio, index=datetimes.index)
+
 
 def getDateList(indexList):
     startYear = 18
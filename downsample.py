@@ -0,0 +1,68 @@
+# Picks which points of a long series to draw, so the browser only gets about as many points as it has pixels.
+#
+# Both methods return positions into the original arrays (never new, interpolated points), so every drawn point is a
+# real reading that can be traced back to its row.
+
+import numpy as np
+
+
+def minmax(x, y, buckets):
+    """
+        Splits x into equal-width buckets and keeps the lowest and highest point of each one. Spikes always survive,
+        because the most extreme reading of every bucket is drawn.
+    :param x: sorted numeric array (datetimes as int64 nanoseconds)
+    :param y: array of values
+    :param buckets: number of buckets (roughly the plot width in pixels)
+    :return: sorted array of positions to keep, at most 2 * buckets long
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) <= 2 * buckets:
+        return np.arange(len(x))
+
+    bucket = _bucket_of(x, buckets)
+    order = np.lexsort((y, bucket))  # by bucket, then by value within the bucket
+    sorted_buckets = bucket[order]
+    first = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])  # lowest of each bucket
+    last = np.r_[first[1:] - 1, len(order) - 1]  # highest of each bucket
+    return np.unique(np.concatenate([order[first], order[last], [0, len(x) - 1]]))
+
+
+def lttb(x, y, points):
+    """
+        Largest-Triangle-Three-Buckets: keeps the points that best preserve the visual shape of the line. From each
+        bucket it keeps the point forming the largest triangle with the previously kept point and the average of the
+        next bucket. Smoother looking than minmax, but it can drop an isolated spike.
+    :param x: sorted numeric array (datetimes as int64 nanoseconds)
+    :param y: array of values
+    :param points: number of points to keep
+    :return: sorted array of positions to keep
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) <= points or points < 3:
+        return np.arange(len(x))
+
+    # the first and last points are always kept, the rest are split into points - 2 buckets
+    edges = np.linspace(1, len(x) - 1, points - 1).astype(np.int64)
+    kept = np.empty(points, dtype=np.int64)
+    kept[0], kept[-1] = 0, len(x) - 1
+
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else len(x)
+        average_x = x[stop:next_stop].mean()
+        average_y = y[stop:next_stop].mean()
+
+        previous = kept[i]
+        area = np.abs((x[previous] - average_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (average_y - y[previous]))
+        kept[i + 1] = start + int(np.argmax(area))
+    return kept
+
+
+def _bucket_of(x, buckets):
+    span = x[-1] - x[0]
+    if span == 0:
+        return np.zeros(len(x), dtype=np.int64)
+    return np.minimum(((x - x[0]) / span * buckets).astype(np.int64), buckets - 1)
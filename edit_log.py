@@ -0,0 +1,206 @@
+# Undo and redo for the working dataframe.
+#
+# Every edit is recorded as an operation on row ids: a value edit keeps the rows' pressures from before and after it,
+# a delete only marks its rows dead in a tombstone mask, so nothing is ever dropped and concatenated back. Undoing or
+# redoing a step writes one side of it back into the full-length arrays, which takes time proportional to the rows it
+# touched and gives back exactly the same floats. Every so often the pressures and mask are copied into a checkpoint,
+# so jumping far back or forward in the history starts from the nearest checkpoint instead of stepping through every
+# operation.
+#
+# The frame is a copy of the alive rows of the full-length columns. Value edits, their undo and redo patch it in place,
+# in time proportional to their rows. A delete, its undo or redo, or a jump changes which rows are alive, so it only
+# marks the frame out of date, and the frame is copied from the columns again when it is next read: that read costs
+# one copy of the alive rows (about 1.5 ms per 100k rows), however many steps came before it.
+
+import numpy as np
+import pandas as pd
+
+# Operations between checkpoints
+CHECKPOINT_EVERY = 25
+
+
+class EditLog:
+    """
+        The edit history of one working dataframe
+
+        Row ids (the frame's index) have to count up in time order, as main_query makes them, so rows can be found
+        with a binary search.
+
+        Attributes
+        ----------
+        frame : pandas.DataFrame
+            The current working frame, the rows that aren't deleted. Value edits change it in place, after deletes
+            and jumps it is built again when it is next read.
+        rows : int
+            Number of rows in the frame, without building it
+        position : int
+            Number of operations currently applied, undo goes back one, redo forward one
+        base : int
+            Number of changes that were already applied to the frame the log started from (eg. a resumed session)
+        ops : list of dict
+            Every operation recorded, the ones past position have been undone and can be redone
+
+        Methods
+        -------
+        set_values(rows, values)
+            Records and applies new pressures for some rows
+        delete(rows)
+            Records and applies deleting some rows
+        undo()
+            Steps back one operation
+        redo()
+            Steps forward one operation
+        jump(step)
+            Goes to any position in the history
+        nbytes()
+            Returns the memory the history holds on to
+    """
+
+    def __init__(self, df, column='pressure_hobo', checkpoint_every=CHECKPOINT_EVERY, base=0):
+        self.column = column
+        self.checkpoint_every = checkpoint_every
+        self.base = base
+        self.position = 0
+        self.ops = []
+
+        self._ids = df.index.values
+        self._columns = {name: df[name].values.copy() for name in df.columns}  # every row ever loaded
+        self._alive = np.ones(len(df), dtype=bool)  # False for deleted rows
+        self._checkpoints = {0: (self._columns[column].copy(), self._alive.copy())}
+        self._frame = df
+        self._stale = False  # True once the frame no longer matches the columns and mask
+        self.rows = len(df)
+
+    @property
+    def frame(self):
+        if self._stale:
+            alive = self._alive
+            self._frame = pd.DataFrame({name: values[alive] for name, values in self._columns.items()},
+                                       index=pd.Index(self._ids[alive], name=self._frame.index.name))
+            self._stale = False
+        return self._frame
+
+    def __len__(self):
+        return len(self.ops)
+
+    def nbytes(self):
+        """
+            Returns the bytes held by the full-length columns, the checkpoints and the recorded operations, not counting
+            the frame itself
+        :return: int
+        """
+        arrays = [self._ids, self._alive, *self._columns.values()]
+        arrays += [array for checkpoint in self._checkpoints.values() for array in checkpoint]
+        arrays += [op[key] for op in self.ops for key in ('rows', 'positions', 'before', 'after') if key in op]
+        return sum(array.nbytes for array in arrays)
+
+    def set_values(self, rows, values):
+        """
+            Sets the pressure of some rows and records the old values so it can be undone
+        :param rows: row ids
+        :param values: the new values, one per row
+        :return: the edit for SessionStore.commit
+        """
+        rows = np.asarray(rows, dtype=self._ids.dtype)
+        positions = self._positions(rows)
+        op = {'kind': 'values', 'rows': rows, 'positions': positions,
+              'before': self._columns[self.column][positions].copy(),
+              'after': np.asarray(values, dtype=self._columns[self.column].dtype)}
+        return self._push(op)
+
+    def delete(self, rows):
+        """
+            Marks some rows deleted
+        :param rows: row ids
+        :return: the edit for SessionStore.commit
+        """
+        rows = np.asarray(rows, dtype=self._ids.dtype)
+        return self._push({'kind': 'delete', 'rows': rows, 'positions': self._positions(rows)})
+
+    def undo(self):
+        """
+            Undoes the last applied operation
+        :return: the edit for SessionStore.commit, or None if there is nothing to undo
+        """
+        if self.position == 0:
+            return None
+        self.position -= 1
+        op = self.ops[self.position]
+        self._apply(op, forward=False)
+        return self._refresh(op, forward=False)
+
+    def redo(self):
+        """
+            Redoes the last undone operation
+        :return: the edit for SessionStore.commit, or None if there is nothing to redo
+        """
+        if self.position == len(self.ops):
+            return None
+        op = self.ops[self.position]
+        self._apply(op, forward=True)
+        self.position += 1
+        return self._refresh(op, forward=True)
+
+    def jump(self, step):
+        """
+            Goes to the state after the first step operations, from the nearest checkpoint or the current position,
+            whichever means replaying fewer operations
+        :param step: number of operations to have applied, 0 for the data as it was loaded
+        :return: None, the whole frame may have changed
+        """
+        step = min(max(step, 0), len(self.ops))
+        checkpoint = max(number for number in self._checkpoints if number <= step)
+        if step - checkpoint < abs(step - self.position):
+            values, alive = self._checkpoints[checkpoint]
+            self._columns[self.column][:] = values
+            self._alive[:] = alive
+            self.rows = int(np.count_nonzero(alive))
+            self.position = checkpoint
+
+        while self.position > step:
+            self.position -= 1
+            self._apply(self.ops[self.position], forward=False)
+        while self.position < step:
+            self._apply(self.ops[self.position], forward=True)
+            self.position += 1
+
+        self._stale = True
+        return None
+
+    def _push(self, op):
+        # a new edit after some undos throws away the undone ones, like any editor
+        del self.ops[self.position:]
+        for number in [number for number in self._checkpoints if number > self.position]:
+            del self._checkpoints[number]
+
+        self.ops.append(op)
+        self._apply(op, forward=True)
+        self.position += 1
+        if self.position % self.checkpoint_every == 0:
+            self._checkpoints[self.position] = (self._columns[self.column].copy(), self._alive.copy())
+        return self._refresh(op, forward=True)
+
+    def _apply(self, op, forward):
+        # only the full-length arrays, the frame is brought up to date by _refresh or when it is next read
+        if op['kind'] == 'values':
+            self._columns[self.column][op['positions']] = op['after'] if forward else op['before']
+        else:
+            self._alive[op['positions']] = not forward
+            self.rows += -len(op['positions']) if forward else len(op['positions'])
+
+    def _refresh(self, op, forward):
+        if op['kind'] == 'values':
+            if not self._stale:  # the rows are all in the frame, write just them
+                positions = np.searchsorted(self._frame.index.values, op['rows'])
+                column = self._frame.columns.get_loc(self.column)
+                self._frame.iloc[positions, column] = op['after'] if forward else op['before']
+            return {'kind': 'update', 'rows': op['rows']}
+
+        self._stale = True
+        return {'kind': 'delete' if forward else 'insert', 'rows': op['rows']}
+
+    def _positions(self, rows):
+        positions = np.searchsorted(self._ids, rows)
+        if len(rows) and (positions.max() >= len(self._ids) or (self._ids[positions] != rows).any()):
+            raise KeyError("rows that were never in the frame")
+        return positions
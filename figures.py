@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from dash import Patch
+
+from downsample import minmax
+from instrumentation import instrumented
+from summaries import LEVELS
+
+# Above this many points in view, the graph is downsampled (about two points per pixel of a wide plot)
+MAX_POINTS = 4000
+
+# Above this many drawn points, the browser draws with WebGL instead of one SVG element per point
+WEBGL_POINTS = 1000
+
+# Discharge readings further than this from any pressure reading show no pressure when hovered
+DISCHARGE_TOLERANCE = pd.Timedelta(hours=1)
+
+# The discharge overlay's axis, on the right of the plot
+DISCHARGE_AXIS = {'title': 'discharge_measured', 'overlaying': 'y', 'side': 'right', 'showgrid': False}
+
+# When an edit touches more than this share of a trace's points, the whole trace is resent instead of point by point
+PATCH_WHOLE_TRACE = 0.25
+
+
+def window_from_relayout(relayoutData):
+    """
+        Reads the visible time window out of the graph's relayoutData
+    :param relayoutData: relayoutData property of the graph
+    :return: [t0, t1] strings, None when the graph was reset to show everything, or False if the x-axis didn't change
+    """
+    if not relayoutData:
+        return False
+    if relayoutData.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayoutData and 'xaxis.range[1]' in relayoutData:
+        return [relayoutData['xaxis.range[0]'], relayoutData['xaxis.range[1]']]
+    if 'xaxis.range' in relayoutData:
+        return list(relayoutData['xaxis.range'])
+    return False  # eg. a selection or a change of drag mode
+
+
+def rows_in_window(df, window):
+    """
+        Returns the rows of a datetime sorted frame that fall inside a time window
+    :param df: working dataframe, sorted by datetime
+    :param window: [t0, t1] or None for every row
+    :return: a slice of df
+    """
+    if not window:
+        return df
+    times = df['datetime'].values
+    start = np.searchsorted(times, np.datetime64(pd.Timestamp(window[0])), side='left')
+    stop = np.searchsorted(times, np.datetime64(pd.Timestamp(window[1])), side='right')
+    return df.iloc[start:stop]
+
+
+@instrumented("figure")
+def build_figure(df, window=None, max_points=MAX_POINTS, discharge=None):
+    """
+        Builds the pressure scatter plot. When more than max_points are in view, only the lowest and highest reading
+        of each pixel-wide time bucket are drawn, so spikes stay visible but the browser gets a few thousand points.
+        Every point carries its row id (the frame's index) in customdata.
+    :param df: working dataframe, sorted by datetime
+    :param window: [t0, t1] to draw, None for everything
+    :param max_points: most points to send to the browser
+    :param discharge: the site's discharge readings to overlay on a second y-axis, None for pressure only
+    :return: the figure, and the view: {'window', 'downsampled', 'traces': the row ids drawn by each trace,
+        'discharge': whether the overlay is drawn (after the pressure traces)}
+    """
+    in_view = rows_in_window(df, window)
+    downsampled = len(in_view) > max_points
+    if downsampled:
+        keep = minmax(in_view['datetime'].values.astype(np.int64), in_view['pressure_hobo'].values, max_points // 2)
+        in_view = in_view.iloc[keep]
+
+    plotted = pd.DataFrame({
+        'datetime': in_view['datetime'].values,
+        'pressure_hobo': in_view['pressure_hobo'].values,
+        'batch_id': in_view['batch_id'].astype(str).values,  # strings so each batch gets its own colour
+        'row_id': in_view.index.values,
+    })
+    fig = px.scatter(plotted, x='datetime', y='pressure_hobo', color='batch_id', custom_data=['row_id'],
+                     render_mode='webgl' if len(plotted) > WEBGL_POINTS else 'svg')
+
+    # keep the user's zoom and legend clicks when the data changes underneath them
+    fig.update_layout(uirevision='pressure')
+    if window:
+        fig.update_xaxes(range=window)
+    if downsampled:
+        fig.update_layout(title=f"Showing {len(plotted)} of {len(rows_in_window(df, window))} points, "
+                                f"zoom in for full resolution")
+
+    traces = [trace.customdata[:, 0].tolist() if len(trace.customdata) else [] for trace in fig.data]
+    if discharge is not None:
+        fig.add_trace(discharge_trace(discharge, df, window, max_points))
+        fig.update_layout(yaxis2=DISCHARGE_AXIS)
+    return fig, {'window': window, 'downsampled': downsampled, 'traces': traces, 'discharge': discharge is not None}
+
+
+@instrumented("figure")
+def discharge_trace(discharge, df, window=None, max_points=MAX_POINTS):
+    """
+        Builds the discharge overlay for the pressure plot. Each discharge reading is matched to the nearest pressure
+        reading in time with one as-of merge, so hovering it shows the pressure it should line up with. The trace
+        has no customdata, so selecting its points never selects pressure rows.
+    :param discharge: discharge readings with datetime and discharge_measured columns, sorted by datetime
+    :param df: working dataframe, sorted by datetime
+    :param window: [t0, t1] to draw, None for everything
+    :param max_points: most points to send to the browser, a continuous gauge is downsampled like pressure is
+    :return: a plotly trace on the second y-axis
+    """
+    in_view = rows_in_window(discharge, window)
+    if len(in_view) > max_points:
+        keep = minmax(in_view['datetime'].values.astype(np.int64), in_view['discharge_measured'].values,
+                      max_points // 2)
+        in_view = in_view.iloc[keep]
+
+    aligned = pd.merge_asof(in_view[['datetime', 'discharge_measured']],
+                            df[['datetime', 'pressure_hobo']].drop_duplicates('datetime'),
+                            on='datetime', direction='nearest', tolerance=DISCHARGE_TOLERANCE)
+
+    scatter = go.Scattergl if len(aligned) > WEBGL_POINTS else go.Scatter
+    return scatter(x=aligned['datetime'], y=aligned['discharge_measured'], name='discharge', yaxis='y2',
+                   mode='lines+markers', marker={'color': 'black', 'symbol': 'diamond'},
+                   text=aligned['pressure_hobo'].round(3).astype(str).replace('nan', 'none nearby'),
+                   hovertemplate='%{x}<br>discharge: %{y}<br>pressure: %{text}<extra></extra>')
+
+
+@instrumented("figure")
+def build_overview(summary, level, window=None):
+    """
+        Builds a quick overview of a site from its summaries (see summaries.py), drawn while the raw readings load: the
+        lowest and highest reading of each bucket of time, one trace per batch. The points have no customdata, they
+        aren't rows that can be selected and edited.
+    :param summary: dataframe from Summaries.overview
+    :param level: the summaries' level, eg. "day"
+    :param window: [t0, t1] shown, None for everything
+    :return: the figure, and the view: like build_figure's, with 'overview' set to the level
+    """
+    fig = go.Figure()
+    half = pd.Timedelta(seconds=LEVELS[level] / 2)
+    for batch_id, buckets in summary.groupby('batch_id', sort=True):
+        x = np.repeat((buckets['bucket'] + half).values, 2)  # the middle of the bucket, once for min and once for max
+        y = np.column_stack([buckets['min'].values, buckets['max'].values]).ravel()
+        text = np.repeat([f"{level} mean {mean:.3f} of {count} readings"
+                          for mean, count in zip(buckets['mean'], buckets['count'])], 2)
+        scatter = go.Scattergl if len(x) > WEBGL_POINTS else go.Scatter
+        fig.add_trace(scatter(x=x, y=y, mode='markers', name=str(batch_id), hovertext=text))
+
+    fig.update_layout(uirevision='pressure', legend_title_text='batch_id', yaxis_title='pressure_hobo',
+                      title=f"{level.capitalize()} overview, loading every reading...")
+    if window:
+        fig.update_xaxes(range=window)
+    return fig, {'window': window, 'downsampled': True, 'traces': [[] for _ in fig.data], 'discharge': False,
+                 'overview': level}
+
+
+@instrumented("figure")
+def patch_figure(df, view, edit):
+    """
+        Works out the smallest change to the figure in the browser after an edit, touching only the traces and
+        points the edit affected
+    :param df: working dataframe after the edit
+    :param view: the view returned with the figure currently in the browser
+    :param edit: the edit recorded by the store, {'kind': 'update' or 'delete', 'rows': row ids}
+    :return: the dash Patch and the updated view, or None if the figure has to be redrawn from scratch
+    """
+    if not view or not edit or 'traces' not in view or edit['kind'] not in ('update', 'delete'):
+        return None  # a new site, an undone delete, etc.
+    if view.get('overview'):
+        return None  # the summaries are drawn, not the rows
+    if edit['kind'] == 'delete' and view['downsampled']:
+        return None  # deleted points would leave gaps that other, hidden, points should fill
+
+    edited = np.asarray(edit['rows'])
+    patch = Patch()
+    traces = []
+    for number, rows in enumerate(view['traces']):
+        rows = np.asarray(rows, dtype=np.int64)
+        hit = np.flatnonzero(np.isin(rows, edited))
+        if len(hit) == 0:
+            traces.append(rows.tolist())
+            continue
+
+        if edit['kind'] == 'delete':
+            rows = np.delete(rows, hit)
+            kept = df.loc[rows]
+            patch['data'][number]['x'] = kept['datetime'].tolist()
+            patch['data'][number]['y'] = kept['pressure_hobo'].tolist()
+            patch['data'][number]['customdata'] = [[row] for row in rows.tolist()]
+        elif len(hit) > PATCH_WHOLE_TRACE * len(rows):
+            patch['data'][number]['y'] = df.loc[rows, 'pressure_hobo'].tolist()
+        else:
+            for position, value in zip(hit.tolist(), df.loc[rows[hit], 'pressure_hobo'].tolist()):
+                patch['data'][number]['y'][position] = value
+        traces.append(rows.tolist())
+
+    return patch, dict(view, traces=traces)
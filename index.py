@@ -1,153 +1,47 @@
+import numpy as np
+
+import calendar_index
+
 startYear = 18
 dayToIndexRatio = 1 / (4 * 24)
 indexToDayRatio = 4 * 24
-
-
-# FIXME!!! THIS CODE IS SUUUUPER inefficient somehow. It makes the entire program almost unusable
+secondToIndexRatio = 1 / (24 * 60 * 60)
 
 
 def getDaysInYear(year):
     """
         Returns the number of days in a year
-    :param year: int
+    :param year: int (two or four digits)
     :return: int (number of days in the year) (365 or 366)
     """
-    if year % 4 == 0:
-        daysInYear = 366  # if it is a leap year
-    else:
-        daysInYear = 365
-    return daysInYear
+    return 366 if calendar_index.is_leap_year(int(year)) else 365
 
 
 def dateToIndex(year, month, day, startYear):
     """
         Returns the index of a date since October 1, startYear
-    :param year:
+    :param year: two or four digit year
     :param month:
     :param day:
-    :param startYear:
-    :return:
+    :param startYear: two or four digit year the index counts from
+    :return: int (negative for dates before the start)
     """
-    # calculates the number of days since October 1, start year (2018)
-    # FIXME will not work properly for any dates prior to that
-
-    year = int(year)
-    month = int(month)
-    day = int(day)
-
-    index = -1 # the index of the date
-
-    if year % 4 == 0:  # if it is a leap year
-        monthToDays = {1: 31, 2: 29, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
-    else:
-        monthToDays = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
-
-    monthVal = int(month)
-    if startYear == year:
-
-        # then just calculate the day it is in the year and subract 304
-        for preMonth in range(10, monthVal):  # add the previous months
-            index += monthToDays[preMonth]
-
-        index += day  # add the days
-
-        return index
-
-    elif year > startYear:
-        # add the residual from the first year
-        for preMonth in range(10, 13):
-            index += monthToDays[preMonth]
-
-        startYear += 1
-        # now treat as if we were calculating days since Jan 1, (startYear + 1)
-
-        # add the years
-        numYears = year - startYear
-        currentYear = startYear
-        for yearSinceStart in range(numYears):
-            if currentYear % 4 == 0:
-                daysInYear = 366
-            else:
-                daysInYear = 365
-            currentYear += 1
-
-            index = index + daysInYear
-
-        # add the months
-        if year % 4 == 0:  # if it is a leap year
-            monthToDays = {1: 31, 2: 29, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
-        else:
-            monthToDays = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
-
-        monthVal = int(month)
-
-        if monthVal > 1:
-            for month in range(1, monthVal):  # don't include the current month because it isn't over yet!
-                index = index + monthToDays[month]
-
-        index = index + day
-
-        return index
+    date = calendar_index.from_fields(int(year), int(month), int(day))
+    return int(round(calendar_index.to_index(date, calendar_index.origin(int(startYear)))))
 
 
 def indexToDatetime(index, startYear):
     """
         Returns the datetime for an index
-    :param index:  int
-    :param startYear:  int
+    :param index:  float (days since October 1, startYear)
+    :param startYear:  int, a two digit startYear gives back two digit years
     :return: year, month, day, hour, minute, second
     """
-    # index must represent days since Oct 1, startYear
-
-    # put everything back into the framework of normal years (Jan 1, startYear)
-    if (startYear % 4) == 0:  # if it is a leap year
-        monthToDays = {1: 31, 2: 29, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
-    else:
-        monthToDays = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
-
-    for month in range(1, 10):
-        index += monthToDays[month]
-    index += 1
-    currentIndex = 0
-
-    timeIndex = index - int(index)
-
-    index = int(index)
     startYear = int(startYear)
-
-    year = startYear
-    while currentIndex < index:
-        daysInYear = getDaysInYear(year)
-        currentIndex += daysInYear
-        year += 1
-
-    year = year - 1
-    currentIndex = currentIndex - daysInYear
-
-    if getDaysInYear(year) == 366:  # if it is a leap year
-        monthToDays = {1: 31, 2: 29, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
-    else:
-        monthToDays = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
-
-    month = 1
-    while currentIndex < index:
-        currentIndex += monthToDays[month]
-        month += 1
-
-    month = month - 1
-    currentIndex -= monthToDays[month]
-
-    day = 1
-    while currentIndex < index:
-        currentIndex += 1
-        day += 1
-    day = day - 1
-
-    hour = int(timeIndex * 24)
-    timeIndex = timeIndex - (hour / 24)
-    minute = int(timeIndex * 24 * 60)
-    timeIndex = timeIndex - ((minute / 24) / 60)
-    second = int(timeIndex * 24 * 60 * 60)
+    datetime = calendar_index.from_index(index, calendar_index.origin(startYear))
+    year, month, day, hour, minute, second = (int(field) for field in calendar_index.to_fields(datetime))
+    if startYear < 100:
+        year -= 2000
 
     return year, month, day, hour, minute, second
 
@@ -161,38 +55,25 @@ def timeToIndex(hour, minute, second, index):
     return index
 
 def datetimeToIndex(year, month, day, hour, minute, second):
-    index1 = dateToIndex(year, month, day, startYear)
-    index = timeToIndex(hour, minute, second, index1)
-
-    return index
+    datetime = calendar_index.from_fields(int(year), int(month), int(day), int(hour), int(minute), float(second))
+    return float(calendar_index.to_index(datetime, calendar_index.origin(startYear)))
 
 startIndex = datetimeToIndex(str(startYear), "10", "01", "00", "00", "00")
 startIndex = round(startIndex / dayToIndexRatio) * dayToIndexRatio
 
-def getDaysInYear(year):
-    #sees if it's a leap year or not
-    if year % 4 == 0:
-        daysInYear = 366
-    else:
-        daysInYear = 365
-    return daysInYear
-
-oldIndices = []
-newIndices = []
-numOff = 0
-for i in range(0,600):
-    index = i
-    for j in range(int(1 / dayToIndexRatio)):
 
+def validateRoundTrip(numDays=600):
+    """
+        Round-trips every 15 minute index of the first numDays days through indexToDatetime and datetimeToIndex, the
+        wrappers the app uses, one index at a time like the check that used to run on import.
+        This is only run on request (see benchmarks.py), never on import.
+    :param numDays: int (number of days to check)
+    :return: int (number of indices that did not come back unchanged)
+    """
+    numOff = 0
+    for index in np.arange(numDays * indexToDayRatio) * dayToIndexRatio:
         year, month, day, hour, minute, second = indexToDatetime(index, startYear)
-
-        date = str(year) + "-" + str(month) + "-" + str(day) + " " + str(hour) + ":" + str(minute) + ":" + str(second)
-
-        if month == "13":
-            print(month)
         newIndex = datetimeToIndex(year, month, day, hour, minute, second)
-
-        newIndices.append(newIndex)
-        oldIndices.append(index)
-        if newIndex - index != 0:
+        if abs(newIndex - index) > 0.5 * secondToIndexRatio:  # more than half a second out
             numOff += 1
+    return numOff
@@ -0,0 +1,280 @@
+# Opt-in timing of the app's callbacks, background jobs, queries, store and figure building, for finding out where a
+# slow request spends its time.
+#
+# Set PRESSUREGUI_METRICS=1 before starting the app to turn it on. Every callback call is then timed along with the
+# instrumented functions it calls (its stages, eg. SessionStore.get, build_figure, or the sql and parse steps of
+# get_pressure), the bytes of its inputs and outputs, and the rows the queries return. Each call is written as one JSON
+# line to PRESSUREGUI_METRICS_LOG (default metrics.log, set it to nothing for no log), and
+# http://127.0.0.1:8050/metrics sums them up per function.
+#
+# Set PRESSUREGUI_PROFILE to a number of milliseconds to also run every callback and job under cProfile, and keep the
+# profile of each call slower than that in PRESSUREGUI_PROFILE_DIR (default profiles/). Open one with
+# `python -m pstats profiles/<file>.prof` or snakeviz.
+#
+# With neither set, the decorators below hand back the functions unchanged, so the app pays nothing for them.
+
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+PROFILE_MS = float(os.environ.get("PRESSUREGUI_PROFILE") or 0)
+ENABLED = bool(os.environ.get("PRESSUREGUI_METRICS")) or PROFILE_MS > 0
+LOG_PATH = os.environ.get("PRESSUREGUI_METRICS_LOG", "metrics.log")
+PROFILE_DIR = Path(os.environ.get("PRESSUREGUI_PROFILE_DIR", "profiles"))
+
+# Calls of each function kept for the percentiles in /metrics
+RECENT = 200
+
+# Kinds of calls that are profiled when PRESSUREGUI_PROFILE is set, the others are profiled as part of them
+PROFILED = ("callback", "job")
+
+_local = threading.local()  # the calls in progress on this thread, innermost last
+
+
+@functools.lru_cache(maxsize=None)
+def _payload_encoder():
+    from plotly.utils import PlotlyJSONEncoder  # only needed once a callback runs, keeps the command line tools light
+
+    class PayloadEncoder(PlotlyJSONEncoder):
+        def default(self, obj):
+            try:
+                return super().default(obj)
+            except TypeError:
+                return str(obj)  # eg. no_update, only its size matters
+    return PayloadEncoder
+
+
+def payload_bytes(value):
+    """
+        Returns about how many bytes a callback's inputs or outputs take in the request or response
+    :param value: anything Dash would send as JSON
+    :return: int, or None if it can't be encoded
+    """
+    try:
+        return len(json.dumps(value, cls=_payload_encoder()))
+    except (TypeError, ValueError):
+        return None
+
+
+class Metrics:
+    """
+        Collects the timed calls, sums them up per function and writes each one to a JSON lines log
+
+        Attributes
+        ----------
+        log_path : str
+            File each call is appended to as a line of JSON, None for no log
+        recent : int
+            Calls of each function kept for percentiles
+
+        Methods
+        -------
+        record(call)
+            Adds a finished call
+        summary()
+            Returns the totals per function, for /metrics
+        reset()
+            Forgets every call
+    """
+
+    def __init__(self, log_path=None, recent=RECENT):
+        self.log_path = log_path
+        self.recent = recent
+
+        self._lock = threading.Lock()
+        self._totals = {}  # function name -> running totals
+        self._durations = {}  # function name -> the latest durations in ms
+
+    def record(self, call):
+        """
+            Adds a finished call to the totals and the log
+        :param call: dict with name, kind, ms, status, stages and optionally in_bytes, out_bytes, rows and profile
+        """
+        with self._lock:
+            totals = self._totals.setdefault(call['name'], {
+                'kind': call['kind'], 'calls': 0, 'errors': 0, 'prevented': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'stages_ms': {}, 'in_bytes': 0, 'out_bytes': 0, 'max_out_bytes': 0, 'rows': None})
+            totals['calls'] += 1
+            totals['errors'] += call['status'] == "error"
+            totals['prevented'] += call['status'] == "prevented"
+            totals['total_ms'] += call['ms']
+            totals['max_ms'] = max(totals['max_ms'], call['ms'])
+            for stage, ms in call['stages'].items():
+                totals['stages_ms'][stage] = totals['stages_ms'].get(stage, 0.0) + ms
+            totals['in_bytes'] += call.get('in_bytes') or 0
+            totals['out_bytes'] += call.get('out_bytes') or 0
+            totals['max_out_bytes'] = max(totals['max_out_bytes'], call.get('out_bytes') or 0)
+            if call.get('rows') is not None:
+                totals['rows'] = call['rows']  # the latest
+            self._durations.setdefault(call['name'], deque(maxlen=self.recent)).append(call['ms'])
+
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a") as file:
+                        file.write(json.dumps(call, default=str) + "\n")
+                except OSError as error:
+                    print(f"ERROR: couldn't write to the metrics log {self.log_path}: {error}")
+                    self.log_path = None  # don't fail every call after this one
+
+    def summary(self):
+        """
+            Returns the totals per function, slowest in total first
+        :return: dict of function name to calls, errors, prevented (PreventUpdate), total, mean, max, p50 and p95
+            ms, mean ms per stage, mean and max payload bytes and the rows of the latest call
+        """
+        with self._lock:
+            functions = {}
+            for name, totals in sorted(self._totals.items(), key=lambda item: -item[1]['total_ms']):
+                calls = totals['calls']
+                durations = sorted(self._durations[name])
+                functions[name] = {
+                    'kind': totals['kind'], 'calls': calls, 'errors': totals['errors'],
+                    'prevented': totals['prevented'], 'total_ms': round(totals['total_ms'], 3),
+                    'mean_ms': round(totals['total_ms'] / calls, 3), 'max_ms': round(totals['max_ms'], 3),
+                    'p50_ms': round(durations[len(durations) // 2], 3),
+                    'p95_ms': round(durations[min(int(len(durations) * 0.95), len(durations) - 1)], 3),
+                    'stages_mean_ms': {stage: round(ms / calls, 3) for stage, ms in totals['stages_ms'].items()},
+                    'mean_in_bytes': totals['in_bytes'] // calls, 'mean_out_bytes': totals['out_bytes'] // calls,
+                    'max_out_bytes': totals['max_out_bytes'], 'rows': totals['rows'],
+                }
+            return functions
+
+    def reset(self):
+        """
+            Forgets every call, the log is left alone
+        """
+        with self._lock:
+            self._totals.clear()
+            self._durations.clear()
+
+
+metrics = Metrics(LOG_PATH)
+
+
+def instrumented(kind):
+    """
+        Decorator that times a function while instrumentation is on, and hands it back unchanged while it is off
+    :param kind: "callback", "job", "query", "store" or "figure". Callbacks also record their payload sizes, callbacks
+        and jobs are the calls that get profiled.
+    :return: the decorator
+    """
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return _run(function, kind, args, kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def _stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        calls = getattr(_local, 'calls', None)
+        if calls:
+            stages = calls[-1]['stages']
+            stages[name] = stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def stage(name):
+    """
+        Context manager that adds the time spent in its block to a stage of the call in progress, eg.
+        `with stage("sql"):`. Does nothing while instrumentation is off.
+    :param name: the stage
+    :return: context manager
+    """
+    return _stage(name) if ENABLED else nullcontext()
+
+
+def instrument_callbacks(app):
+    """
+        Makes every callback registered on app after this is called an instrumented one. Call it right after the app
+        is created, before its callbacks are defined.
+    :param app: the Dash (or DashProxy) app
+    """
+    if not ENABLED:
+        return
+    register = app.callback
+
+    @functools.wraps(register)
+    def callback(*args, **kwargs):
+        decorate = register(*args, **kwargs)
+        return lambda function: decorate(instrumented("callback")(function))
+    app.callback = callback
+
+
+def _run(function, kind, args, kwargs):
+    calls = _local.__dict__.setdefault('calls', [])
+    call = {'name': function.__qualname__, 'kind': kind, 'time': time.time(), 'status': "ok", 'stages': {}}
+    if kind == "callback":
+        call['trigger'] = _trigger()
+        call['in_bytes'] = payload_bytes(args)
+
+    profiler = None
+    if PROFILE_MS and kind in PROFILED and not any(outer['kind'] in PROFILED for outer in calls):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is running on this thread
+            profiler = None
+
+    calls.append(call)
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+    except Exception as error:
+        call['status'] = "prevented" if type(error).__name__ == "PreventUpdate" else "error"
+        if call['status'] == "error":
+            call['error'] = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        call['ms'] = (time.perf_counter() - start) * 1000
+        calls.pop()
+        if profiler is not None:
+            profiler.disable()
+            if call['ms'] >= PROFILE_MS:
+                call['profile'] = _save_profile(profiler, call)
+        if calls:  # this call is a stage of the one that called it
+            stages = calls[-1]['stages']
+            stages[call['name']] = stages.get(call['name'], 0.0) + call['ms']
+        if call['status'] != "ok":
+            metrics.record(call)
+
+    if kind == "callback":
+        call['out_bytes'] = payload_bytes(result)
+    if hasattr(result, 'shape'):  # a dataframe
+        call['rows'] = int(result.shape[0])
+    metrics.record(call)
+    return result
+
+
+def _trigger():
+    try:
+        from dash import ctx
+        trigger = ctx.triggered_id
+    except Exception:
+        return None  # called outside a request
+    return trigger if isinstance(trigger, (str, type(None))) else json.dumps(trigger, sort_keys=True, default=str)
+
+
+def _save_profile(profiler, call):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(call['time']))
+    path = PROFILE_DIR / f"{stamp}-{call['name']}-{call['ms']:.0f}ms.prof"
+    try:
+        profiler.dump_stats(path)
+    except OSError as error:
+        print(f"ERROR: couldn't save the profile of {call['name']}: {error}")
+        return None
+    return str(path)
@@ -0,0 +1,213 @@
+# Runs slow work (loading a site) in the background, so a callback can return straight away and the page can poll for
+# progress instead of waiting on one long request.
+#
+# Jobs run on a thread pool inside the server process, next to the session store they read and write. Each job's
+# state (progress, message, result or error) is kept as a small JSON file in a directory, so no Redis or other
+# service is needed and the state can be read by any worker that shares the directory.
+
+import json
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Finished jobs whose state files are kept, older ones are deleted
+KEEP_FINISHED = 100
+
+
+class JobCancelled(Exception):
+    """
+        Raised inside a job by Job.report once the job has been cancelled, so it stops at its next report
+    """
+
+
+class Job:
+    """
+        One piece of background work and its progress
+
+        Attributes
+        ----------
+        id : str
+            Identifies the job, for JobManager.state and cancel
+        key : hashable
+            What the job does, eg. ("query", site_id, user). A job submitted with the key of one still in flight is
+            not run again.
+        status : str
+            "queued", "running", "done", "failed" or "cancelled"
+        progress : float
+            From 0 to 1
+        message : str
+            What the job is doing now
+
+        Methods
+        -------
+        report(progress, message)
+            Records progress, called by the job's function between its steps
+        cancel()
+            Asks the job to stop
+        in_flight()
+            Whether the job is still on its way
+        state()
+            Returns the job's state as a dict
+    """
+
+    def __init__(self, manager, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = "waiting to start"
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+        self._manager = manager
+        self._cancelled = threading.Event()
+
+    def report(self, progress, message):
+        """
+            Records how far the job is, and stops it if it was cancelled
+        :param progress: from 0 to 1
+        :param message: what the job is doing now
+        """
+        if self._cancelled.is_set():
+            raise JobCancelled(self.id)
+        self.progress = progress
+        self.message = message
+        self._manager._save(self)
+
+    def cancel(self):
+        """
+            Asks the job to stop. A queued job never starts, a running one stops at its next report.
+        """
+        self._cancelled.set()
+
+    def in_flight(self):
+        """
+            Whether the job is queued or running and hasn't been asked to stop
+        :return: bool
+        """
+        return self.status in ("queued", "running") and not self._cancelled.is_set()
+
+    def state(self):
+        """
+            Returns the job's state as a JSON serializable dict
+        :return: dict of id, status, progress, message, result, error, submitted and finished
+        """
+        return {"id": self.id, "status": self.status, "progress": self.progress, "message": self.message,
+                "result": self.result, "error": self.error, "submitted": self.submitted, "finished": self.finished}
+
+
+class JobManager:
+    """
+        Runs jobs on a thread pool and keeps their state on disk
+
+        Attributes
+        ----------
+        directory : pathlib.Path
+            Where each job's state is written as <id>.json
+        workers : int
+            Jobs that can run at the same time
+
+        Methods
+        -------
+        submit(key, function, *args)
+            Starts a job, or returns the one already in flight with the same key
+        state(job_id)
+            Returns a job's status, progress and result
+        cancel(job_id)
+            Asks a job to stop
+    """
+
+    def __init__(self, directory=None, workers=2):
+        if directory is None:
+            directory = Path(tempfile.gettempdir()) / "pressuregui_jobs"
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._jobs = {}  # job id -> Job, only while it is in flight
+        self._finished = []  # ids of finished jobs with state files, oldest first
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, key, function, *args):
+        """
+            Runs function(job, *args) in the background. Its return value must be JSON serializable, it becomes the
+            job's result. If a job with the same key is still queued or running, that job is returned instead.
+        :param key: what the job does, eg. ("query", site_id, user)
+        :param function: called as function(job, *args), should call job.report between its steps
+        :return: the Job
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.key == key and job.in_flight():
+                    return job  # the same work is already on its way
+            job = Job(self, key)
+            self._jobs[job.id] = job
+        self._save(job)
+        self._executor.submit(self._run, job, function, args)
+        return job
+
+    def state(self, job_id):
+        """
+            Returns a job's state, from its state file once it has finished
+        :param job_id: the job's id
+        :return: dict of id, status, progress, message, result, error, submitted and finished, or None if the job
+            is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.state()
+        path = self._path(job_id)
+        if path is None or not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+    def cancel(self, job_id):
+        """
+            Asks a job to stop, eg. because the page asked for something else since
+        :param job_id: the job's id
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.cancel()
+
+    def _run(self, job, function, args):
+        try:
+            job.status = "running"
+            job.report(0.0, "starting")  # raises JobCancelled if it was cancelled while queued
+            job.result = function(job, *args)
+            if job._cancelled.is_set():  # cancelled after its last report, the result is kept for whoever cleans it up
+                raise JobCancelled(job.id)
+            job.status, job.progress, job.message = "done", 1.0, "done"
+        except JobCancelled:
+            job.status, job.message = "cancelled", "cancelled"
+        except Exception as error:
+            print(f"ERROR: job {job.key} failed: {error}")
+            job.status, job.error, job.message = "failed", str(error), "failed"
+        job.finished = time.time()
+        self._save(job)
+
+        with self._lock:
+            del self._jobs[job.id]
+            self._finished.append(job.id)
+            stale, self._finished = self._finished[:-KEEP_FINISHED], self._finished[-KEEP_FINISHED:]
+        for job_id in stale:
+            self._path(job_id).unlink(missing_ok=True)
+
+    def _save(self, job):
+        path = self._path(job.id)
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(job.state()))
+        temporary.replace(path)  # so a reader never sees half a file
+
+    def _path(self, job_id):
+        if not isinstance(job_id, str) or not job_id.isalnum():
+            return None  # only ids made by Job become file names
+        return self.directory / f"{job_id}.json"
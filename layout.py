@@ -1,6 +1,12 @@
 import dash_bootstrap_components as dbc
 from dash import Dash, dcc, html, dash_table
 
+from table import COLUMNS
+
+# Sites that can be queried
+SITE_IDS = ['BEN', 'BLI', 'BSL', 'CLE', 'CRB', 'DAI', 'DFF', 'DFL', 'DFM', 'DFU', 'HCL', 'HCN', 'HCS', 'IND', 'LAK',
+            'LDF', 'MIT', 'NEB', 'PBC', 'SBL', 'SFL', 'SHE', 'SOL', 'STR', 'TCU', 'TIE', 'WAN']
+
 # Header contains the title and subtitle
 header = [
     dbc.Row([
@@ -17,16 +23,21 @@ header = [
 # Local storage is used to store data in the browser
 localstorage = [
     dcc.Store(id='memory-output'),
-    # dcc.Store(id='discharge'),
     # dcc.Store(id='selection-stats'),
     dcc.Store(id='history'),
-    dcc.Store(id='updated-table'),
+    dcc.Store(id='redo-history'),  # changes that were undone, the next one to redo last
+    dcc.Store(id='view-window'),  # the graph's visible time window and whether it had to be downsampled
+    dcc.Store(id='session-key'),  # the site and user of the loaded session, for autosaving
+    dcc.Store(id='query-job'),  # the background job loading a site
+    dcc.Store(id='overview-site'),  # the site whose summaries are drawn while it loads
+    dcc.Interval(id='job-poll', interval=250, disabled=True),  # only ticks while a site is loading
 ]
 
 # Download is used to hold the dcc.Download components
 download = [
     dcc.Download(id="download-csv"),
-    dcc.Download(id="changes-csv")
+    dcc.Download(id="changes-csv"),
+    html.Iframe(id="export-frame", style={'display': 'none'}),  # large CSV exports are streamed into this
 ]
 
 # shift_tab is used to hold the shift controls
@@ -55,6 +66,16 @@ compress_tab = [
                n_clicks=0),
 ]
 
+# range_tab is used to hold the time range inputs, an alternative to selecting points on the graph
+range_tab = [
+    html.P("Edit every point from:"),
+    dcc.Input(id="range_start", type="text", placeholder="2019-06-01 00:00", style={'width': '100%'}),
+    html.P("to:"),
+    dcc.Input(id="range_end", type="text", placeholder="2019-07-01 00:00", style={'width': '100%'}),
+    html.Small("Shift, Compress and Delete use this range instead of the graph selection while both are filled in. "
+               "Drawing a new selection on the graph empties it.", className="text-muted"),
+]
+
 # export_tab is used to hold the export controls
 export_tab = [
     html.P("Export as CSV"),
@@ -64,11 +85,14 @@ export_tab = [
                n_clicks=0),
 ]
 
-# history_tab is used to hold the undo button
+# history_tab is used to hold the undo and redo buttons
 history_tab = [
     dbc.Button("Undo", id="undoChange", color="primary",
                style={'display': 'inline-block', "margin": "5px"},
                n_clicks=0),
+    dbc.Button("Redo", id="redoChange", color="primary",
+               style={'display': 'inline-block', "margin": "5px"},
+               n_clicks=0),
     dbc.Accordion([], id="history_log", start_collapsed=True),
 ]
 
@@ -80,9 +104,12 @@ editor = [
         dbc.AccordionItem(shift_tab, title="Shift︎"),
         dbc.AccordionItem(compress_tab, title="Compress"),
         dbc.AccordionItem(delete_tab, title="Delete"),
+        dbc.AccordionItem(range_tab, title="Time Range"),
         dbc.AccordionItem(export_tab, title="Export"),
         dbc.AccordionItem(history_tab, title="History")
     ], start_collapsed=True),
+    html.Small("Select points on the graph, or type a time range, to edit them", id="edit-target",
+               className="text-muted"),  # what Shift, Compress and Delete will act on
     #     ]),
     #
     #     dbc.CardBody(id="editor_card_body")
@@ -100,42 +127,59 @@ layout = dbc.Container([
                 html.H5("Run Site Query"),
                 "Site ID:",
                 dcc.Dropdown(
-                    options=['BEN', 'BLI', 'BSL', 'CLE', 'CRB', 'DAI', 'DFF', 'DFL', 'DFM', 'DFU', 'HCL',
-                             'HCN', 'HCS', 'IND', 'LAK', 'LDF', 'MIT', 'NEB', 'PBC', 'SBL', 'SFL', 'SHE',
-                             'SOL', 'STR', 'TCU', 'TIE', 'WAN'],
+                    options=SITE_IDS,
                     value='BEN',
                     id='site_id',
                     style={'display': 'inline-block', "width": "80%", "margin": "2px"}),
+                "User:",
+                dcc.Input(id="user", type="text", placeholder="your name", persistence=True,
+                          style={'width': '80%', "margin": "2px"}),  # autosaved edits are kept per site and user
+                dbc.Switch(id="resume", label="Resume my autosaved edits", value=True),  # off: load fresh, start over
+                dbc.Switch(id="window-only", label="Load only the window in view", value=False),  # to edit it sooner
                 dbc.Button("Query Site", id="query", color="primary",
                            style={'display': 'inline-block', "margin": "5px"},
-                           n_clicks=0)
+                           n_clicks=0),
+                html.Small(id="query-status", className="text-muted"),
+                html.Small(id="autosave-status", className="text-muted"),
             ], body="true", color="light"),
             html.Hr(),
             *editor,  # *editor expands the editor components into the container
         ], width=3),
         dbc.Col(
-            dbc.Card(
-                dcc.Graph(id='indicator-graphic'), body='True', color="light"), width=9)  # This is the graph
+            dbc.Card([
+                dcc.Graph(id='indicator-graphic'),  # This is the graph
+                dbc.Switch(id='discharge-toggle', label="Show discharge", value=False),  # queried only when on
+                html.Small(id='render-stats', className="text-muted"),  # how long the last graph update took
+            ], body='True', color="light"), width=9)
     ]),
     html.Hr(),
 
     dbc.Row([
         dbc.Col([
-            dbc.Card([  # This is the card that holds the mean and variance information
+            dbc.Card([  # This is the card that holds the statistics of the selection
                 dcc.Markdown("""
-                    **Click Data**
+                    **Selection Statistics**
 
-                    Click on a point from the graph to display more about that observation.
+                    Select points on the graph to see their statistics, overall and for each batch.
                 """),
-                html.P("Selection Mean:"),
-                html.P(id="mean"),
-                html.P("Selection Variance:"),
-                html.P(id="variance"),
+                html.Div(id="selection-stats"),
             ], body="true", color="light")
         ], width=3),
         dbc.Col([
-            dbc.Card([html.Div(id="update-table"),  # This is the card that holds the table
-                      ], body="true", color="light")
+            dbc.Card([html.Div(id="update-table", children=[  # This is the card that holds the table
+                dash_table.DataTable(
+                    id='pressure-table',
+                    columns=[{'id': x, 'name': x} for x in COLUMNS],
+                    page_current=0,
+                    page_size=25,
+                    page_action='custom',  # the server only sends the page being looked at (see table.py)
+                    sort_action='custom',
+                    sort_mode='multi',
+                    sort_by=[],
+                    filter_action='custom',
+                    filter_query='',
+                )
+            ])], body="true", color="light")
         ], width=9)
     ])
 ])
@@ -0,0 +1,149 @@
+# Database maintenance for the queries in run_query.py.
+#
+# `python maintenance.py --db copy.db` shows how SQLite plans each query, times them for every site, creates the
+# covering indexes they need, and then plans and times them again. Use --dry-run to only look.
+# This opens the database for writing, so run it on a copy that the app isn't using. Each query is run once to warm the
+# page cache before it is timed, and the median of RUNS timed runs is reported, so before and after compare the plans
+# rather than a cold cache with a warm one.
+
+import argparse
+import sqlite3
+import statistics
+import time
+from urllib.parse import quote
+
+from run_query import column_name, pressure_query, discharge_query
+
+# Both queries read one site's batches, join them to their readings and keep the newest reading for each date and
+# time. These indexes let SQLite find a site's batches without a scan and read every needed column of the readings
+# straight from the index, already ordered by batch.
+INDEXES = {
+    "hobo_pressure_batches_1_site": "hobo_pressure_batches_1 (site_id, batch_id)",
+    "hobo_pressure_logs_1_batch": "hobo_pressure_logs_1 (batch_id, logging_date, logging_time, {pressure})",
+    "q_batches_site": "q_batches (site_id, q_batch_id)",
+    "q_reads_batch": "q_reads (q_batch_id, date_sampled, time_sampled, {discharge})",
+}
+
+# Timed runs of each query per site, after one untimed run
+RUNS = 3
+
+
+def explain(cursor, sql, site_id):
+    """
+        Returns SQLite's query plan for sql as readable lines
+    :param cursor: cursor object from the database
+    :param sql: query with one parameter (site_id)
+    :param site_id: site to plan the query for
+    :return: list of strings
+    """
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, (site_id,))
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def time_query(cursor, sql, site_id, runs=RUNS):
+    """
+        Runs sql for one site and fetches every row, once to warm the cache and then runs more times
+    :param cursor: cursor object from the database
+    :param sql: query with one parameter (site_id)
+    :param site_id: site to run the query for
+    :param runs: timed runs
+    :return: median seconds taken, number of rows
+    """
+    cursor.execute(sql, (site_id,))
+    rows = len(cursor.fetchall())
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        cursor.execute(sql, (site_id,))
+        cursor.fetchall()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), rows
+
+
+def create_indexes(conn):
+    """
+        Creates the covering indexes for the queries in run_query.py, indexes that already exist are left alone
+    :param conn: writable connection to the database
+    :return: list of the index names that were created
+    """
+    cursor = conn.cursor()
+    columns = {
+        "pressure": column_name(cursor, "hobo_pressure_logs_1", 2),
+        "discharge": column_name(cursor, "q_reads", 4),
+    }
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing = {row[0] for row in cursor.fetchall()}
+
+    created = []
+    for name, definition in INDEXES.items():
+        if name not in existing:
+            cursor.execute(f"CREATE INDEX {name} ON {definition.format(**columns)}")
+            created.append(name)
+    cursor.execute("ANALYZE")  # give the query planner statistics about the new indexes
+    conn.commit()
+    return created
+
+
+def report(cursor, queries, sites):
+    """
+        Prints the plan of each query and how long it takes for each site
+    :param cursor: cursor object from the database
+    :param queries: dict of query name to SQL
+    :param sites: site ids to time the queries for
+    :return: dict of query name to total seconds over every site
+    """
+    totals = {}
+    for name, sql in queries.items():
+        print(f"  {name} plan:")
+        for line in explain(cursor, sql, sites[0]):
+            print(f"    {line}")
+
+        totals[name] = 0.0
+        for site_id in sites:
+            seconds, rows = time_query(cursor, sql, site_id)
+            totals[name] += seconds
+            print(f"    {site_id}: {rows} rows in {seconds * 1000:.1f} ms")
+        print(f"  {name} total: {totals[name]:.3f} s (median of {RUNS} warm runs per site)")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and create the indexes the app's queries need")
+    parser.add_argument("--db", default="copy.db", help="path to the database (default: copy.db)")
+    parser.add_argument("--site", action="append", help="site id to time, repeat for more (default: every site)")
+    parser.add_argument("--dry-run", action="store_true", help="only show plans and timings, don't create indexes")
+    args = parser.parse_args()
+
+    try:  # mode=rw, so a mistyped path is an error instead of a new empty database
+        conn = sqlite3.connect(f"file:{quote(args.db)}?mode=rw", uri=True)
+        cursor = conn.cursor()
+        sites = args.site
+        if not sites:
+            cursor.execute("SELECT DISTINCT site_id FROM hobo_pressure_batches_1 ORDER BY site_id")
+            sites = [row[0] for row in cursor.fetchall()]
+        queries = {"pressure": pressure_query(cursor), "discharge": discharge_query(cursor)}
+    except sqlite3.Error as error:
+        print(f"ERROR: couldn't open the database {args.db}: {error}")
+        return
+    if not sites:
+        print(f"ERROR: {args.db} has no sites to time the queries for")
+        conn.close()
+        return
+
+    print("Before:")
+    before = report(cursor, queries, sites)
+    if args.dry_run:
+        return
+
+    created = create_indexes(conn)
+    print(f"Created indexes: {', '.join(created) if created else 'none, they already exist'}")
+
+    print("After:")
+    after = report(cursor, queries, sites)
+    for name in queries:
+        print(f"{name}: {before[name]:.3f} s -> {after[name]:.3f} s over {len(sites)} sites")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,91 @@
+import numpy as np
 import pandas as pd
-from index import datetimeToIndex, dayToIndexRatio
-from datetime_modifications import correct_datetime, getIndexList, getDateList, joinDict
+from datetime_modifications import correct_datetimes, snap_to_grid
+from instrumentation import instrumented, stage
 
+
+def frame_from_rows(rows, date_col, time_col, value_col, batch_col, value_name, rowid_col=None):
+    """
+        Loads a query result straight into a dataframe and parses its dates column-wise.
+    :param rows: list of tuples from cursor.fetchall()
+    :param date_col: position of the date column in each row
+    :param time_col: position of the time column in each row
+    :param value_col: position of the measured value in each row
+    :param batch_col: position of the batch id in each row
+    :param value_name: name to give the measured value column
+    :param rowid_col: position of the log table's rowid in each row, None to leave it out
+    :return: dataframe with batch_id, datetime, value_name and index columns (and log_rowid), sorted by datetime
+    """
+    result = pd.DataFrame.from_records(rows)
+
+    if result.empty:
+        data = pd.DataFrame({"batch_id": [], "datetime": pd.to_datetime([]), value_name: [], "index": []})
+        if rowid_col is not None:
+            data["log_rowid"] = np.array([], dtype=np.int64)
+        return data
+
+    datetimes = correct_datetimes(result[date_col], result[time_col])
+
+    data = pd.DataFrame({
+        "batch_id": result[batch_col],
+        "datetime": datetimes,
+        value_name: result[value_col],
+        "index": snap_to_grid(datetimes),
+    })
+    if rowid_col is not None:
+        data["log_rowid"] = result[rowid_col]
+    data = data.sort_values(by=['datetime', 'batch_id'], kind='stable')  # the same order however the rows were read
+    return data
+
+
+def column_name(cursor, table, position):
+    """
+        Looks up the name of a table's column by its position, the queries below only rely on column order
+    :param cursor: cursor object from the database
+    :param table: table name
+    :param position: zero based column position
+    :return: column name
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    return cursor.fetchall()[position][1]
+
+
+def pressure_query(cursor):
+    """
+        Returns the SQL for one site's pressure readings. When batches overlap, only the reading from the newest
+        batch (highest batch_id) is kept for each date and time.
+    :param cursor: cursor object from the database
+    :return: SQL with one parameter (site_id) returning logging_date, logging_time, pressure, batch_id
+    """
+    pressure = column_name(cursor, "hobo_pressure_logs_1", 2)
+    return f"""
+        SELECT logging_date, logging_time, {pressure}, batch_id FROM (
+            SELECT logs.logging_date, logs.logging_time, logs.{pressure}, logs.batch_id,
+                   ROW_NUMBER() OVER (PARTITION BY logs.logging_date, logs.logging_time
+                                      ORDER BY logs.batch_id DESC, logs.rowid DESC) AS newest
+            FROM hobo_pressure_logs_1 AS logs INNER JOIN hobo_pressure_batches_1 AS batches USING(batch_id)
+            WHERE batches.site_id = ?
+        ) WHERE newest = 1;"""
+
+
+def discharge_query(cursor):
+    """
+        Returns the SQL for one site's discharge readings, keeping the newest batch's reading for each date and time
+    :param cursor: cursor object from the database
+    :return: SQL with one parameter (site_id) returning q_batch_id, date_sampled, time_sampled, discharge
+    """
+    discharge = column_name(cursor, "q_reads", 4)
+    return f"""
+        SELECT q_batch_id, date_sampled, time_sampled, {discharge} FROM (
+            SELECT reads.q_batch_id, reads.date_sampled, reads.time_sampled, reads.{discharge},
+                   ROW_NUMBER() OVER (PARTITION BY reads.date_sampled, reads.time_sampled
+                                      ORDER BY reads.q_batch_id DESC, reads.rowid DESC) AS newest
+            FROM q_reads AS reads INNER JOIN q_batches AS batches USING(q_batch_id)
+            WHERE batches.site_id = ?
+        ) WHERE newest = 1;"""
+
+
+@instrumented("query")
 def get_pressure(cursor, site_id):
     """
         Gets the pressure data from the database and returns it as a dataframe.
@@ -9,50 +93,96 @@ def get_pressure(cursor, site_id):
     :param site_id: three char site id that matches the database
     :return: dataframe of pressure data
     """
-    indexList = getIndexList()
-    dateList = getDateList(indexList)
-
-    sql_query = "SELECT *, MAX(batch_id) FROM (hobo_pressure_logs_1 INNER JOIN hobo_pressure_batches_1 USING(batch_id)) WHERE site_id = ? GROUP BY logging_date, logging_time;"
-    site_tuple = (site_id,)
-    cursor.execute(sql_query, site_tuple)
-    result = cursor.fetchall()
-    pressure_data = {
-        "index": indexList,
-        "datetime": dateList
-    }
-    pressure_dict = {"batch_id": [], "datetime": [], "pressure_hobo": [], "index": []}
+    with stage("sql"):
+        sql_query = pressure_query(cursor)
+        site_tuple = (site_id,)
+        cursor.execute(sql_query, site_tuple)
+        rows = cursor.fetchall()
 
-    for item in result:
-        batch_id = item[4]
-        date = item[0]
-        time = item[1]
-        pressure = item[2]
-        date = date.split(" ")[0]
-        datetime = date + " " + time
+    with stage("parse"):
+        return frame_from_rows(rows, date_col=0, time_col=1, value_col=2, batch_col=3, value_name="pressure_hobo")
 
-        year, month, day, hour, minute, second = correct_datetime(datetime)
 
-        datetime = day + "/" + month + "/" + year + " " + hour + ":" + minute + ":" + second
-
-        index = datetimeToIndex(year, month, day, hour, minute, second)
-        index = round(index / dayToIndexRatio) * dayToIndexRatio
+def newest_readings(cursor, where, parameters, rowids=False):
+    """
+        Runs the query shared by get_batch_pressure and get_window_pressure: the pressure readings of the log rows
+        matching a condition, keeping only the newest batch's reading for each date and time as in get_pressure
+    :param cursor: cursor object from the database
+    :param where: SQL condition on hobo_pressure_logs_1
+    :param parameters: the condition's parameters
+    :param rowids: also return each reading's rowid in the log table, as a log_rowid column
+    :return: dataframe of pressure data, like get_pressure's
+    """
+    with stage("sql"):
+        pressure = column_name(cursor, "hobo_pressure_logs_1", 2)
+        cursor.execute(f"""
+            SELECT logging_date, logging_time, {pressure}, batch_id, log_rowid FROM (
+                SELECT logging_date, logging_time, {pressure}, batch_id, rowid AS log_rowid,
+                       ROW_NUMBER() OVER (PARTITION BY logging_date, logging_time
+                                          ORDER BY batch_id DESC, rowid DESC) AS newest
+                FROM hobo_pressure_logs_1 WHERE {where}
+            ) WHERE newest = 1;""", parameters)
+        rows = cursor.fetchall()
+
+    with stage("parse"):
+        return frame_from_rows(rows, date_col=0, time_col=1, value_col=2, batch_col=3, value_name="pressure_hobo",
+                               rowid_col=4 if rowids else None)
+
+
+@instrumented("query")
+def get_batch_pressure(cursor, batch_ids, rowids=False):
+    """
+        Gets the pressure readings of some batches. As in get_pressure, where the batches overlap only the newest
+        batch's reading is kept for each date and time.
+    :param cursor: cursor object from the database
+    :param batch_ids: the batches to read
+    :param rowids: also return each reading's rowid in the log table, as a log_rowid column
+    :return: dataframe of pressure data, like get_pressure's
+    """
+    batch_ids = list(batch_ids)
+    if not batch_ids:
+        return frame_from_rows([], 0, 1, 2, 3, value_name="pressure_hobo", rowid_col=4 if rowids else None)
+    return newest_readings(cursor, f"batch_id IN ({', '.join('?' * len(batch_ids))})", batch_ids, rowids)
 
-        pressure_dict["batch_id"].append(batch_id)
-        pressure_dict["datetime"].append(datetime)
-        pressure_dict["pressure_hobo"].append(pressure)
-        pressure_dict["index"].append(index)
 
+@instrumented("query")
+def get_window_pressure(cursor, ranges, window):
+    """
+        Gets the pressure readings in a time window, reading only the log rows that can fall in it: for each batch
+        with readings in the window, the rowids from its first to its last reading there (see Summaries.rowid_ranges).
+        Those are found through the table's rowid, so the rest of the site is neither read nor parsed. Where batches
+        overlap the newest batch's reading wins, as in get_pressure.
+    :param cursor: cursor object from the database
+    :param ranges: dict of batch id to (first rowid, last rowid)
+    :param window: [t0, t1]
+    :return: dataframe of pressure data, like get_pressure's
+    """
+    if not ranges:
+        return frame_from_rows([], 0, 1, 2, 3, value_name="pressure_hobo")
+    where = " OR ".join(["(batch_id = ? AND rowid BETWEEN ? AND ?)"] * len(ranges))
+    parameters = [value for batch_id, (first, last) in ranges.items() for value in (batch_id, first, last)]
+    data = newest_readings(cursor, where, parameters)
+    t0, t1 = (pd.Timestamp(t) for t in window)
+    return data[(data['datetime'] >= t0) & (data['datetime'] <= t1)]  # the ranges can hold a few readings either side
 
-    # pressure_data = joinDict(pressure_dict, pressure_data)
-    # pressure_data = pd.DataFrame.from_dict(pressure_data)
-    #pressure_data = pd.to_datetime(pressure_data.datetime)
 
-    pressure_data = pd.DataFrame(pressure_dict)
-    pressure_data['datetime'] = pd.to_datetime(pressure_data.datetime, format="%d/%m/%y %H:%M:%S")
-    pressure_data = pressure_data.sort_values(by=['datetime'])
-    return pressure_data
+@instrumented("query")
+def working_frame(pressure_data):
+    """
+        Turns a site's pressure readings into the frame the editor works on: readings without a value are dropped and
+        the rows are numbered from 0 in time order, which is what the row ids of edits and change logs refer to.
+    :param pressure_data: dataframe from get_pressure
+    :return: dataframe with batch_id, datetime and pressure_hobo columns
+    """
+    table = pd.DataFrame(pressure_data)  # make sure the data is in a dataframe
+    table['pressure_hobo'] = table['pressure_hobo'].replace('', np.nan)  # replace empty values with NaN
+    table.dropna(subset=['pressure_hobo'], inplace=True)  # drop rows with NaN values
+    table.drop('index', axis=1, inplace=True)  # drop the index column
+    table.reset_index(drop=True, inplace=True)  # row ids count up in time order, the graph's points carry them
+    return table
 
 
+@instrumented("query")
 def get_discharge(cursor, site_id):
     """
         Gets the discharge data from the database and returns it as a dataframe.
@@ -60,50 +190,12 @@ def get_discharge(cursor, site_id):
     :param site_id: three char site id that matches the database
     :return: a dataframe of discharge data
     """
-
-    # INFO: I just copied the get_pressure function and changed the sql query
-
-    indexList = getIndexList()
-    dateList = getDateList(indexList)
-
-    sql_query = "SELECT *, MAX(q_batch_id) FROM q_reads INNER JOIN q_batches USING (q_batch_id) where site_id = ? group by date_sampled, time_sampled order by (date_sampled);"
-    site_tuple = (site_id,)
-    cursor.execute(sql_query, site_tuple)
-    result = cursor.fetchall()
-    discharge_data = {
-        'index': indexList,
-        'datetime': dateList
-    }
-    discharge_dict = {
-        "batch_id": [],
-        "datetime": [],
-        "discharge_measured": [],
-        "index": []
-    }
-
-    for item in result:
-        batch_id = item[0]
-        date = item[2]
-        time = item[3]
-        date = date.split(" ")[0]
-        datetime = date + " " + time
-        discharge = item[4]
-
-        year, month, day, hour, minute, second = correct_datetime(datetime)
-
-        datetime = day + "/" + month + "/" + year + " " + hour + ":" + minute + ":" + second
-
-        index = datetimeToIndex(year, month, day, hour, minute, second)
-        index = round(index / dayToIndexRatio) * dayToIndexRatio
-
-        discharge_dict["batch_id"].append(batch_id)
-        discharge_dict["datetime"].append(datetime)
-        discharge_dict["discharge_measured"].append(discharge)
-        discharge_dict["index"].append(index)
-
-
-    discharge_data = pd.DataFrame(discharge_dict)
-    discharge_data['datetime'] = pd.to_datetime(discharge_data.datetime, format="%d/%m/%y %H:%M:%S")
-    discharge_data = discharge_data.sort_values(by=['datetime'])
-
-    return discharge_data
+    with stage("sql"):
+        sql_query = discharge_query(cursor)
+        site_tuple = (site_id,)
+        cursor.execute(sql_query, site_tuple)
+        rows = cursor.fetchall()
+
+    with stage("parse"):
+        return frame_from_rows(rows, date_col=1, time_col=2, value_col=3, batch_col=0,
+                               value_name="discharge_measured")
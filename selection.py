@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from figures import rows_in_window
+
+
+def has_region(selection):
+    """
+        Whether a selection carries the box or lasso outline it was drawn with
+    :param selection: selectedData property of the graph
+    :return: bool
+    """
+    return selection is not None and ('range' in selection or 'lassoPoints' in selection)
+
+
+def has_time_range(t0, t1):
+    """
+        Whether both ends of an explicit time range were filled in
+    :param t0: start of the range, eg. "2019-06-01"
+    :param t1: end of the range
+    :return: bool
+    """
+    return bool(t0) and bool(t1)
+
+
+def rows_from_points(df, selection):
+    """
+        Looks up the selected points' rows by the row id each plotted point carries in its customdata, rather than by
+        matching their x and y values against the whole frame. Points without a row id (eg. from another trace) and
+        rows that no longer exist are skipped.
+    :param df: working dataframe, indexed by row id
+    :param selection: selectedData property of the graph
+    :return: the selected rows of df, in time order
+    """
+    ids = [point['customdata'][0] for point in selection.get('points', []) if point.get('customdata')]
+    positions = df.index.get_indexer(ids)  # a hash lookup per point
+    return df.iloc[np.unique(positions[positions >= 0])]
+
+
+def rows_in_region(df, selection):
+    """
+        Returns every row inside the box or lasso the user drew, including rows the downsampled graph didn't draw. A
+        box is a time range plus a pressure range, so it is found with two binary searches and the pressures are only
+        compared inside that slice, however long the record is.
+    :param df: working dataframe, sorted by datetime
+    :param selection: selectedData property of the graph, must have a 'range' or 'lassoPoints'
+    :return: the selected rows of df
+    """
+    if 'range' in selection:
+        x, y = selection['range']['x'], selection['range']['y']
+        candidates = rows_in_window(df, sorted(x, key=pd.Timestamp))
+        pressure = candidates['pressure_hobo']
+        return candidates[(pressure >= min(y)) & (pressure <= max(y))]
+
+    x = pd.to_datetime(pd.Series(selection['lassoPoints']['x'])).values.astype(np.int64)
+    y = np.asarray(selection['lassoPoints']['y'], dtype=np.float64)
+    candidates = rows_in_window(df, [pd.Timestamp(x.min()), pd.Timestamp(x.max())])
+    inside = points_in_polygon(candidates['datetime'].values.astype(np.int64), candidates['pressure_hobo'].values, x, y)
+    return candidates[inside]
+
+
+def points_in_polygon(x, y, polygon_x, polygon_y):
+    """
+        Even-odd rule point in polygon test for many points at once
+    :param x: array of point x values
+    :param y: array of point y values
+    :param polygon_x: x values of the polygon's corners, in order
+    :param polygon_y: y values of the polygon's corners, in order
+    :return: boolean array, True for points inside
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    polygon_x = np.asarray(polygon_x, dtype=np.float64)
+    polygon_y = np.asarray(polygon_y, dtype=np.float64)
+
+    inside = np.zeros(len(x), dtype=bool)
+    for x1, y1, x2, y2 in zip(polygon_x, polygon_y, np.roll(polygon_x, -1), np.roll(polygon_y, -1)):
+        if y1 == y2:
+            continue  # horizontal edges never cross a horizontal ray
+        crosses = (y1 > y) != (y2 > y)
+        crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (x < crossing_x)
+    return inside
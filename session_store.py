@@ -0,0 +1,336 @@
+import atexit
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from codec import encode_frame, decode_frame
+from edit_log import EditLog
+from instrumentation import instrumented
+
+
+class SessionExpired(KeyError):
+    """
+        Raised when the browser holds a token for a session the server no longer has (eg. after a restart)
+    """
+
+
+class SessionStore:
+    """
+        Keeps each browser session's working dataframe on the server, so the browser only has to hold a small token
+
+        Frames live in process memory. When the frames in memory add up to more than memory_limit bytes, the least
+        recently used ones are written to local disk (see codec.py) and read back the next time they are needed. The store is
+        shared by every callback of one server process, so all access goes through a lock.
+
+        A frame's bytes per row are measured once, when it is stored as a new frame, and edits only scale that by the
+        rows left, so an edit never pays for measuring the whole frame. The session's EditLog counts towards the limit
+        too. Sessions unused for max_idle seconds are dropped along with their spill files, and every spill file is
+        deleted when the process exits.
+
+        Attributes
+        ----------
+        directory : pathlib.Path
+            Where frames that don't fit in memory are written
+        memory_limit : int
+            Number of bytes of frames to keep in memory before spilling to disk
+        max_idle : float
+            Seconds a session can go unused before it is dropped
+
+        Methods
+        -------
+        create(df)
+            Stores a new frame and returns the token for it
+        get(token)
+            Returns the working frame for a token, edits to it are visible to later callbacks
+        snapshot(token)
+            Returns a copy of the frame as of the token's version, that later edits don't touch
+        put(token, df, edit)
+            Replaces (or marks as edited) the frame for a token and returns the new token
+        last_edit(token)
+            Returns what the edit that produced a token changed, so the graph can be patched instead of redrawn
+        edit_log(token)
+            Returns the session's undo/redo history (see edit_log.py)
+        commit(token, edit)
+            Stores the frame after an edit made through the edit log
+        drop(token)
+            Forgets a session
+        expire()
+            Drops the sessions that haven't been used for max_idle seconds
+        close()
+            Drops every session, called when the process exits
+    """
+
+    def __init__(self, directory=None, memory_limit=512 * 1024 ** 2, max_idle=24 * 3600):
+        if directory is None:
+            directory = Path(tempfile.gettempdir()) / "pressuregui_sessions"
+        self.directory = Path(directory)
+        self.memory_limit = memory_limit
+        self.max_idle = max_idle
+
+        self._lock = threading.RLock()
+        self._frames = OrderedDict()  # session id -> dataframe, least recently used first
+        self._sizes = {}  # session id -> bytes used by the in-memory frame
+        self._versions = {}  # session id -> number of times the frame has been replaced or edited
+        self._edits = {}  # session id -> the edit that produced the current version
+        self._logs = {}  # session id -> EditLog of the frame, while the frame stays in memory
+        self._row_bytes = {}  # session id -> bytes per row of the frame, measured when it was stored
+        self._used = {}  # session id -> time.time() it was last used
+
+        self._remove_stale_files()  # left behind by a process that didn't exit cleanly
+        atexit.register(self.close)
+
+    def create(self, df):
+        """
+            Stores a new frame under a new session id
+        :param df: the working dataframe
+        :return: token to keep in the browser: {"session": id, "version": 0}
+        """
+        self.expire()
+        session = uuid.uuid4().hex
+        with self._lock:
+            self._versions[session] = -1
+            return self.put({"session": session}, df)
+
+    @instrumented("store")
+    def get(self, token):
+        """
+            Returns the working frame for a token. It is the stored frame itself, not a copy.
+        :param token: token from create or put
+        :return: pandas.DataFrame
+        """
+        session = self._session(token)
+        with self._lock:
+            if session in self._frames:
+                self._frames.move_to_end(session)
+                self._used[session] = time.time()
+                return self._frame(session)
+
+            path = self._path(session)
+            if session not in self._versions or not path.exists():
+                raise SessionExpired(session)
+            df = decode_frame(path.read_text())  # it was spilled to disk, bring it back
+            path.unlink()
+            self._remember(session, df)
+            return df
+
+    def snapshot(self, token):
+        """
+            Returns a copy of the working frame, for reading it outside a callback (eg. while streaming an export) while
+            edits carry on
+        :param token: token from create or put, with its version
+        :return: pandas.DataFrame
+        """
+        session = self._session(token)
+        with self._lock:
+            if self._versions.get(session) != token.get("version"):
+                raise SessionExpired(session)  # edited since the token was handed out, it no longer describes the frame
+            return self.get(token).copy()
+
+    @instrumented("store")
+    def put(self, token, df, edit=None):
+        """
+            Stores df as the working frame for a token's session, call this after every edit
+        :param token: token from create or put
+        :param df: the new (or edited in place) working dataframe
+        :param edit: what changed: {'kind': 'update', 'delete' or 'insert', 'rows': row ids}, None for everything
+        :return: new token with the version bumped, so dcc.Store sees a change
+        """
+        session = self._session(token)
+        with self._lock:
+            if session not in self._versions:
+                raise SessionExpired(session)
+            if edit is None:
+                self._logs[session] = EditLog(df)  # a new frame starts a new history
+                self._row_bytes.pop(session, None)  # measure the new frame
+            else:
+                self._logs.pop(session, None)  # edited behind the log's back, it no longer describes the frame
+            return self._store(session, df, edit)
+
+    @instrumented("store")
+    def commit(self, token, edit):
+        """
+            Stores the frame of the session's edit log, call this after editing through edit_log(token)
+        :param token: token from create or put
+        :param edit: the edit returned by the EditLog
+        :return: new token with the version bumped
+        """
+        session = self._session(token)
+        with self._lock:
+            if session not in self._logs:
+                raise SessionExpired(session)
+            return self._store(session, None, edit)  # the log builds the frame when it is next read
+
+    def _store(self, session, df, edit):
+        if session not in self._versions:
+            raise SessionExpired(session)
+        self._versions[session] += 1
+        self._edits[session] = _compact_edit(edit)
+        self._path(session).unlink(missing_ok=True)
+        self._remember(session, df)
+        return {"session": session, "version": self._versions[session]}
+
+    def last_edit(self, token):
+        """
+            Returns the edit passed to the put that produced this token
+        :param token: token from put
+        :return: the edit, or None if it changed everything or the token is out of date
+        """
+        session = self._session(token)
+        with self._lock:
+            if self._versions.get(session) != token.get("version"):
+                return None
+            return self._edits.get(session)
+
+    def edit_log(self, token):
+        """
+            Returns the undo/redo history of a session's frame. Edits made through it have to be followed by commit.
+            There is none once the frame was spilled to disk or edited with put.
+        :param token: token from create or put
+        :return: EditLog, or None
+        """
+        with self._lock:
+            return self._logs.get(self._session(token))
+
+    def drop(self, token):
+        """
+            Forgets a session and deletes anything it spilled to disk
+        :param token: token from create or put
+        """
+        session = self._session(token)
+        with self._lock:
+            self._frames.pop(session, None)
+            self._sizes.pop(session, None)
+            self._versions.pop(session, None)
+            self._edits.pop(session, None)
+            self._logs.pop(session, None)
+            self._row_bytes.pop(session, None)
+            self._used.pop(session, None)
+            self._path(session).unlink(missing_ok=True)
+
+    def expire(self):
+        """
+            Drops the sessions that haven't been used for max_idle seconds, and their spill files
+        :return: number of sessions dropped
+        """
+        cutoff = time.time() - self.max_idle
+        with self._lock:
+            stale = [session for session, used in self._used.items() if used < cutoff]
+            for session in stale:
+                self.drop({"session": session})
+        return len(stale)
+
+    def close(self):
+        """
+            Drops every session and deletes every spill file this store wrote
+        """
+        with self._lock:
+            for session in list(self._versions):
+                self.drop({"session": session})
+
+    def __contains__(self, token):
+        try:
+            return self._session(token) in self._versions
+        except SessionExpired:
+            return False
+
+    def _remember(self, session, df):
+        # df is None when the frame is the session's EditLog's
+        self._frames[session] = df
+        self._frames.move_to_end(session)
+        self._used[session] = time.time()
+        if session not in self._row_bytes:  # a new frame, the only time its object columns are measured
+            self._row_bytes[session] = df.memory_usage(deep=True).sum() / max(len(df), 1)
+        log = self._logs.get(session)
+        rows = len(df) if df is not None else log.rows
+        self._sizes[session] = int(self._row_bytes[session] * rows) + (log.nbytes() if log is not None else 0)
+        self._spill()
+
+    def _frame(self, session):
+        df = self._frames[session]
+        return self._logs[session].frame if df is None else df
+
+    def _spill(self):
+        # write the least recently used frames to disk until the rest fit, always keeping the newest in memory
+        while sum(self._sizes.values()) > self.memory_limit and len(self._frames) > 1:
+            session = next(iter(self._frames))
+            df = self._frame(session)
+            del self._frames[session]
+            del self._sizes[session]
+            self._logs.pop(session, None)  # its history goes too, undo falls back to the change records
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._path(session).write_text(encode_frame(df, compress=False))
+
+    def _path(self, session):
+        return self.directory / f"{session}.frame"
+
+    def _remove_stale_files(self):
+        cutoff = time.time() - self.max_idle
+        for path in self.directory.glob("*.frame"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass  # another process removed it first
+
+    @staticmethod
+    def _session(token):
+        if not isinstance(token, dict) or not isinstance(token.get("session"), str):
+            raise SessionExpired(token)
+        return token["session"]
+
+
+class ClientStore:
+    """
+        Same interface as SessionStore, but the whole frame travels in the token in the compact encoding from codec.py
+
+        Use this when the server can't keep state between requests (eg. several worker processes without a shared
+        store). It costs a decode and an encode per callback, but is still far smaller and faster than to_json.
+    """
+
+    def __init__(self, compress=True):
+        self.compress = compress
+
+    def create(self, df):
+        return {"frame": encode_frame(df, self.compress), "version": 0}
+
+    @instrumented("store")
+    def get(self, token):
+        if not isinstance(token, dict) or not isinstance(token.get("frame"), str):
+            raise SessionExpired(token)
+        return decode_frame(token["frame"])
+
+    def snapshot(self, token):
+        return self.get(token)  # decoded fresh every time already
+
+    @instrumented("store")
+    def put(self, token, df, edit=None):
+        version = token.get("version", -1) + 1 if isinstance(token, dict) else 0
+        return {"frame": encode_frame(df, self.compress), "version": version, "edit": _compact_edit(edit)}
+
+    def last_edit(self, token):
+        return token.get("edit") if isinstance(token, dict) else None
+
+    def edit_log(self, token):
+        return None  # nothing is kept between requests, undo uses the change records
+
+    def drop(self, token):
+        pass
+
+    def expire(self):
+        return 0
+
+    def close(self):
+        pass
+
+    def __contains__(self, token):
+        return isinstance(token, dict) and isinstance(token.get("frame"), str)
+
+
+def _compact_edit(edit):
+    # row ids as a plain list, so the edit can go into a dcc.Store as well
+    if edit is None:
+        return None
+    return {"kind": edit["kind"], "rows": [int(row) for row in edit["rows"]]}
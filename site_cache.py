@@ -0,0 +1,178 @@
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from codec import encode_frame, decode_frame
+from run_query import get_pressure, get_discharge
+
+# For each kind of data: a cheap query that changes whenever a site's data does, and the function that loads it
+SOURCES = {
+    "pressure": (
+        "SELECT MAX(batch_id), COUNT(*) FROM hobo_pressure_logs_1 INNER JOIN hobo_pressure_batches_1 USING(batch_id) "
+        "WHERE site_id = ?",
+        get_pressure,
+    ),
+    "discharge": (
+        "SELECT MAX(q_batch_id), COUNT(*) FROM q_reads INNER JOIN q_batches USING(q_batch_id) WHERE site_id = ?",
+        get_discharge,
+    ),
+}
+
+
+class SiteCache:
+    """
+        An LRU cache of parsed per-site dataframes, so going back to a site doesn't rerun its query and parsing
+
+        Every lookup first asks the database for the site's newest batch id and row count (a fast, index-only query).
+        If either changed since the frame was cached (eg. a new batch was uploaded), the entry is stale and the site
+        is loaded again. Requests for a site that is already being loaded wait for that load instead of running the
+        query again. Frames are kept in memory up to memory_limit bytes, least recently used ones are evicted
+        first. If a directory is given, frames are also written there so the cache survives restarts.
+
+        Attributes
+        ----------
+        memory_limit : int
+            Number of bytes of frames to keep in memory
+        directory : pathlib.Path or None
+            Where to keep frames on disk, None to only cache in memory
+        hits, misses, evictions : int
+            Lookup counters, see stats()
+
+        Methods
+        -------
+        get(cursor, site_id, kind)
+            Returns a copy of the site's frame, loading it if needed
+        invalidate(site_id, kind)
+            Drops a site's frame
+        stats()
+            Returns the counters and current size of the cache
+    """
+
+    def __init__(self, memory_limit=256 * 1024 ** 2, directory=None):
+        self.memory_limit = memory_limit
+        self.directory = Path(directory) if directory else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (kind, site_id) -> (fingerprint, frame), least recently used first
+        self._sizes = {}  # (kind, site_id) -> bytes
+        self._loading = {}  # (kind, site_id) -> lock held while the site is being loaded
+
+    def get(self, cursor, site_id, kind="pressure"):
+        """
+            Returns a site's frame from the cache if it is still current, otherwise loads and caches it
+        :param cursor: cursor object from the database
+        :param site_id: three char site id that matches the database
+        :param kind: "pressure" or "discharge"
+        :return: a copy of the frame, safe to edit
+        """
+        fingerprint_query, loader = SOURCES[kind]
+        cursor.execute(fingerprint_query, (site_id,))
+        fingerprint = tuple(cursor.fetchone())
+        key = (kind, site_id)
+
+        cached = self._lookup(key, fingerprint)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:  # if another request is already loading this site, wait for it and use its frame
+            cached = self._lookup(key, fingerprint)
+            if cached is not None:
+                return cached
+
+            df = self._read_disk(key, fingerprint)
+            with self._lock:
+                if df is not None:
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+            if df is None:
+                df = loader(cursor, site_id)
+                self._write_disk(key, fingerprint, df)
+
+            with self._lock:
+                self._entries[key] = (fingerprint, df)
+                self._entries.move_to_end(key)
+                self._sizes[key] = int(df.memory_usage(deep=True).sum())
+                self._evict()
+        return df.copy()
+
+    def invalidate(self, site_id, kind="pressure"):
+        """
+            Drops a site's frame from memory and disk
+        :param site_id: three char site id
+        :param kind: "pressure" or "discharge"
+        """
+        key = (kind, site_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._sizes.pop(key, None)
+        for path in self._disk_files(key):
+            path.unlink(missing_ok=True)
+
+    def stats(self):
+        """
+            Returns the cache counters and current size
+        :return: dict
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": sum(self._sizes.values()),
+                "memory_limit": self.memory_limit,
+            }
+
+    def _lookup(self, key, fingerprint):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1].copy()
+
+    def _evict(self):
+        # drop least recently used frames until the rest fit, always keeping the newest
+        while sum(self._sizes.values()) > self.memory_limit and len(self._entries) > 1:
+            key, _ = self._entries.popitem(last=False)
+            del self._sizes[key]
+            self.evictions += 1
+
+    def _disk_path(self, key, fingerprint):
+        kind, site_id = key
+        if self.directory is None or not re.fullmatch(r"\w+", str(site_id)):
+            return None  # only plain site ids become file names
+        return self.directory / f"{kind}_{site_id}_{'_'.join(str(part) for part in fingerprint)}.frame"
+
+    def _disk_files(self, key):
+        kind, site_id = key
+        if self.directory is None or not self.directory.exists() or not re.fullmatch(r"\w+", str(site_id)):
+            return []
+        return list(self.directory.glob(f"{kind}_{site_id}_*.frame"))
+
+    def _read_disk(self, key, fingerprint):
+        path = self._disk_path(key, fingerprint)
+        if path is None or not path.exists():
+            return None
+        return decode_frame(path.read_text())
+
+    def _write_disk(self, key, fingerprint, df):
+        path = self._disk_path(key, fingerprint)
+        if path is None:
+            return
+        for stale in self._disk_files(key):
+            stale.unlink(missing_ok=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(encode_frame(df))
+        temporary.replace(path)  # so a crash never leaves half a file behind
@@ -0,0 +1,92 @@
+# Statistics of the readings selected on the graph, for the panel under it.
+#
+# Everything is computed with whole-array numpy operations on the selected rows of the working frame, so a selection
+# of a hundred thousand readings takes milliseconds. Variances are taken per batch from deviations about the batch's
+# own mean, and the batches are then combined with Chan et al.'s parallel formula, which stays accurate when the
+# readings sit far from zero (summing squares and subtracting loses most of the digits there).
+
+import numpy as np
+import pandas as pd
+
+# Columns of the per batch table
+BATCH_COLUMNS = ['batch_id', 'count', 'mean', 'std', 'min', 'max', 'first', 'last', 'slope_per_day']
+
+
+def combine(counts, means, m2s):
+    """
+        Combines the counts, means and sums of squared deviations of groups into those of all of them together
+        (Chan, Golub and LeVeque's parallel update)
+    :param counts: array of group sizes
+    :param means: array of group means
+    :param m2s: array of each group's sum of squared deviations from its mean
+    :return: count, mean and sum of squared deviations of every group together
+    """
+    count = counts.sum()
+    if count == 0:
+        return 0, np.nan, np.nan
+    mean = (counts * means).sum() / count
+    return count, mean, m2s.sum() + (counts * (means - mean) ** 2).sum()
+
+
+def selection_stats(df):
+    """
+        Summarizes selected readings, overall and per batch
+    :param df: rows of the working frame, with batch_id, datetime and pressure_hobo columns, in time order
+    :return: dict of count, mean, std, min, max, median, first, last, span and slope_per_day (least squares pressure
+        change per day), and a dataframe with BATCH_COLUMNS, one row per batch
+    """
+    values = df['pressure_hobo'].to_numpy(dtype=float)
+    days = df['datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64) / 86400e9
+    codes, batch_ids = pd.factorize(df['batch_id'], sort=True)
+
+    # per batch moments, each batch's deviations are about its own mean and time
+    counts = np.bincount(codes, minlength=len(batch_ids))
+    means = np.bincount(codes, values, len(batch_ids)) / np.maximum(counts, 1)
+    day_means = np.bincount(codes, days, len(batch_ids)) / np.maximum(counts, 1)
+    deviations = values - means[codes]
+    day_deviations = days - day_means[codes]
+    m2s = np.bincount(codes, deviations ** 2, len(batch_ids))
+    day_m2s = np.bincount(codes, day_deviations ** 2, len(batch_ids))
+    co_m2s = np.bincount(codes, day_deviations * deviations, len(batch_ids))
+
+    grouped = pd.DataFrame({'code': codes, 'pressure': values, 'datetime': df['datetime'].to_numpy()}) \
+        .groupby('code', sort=True)
+    extremes = grouped['pressure'].agg(['min', 'max'])
+    times = grouped['datetime'].agg(['min', 'max'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):  # one reading, or all at one time, has no spread or slope
+        batches = pd.DataFrame({
+            'batch_id': batch_ids,
+            'count': counts,
+            'mean': means,
+            'std': np.sqrt(m2s / (counts - 1)),
+            'min': extremes['min'].to_numpy(),
+            'max': extremes['max'].to_numpy(),
+            'first': times['min'].to_numpy(),
+            'last': times['max'].to_numpy(),
+            'slope_per_day': co_m2s / day_m2s,
+        }, columns=BATCH_COLUMNS)
+
+    count, mean, m2 = combine(counts, means, m2s)
+    _, _, day_m2 = combine(counts, day_means, day_m2s)
+    if count == 0:
+        return {'count': 0}, batches
+
+    # the cross term combines like a variance, with the time and pressure deviations of the batch means
+    day_mean = (counts * day_means).sum() / count
+    co_m2 = co_m2s.sum() + (counts * (day_means - day_mean) * (means - mean)).sum()
+
+    first, last = df['datetime'].iloc[0], df['datetime'].iloc[-1]
+    overall = {
+        'count': int(count),
+        'mean': mean,
+        'std': np.sqrt(m2 / (count - 1)) if count > 1 else np.nan,
+        'min': values.min(),
+        'max': values.max(),
+        'median': np.median(values),
+        'first': first,
+        'last': last,
+        'span': last - first,
+        'slope_per_day': co_m2 / day_m2 if day_m2 > 0 else np.nan,
+    }
+    return overall, batches
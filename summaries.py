@@ -0,0 +1,261 @@
+# Hourly, daily and weekly summaries of every site's pressure readings, kept in a SQLite sidecar file.
+#
+# For each bucket of time and each batch the sidecar holds the count, min, max and mean of the readings, so a
+# multi-year overview of a site is a few thousand summary rows instead of every raw reading. The graph draws them
+# while the site's raw readings are still loading.
+#
+# `python summaries.py --db copy.db` brings every site's summaries up to date (the app also updates a site's when it
+# is queried). Only new batches are read: the weeks their readings fall in are summarized again, together with the
+# readings of older batches in those weeks, since the newest batch's reading wins where batches overlap.
+#
+# It also holds, for each hour and batch, the first and last rowid of the batch's log rows in that hour, so the raw
+# readings of a time window can be read by rowid without touching the rest of the site (see get_window_pressure).
+
+import argparse
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from database import ConnectionPool
+from run_query import get_batch_pressure, get_window_pressure, working_frame
+
+# Bucket sizes in seconds, finest first
+LEVELS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+
+# Buckets start this many seconds after a multiple of their size, so weeks start on Monday (1970-01-05)
+OFFSETS = {"hour": 0, "day": 0, "week": 4 * 86400}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS batches (
+        site_id TEXT, batch_id INTEGER, start INTEGER, end INTEGER, rows INTEGER, PRIMARY KEY (site_id, batch_id));
+    CREATE TABLE IF NOT EXISTS summaries (
+        site_id TEXT, level TEXT, bucket INTEGER, batch_id INTEGER, count INTEGER, min REAL, max REAL, mean REAL,
+        PRIMARY KEY (site_id, level, bucket, batch_id));
+    CREATE TABLE IF NOT EXISTS rowids (
+        site_id TEXT, batch_id INTEGER, bucket INTEGER, first INTEGER, last INTEGER,
+        PRIMARY KEY (site_id, bucket, batch_id));
+"""
+
+
+def bucket_of(seconds, level):
+    """
+        Returns the start of the bucket each time falls in
+    :param seconds: array of times as seconds since 1970
+    :param level: "hour", "day" or "week"
+    :return: array of bucket starts, seconds since 1970
+    """
+    size, offset = LEVELS[level], OFFSETS[level]
+    return (seconds - offset) // size * size + offset
+
+
+def aggregate(df, level):
+    """
+        Summarizes readings per bucket and batch
+    :param df: dataframe with batch_id, datetime and pressure_hobo columns
+    :param level: "hour", "day" or "week"
+    :return: dataframe with bucket, batch_id, count, min, max and mean columns
+    """
+    seconds = df['datetime'].values.astype('datetime64[s]').astype(np.int64)
+    grouped = pd.DataFrame({'bucket': bucket_of(seconds, level), 'batch_id': df['batch_id'].values,
+                            'pressure': df['pressure_hobo'].values}).groupby(['bucket', 'batch_id'])['pressure']
+    return grouped.agg(['count', 'min', 'max', 'mean']).reset_index()
+
+
+class Summaries:
+    """
+        Per-site hourly, daily and weekly summaries of the pressure readings, kept in a SQLite sidecar file
+
+        Attributes
+        ----------
+        path : pathlib.Path
+            The sidecar database file
+
+        Methods
+        -------
+        update(cursor, site_id)
+            Summarizes the site's batches that aren't summarized yet
+        overview(site_id, window, max_buckets)
+            Returns the finest summary of a time window with at most max_buckets buckets
+        rowid_ranges(site_id, window)
+            Returns the rowids of the log rows each summarized batch has in a time window
+        readings_before(site_id, time)
+            Returns how many of a site's readings come before an hour
+        window_frame(cursor, site_id, window)
+            Loads the working frame of a site's readings in a time window, without the rest of the site
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()  # one update at a time, so two never summarize the same new batch
+
+        with sqlite3.connect(self.path) as connection:
+            connection.executescript(SCHEMA)
+
+    def update(self, cursor, site_id):
+        """
+            Brings a site's summaries up to date with the database. If batches were removed from the database, or
+            the sidecar predates the rowids table, the site is summarized again from scratch.
+        :param cursor: cursor object from the database
+        :param site_id: three char site id that matches the database
+        :return: number of new batches that were summarized
+        """
+        cursor.execute("SELECT batch_id FROM hobo_pressure_batches_1 WHERE site_id = ?", (site_id,))
+        current = {batch_id for batch_id, in cursor.fetchall()}
+
+        with self._lock, sqlite3.connect(self.path) as connection:
+            known = {batch_id: (start, end) for batch_id, start, end in connection.execute(
+                "SELECT batch_id, start, end FROM batches WHERE site_id = ?", (site_id,))}
+            unlocated = connection.execute(
+                "SELECT COUNT(*) FROM batches WHERE site_id = ? AND rows > 0 AND batch_id NOT IN "
+                "(SELECT batch_id FROM rowids WHERE site_id = ?)", (site_id, site_id)).fetchone()[0]
+            if set(known) - current or unlocated:  # a batch was removed or replaced, or summarized without rowids
+                for table in ("batches", "summaries", "rowids"):
+                    connection.execute(f"DELETE FROM {table} WHERE site_id = ?", (site_id,))
+                known = {}
+            new = current - set(known)
+            if not new:
+                return 0
+
+            logged = get_batch_pressure(cursor, new, rowids=True)
+            hours = bucket_of(logged['datetime'].values.astype('datetime64[s]').astype(np.int64), "hour")
+            located = pd.DataFrame({'batch_id': logged['batch_id'].values, 'bucket': hours,
+                                    'rowid': logged['log_rowid'].values}) \
+                .groupby(['batch_id', 'bucket'])['rowid'].agg(['min', 'max']).reset_index()
+            connection.executemany(
+                "INSERT OR REPLACE INTO rowids VALUES (?, ?, ?, ?, ?)",
+                zip([site_id] * len(located), located['batch_id'].tolist(), located['bucket'].tolist(),
+                    located['min'].tolist(), located['max'].tolist()))
+
+            readings = self._readings(logged.drop(columns='log_rowid'))
+            seconds = readings['datetime'].values.astype('datetime64[s]').astype(np.int64)
+            spans = pd.DataFrame({'batch_id': readings['batch_id'].values, 'second': seconds}) \
+                .groupby('batch_id')['second'].agg(['min', 'max', 'count'])
+            batches = [(site_id, int(batch_id), *(
+                (int(spans.at[batch_id, 'min']), int(spans.at[batch_id, 'max']), int(spans.at[batch_id, 'count']))
+                if batch_id in spans.index else (None, None, 0))) for batch_id in sorted(new)]
+
+            if len(readings):
+                # whole weeks, so every hour and day bucket in them is summarized again too
+                start = int(bucket_of(seconds.min(), "week"))
+                end = int(bucket_of(seconds.max(), "week")) + LEVELS["week"]
+                overlapping = [batch_id for batch_id, (first, last) in known.items()
+                               if first is not None and first < end and last >= start]
+                if overlapping:  # the older batches' readings in those weeks may have lost to the new batches
+                    readings = self._readings(get_batch_pressure(cursor, new | set(overlapping)))
+                    seconds = readings['datetime'].values.astype('datetime64[s]').astype(np.int64)
+                readings = readings[(seconds >= start) & (seconds < end)]
+
+                connection.execute("DELETE FROM summaries WHERE site_id = ? AND bucket >= ? AND bucket < ?",
+                                   (site_id, start, end))
+                for level in LEVELS:
+                    summary = aggregate(readings, level)
+                    connection.executemany(
+                        "INSERT INTO summaries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        zip([site_id] * len(summary), [level] * len(summary), summary['bucket'].tolist(),
+                            summary['batch_id'].tolist(), summary['count'].tolist(), summary['min'].tolist(),
+                            summary['max'].tolist(), summary['mean'].tolist()))
+            connection.executemany("INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?, ?)", batches)
+        return len(new)
+
+    def overview(self, site_id, window=None, max_buckets=2000):
+        """
+            Returns the finest summary of a site's readings that has at most max_buckets buckets in the window
+        :param site_id: three char site id
+        :param window: [t0, t1] to summarize, None for everything
+        :param max_buckets: most buckets of time to return
+        :return: dataframe with bucket (datetime), batch_id, count, min, max and mean columns, and the level used,
+            or None and None if the site hasn't been summarized
+        """
+        with sqlite3.connect(self.path) as connection:
+            if window:
+                start, end = (int(pd.Timestamp(t).timestamp()) for t in window)
+            else:
+                start, end = connection.execute("SELECT MIN(start), MAX(end) FROM batches WHERE site_id = ?",
+                                                (site_id,)).fetchone()
+                if start is None:
+                    return None, None
+
+            level = next((level for level, size in LEVELS.items() if (end - start) / size <= max_buckets), "week")
+            summary = pd.read_sql_query(
+                "SELECT bucket, batch_id, count, min, max, mean FROM summaries "
+                "WHERE site_id = ? AND level = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket",
+                connection, params=(site_id, level, int(bucket_of(start, level)), end))
+        summary['bucket'] = pd.to_datetime(summary['bucket'], unit='s')
+        return summary, level
+
+    def rowid_ranges(self, site_id, window):
+        """
+            Returns, for each batch of a site with log rows in a time window, the first and last rowid of its rows in
+            the hours the window covers, so get_window_pressure can read the window without the rest of the site
+        :param site_id: three char site id
+        :param window: [t0, t1]
+        :return: dict of batch id to (first rowid, last rowid), only of batches that have been summarized
+        """
+        start, end = (int(pd.Timestamp(t).timestamp()) for t in window)
+        with sqlite3.connect(self.path) as connection:
+            return {batch_id: (first, last) for batch_id, first, last in connection.execute(
+                "SELECT batch_id, MIN(first), MAX(last) FROM rowids WHERE site_id = ? AND bucket >= ? AND bucket <= ? "
+                "GROUP BY batch_id", (site_id, int(bucket_of(start, "hour")), end))}
+
+    def readings_before(self, site_id, time):
+        """
+            Counts a site's readings before an hour, the row id its first reading from then on has in the site's
+            working frame (see working_frame)
+        :param site_id: three char site id
+        :param time: start of an hour
+        :return: number of readings, with a value, of the newest batches before time
+        """
+        with sqlite3.connect(self.path) as connection:
+            return connection.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM summaries WHERE site_id = ? AND level = 'hour' AND bucket < ?",
+                (site_id, int(pd.Timestamp(time).timestamp()))).fetchone()[0]
+
+    def window_frame(self, cursor, site_id, window):
+        """
+            Loads a site's readings in a time window and nothing else, read by rowid (see get_window_pressure). They
+            are numbered with the row ids they have in the whole site's working frame, counting the readings before
+            the window from the hourly summaries, so edits to the window replay onto the whole site (see
+            batch_clean.py). The site's summaries have to be up to date for that.
+        :param cursor: cursor object from the database
+        :param site_id: three char site id that matches the database
+        :param window: [t0, t1]
+        :return: working dataframe of the readings in the window, like working_frame's
+        """
+        t0, t1 = (pd.Timestamp(t) for t in window)
+        hour = pd.Timestamp(int(bucket_of(int(t0.timestamp()), "hour")), unit='s')  # the summaries count whole hours
+        table = working_frame(get_window_pressure(cursor, self.rowid_ranges(site_id, [hour, t1]), [hour, t1]))
+        table.index += self.readings_before(site_id, hour)
+        return table[table['datetime'] >= t0]
+
+    @staticmethod
+    def _readings(df):
+        df = df.assign(pressure_hobo=pd.to_numeric(df['pressure_hobo'].replace('', np.nan), errors='coerce'))
+        return df.dropna(subset=['pressure_hobo'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the per-site summaries the graph's overview uses up to date")
+    parser.add_argument("--db", default="copy.db", help="path to the database (default: copy.db)")
+    parser.add_argument("--out", default="summaries.db", help="the summaries sidecar file (default: summaries.db)")
+    parser.add_argument("--site", action="append", help="site id to update, repeat for more (default: every site)")
+    args = parser.parse_args()
+
+    summaries = Summaries(args.out)
+    with ConnectionPool(args.db, size=1).cursor() as cursor:
+        sites = args.site
+        if not sites:
+            cursor.execute("SELECT DISTINCT site_id FROM hobo_pressure_batches_1 ORDER BY site_id")
+            sites = [row[0] for row in cursor.fetchall()]
+
+        for site_id in sites:
+            start = time.perf_counter()
+            added = summaries.update(cursor, site_id)
+            print(f"{site_id}: {added} new batches summarized in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# Builds a synthetic logger database with the same tables and column order as the real one, so the app and
+# benchmarks.py can run without a copy of it.
+#
+# `python synth_db.py synthetic.db --sites 27 --years 5` writes years of 15 minute pressure readings for each site, in
+# batches of two to four months that overlap the batch before by a few days, like loggers that were read out late.
+# Each batch writes its dates and times in one of the formats correct_datetimes has to handle, a few readings have no
+# value, and each site gets a discharge measurement about once a month.
+
+import argparse
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from layout import SITE_IDS
+from maintenance import create_indexes
+
+SCHEMA = """
+    DROP TABLE IF EXISTS hobo_pressure_logs_1;
+    DROP TABLE IF EXISTS hobo_pressure_batches_1;
+    DROP TABLE IF EXISTS q_reads;
+    DROP TABLE IF EXISTS q_batches;
+    CREATE TABLE hobo_pressure_batches_1 (batch_id INTEGER PRIMARY KEY, site_id TEXT, uploaded TEXT);
+    CREATE TABLE hobo_pressure_logs_1 (
+        logging_date TEXT, logging_time TEXT, pressure_hobo REAL, temperature_hobo REAL, batch_id INTEGER);
+    CREATE TABLE q_batches (q_batch_id INTEGER PRIMARY KEY, site_id TEXT);
+    CREATE TABLE q_reads (
+        q_batch_id INTEGER, q_read_id INTEGER, date_sampled TEXT, time_sampled TEXT, discharge_measured REAL);
+"""
+
+# Date formats found in the real batches: M-D-YYYY, MM-DD-YY and YYYY-MM-DD with a midnight time after it
+DATE_FORMATS = ["mdy", "mdy2", "ymd"]
+
+# Share of readings logged without a value
+MISSING = 0.001
+
+
+def date_strings(times, date_format):
+    """
+        Formats dates the way one kind of logger export does
+    :param times: pandas.DatetimeIndex
+    :param date_format: one of DATE_FORMATS
+    :return: array of strings
+    """
+    if date_format == "mdy":  # no zero padding, eg. 6-1-2019
+        return (times.month.astype(str) + "-" + times.day.astype(str) + "-" + times.year.astype(str)).to_numpy()
+    if date_format == "mdy2":
+        return times.strftime("%m-%d-%y").to_numpy()
+    return times.strftime("%Y-%m-%d 00:00:00").to_numpy()
+
+
+def time_strings(times, seconds):
+    """
+        Formats times as H:MM, or HH:MM:SS if seconds
+    :param times: pandas.DatetimeIndex
+    :param seconds: whether to write seconds
+    :return: array of strings
+    """
+    if seconds:
+        return times.strftime("%H:%M:%S").to_numpy()
+    return (times.hour.astype(str) + ":" + times.strftime("%M")).to_numpy()
+
+
+def build(path, sites=2, years=3.0, seed=0, start="2018-10-01", overlap_days=5, indexes=False):
+    """
+        Writes a synthetic database, replacing its tables if it already has them
+    :param path: the SQLite file to write
+    :param sites: number of sites, named like the real ones
+    :param years: years of readings per site
+    :param seed: random seed, the same seed gives the same database
+    :param start: date of each site's first reading
+    :param overlap_days: days each batch repeats from the end of the one before
+    :param indexes: also create the indexes maintenance.py recommends
+    :return: number of pressure readings written
+    """
+    rng = np.random.default_rng(seed)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+
+    readings = 0
+    batch_id = 0
+    q_batch_id = 0
+    for site_id in SITE_IDS[:sites]:
+        first = pd.Timestamp(start)
+        end = first + pd.Timedelta(days=365 * years)
+        level = 10 + rng.normal(0, 1)  # each site sits at its own depth
+
+        batch_start = first
+        while batch_start < end:
+            batch_id += 1
+            batch_end = min(batch_start + pd.Timedelta(days=int(rng.integers(60, 121))), end)
+            times = pd.date_range(batch_start, batch_end, freq="15min", inclusive="left")
+
+            # a slow random walk with a daily cycle, and the odd reading without a value
+            days = ((times - first) / pd.Timedelta(days=1)).to_numpy()
+            pressure = level + np.cumsum(rng.normal(0, 0.005, len(times))) + 0.05 * np.sin(2 * np.pi * days)
+            values = pressure.astype(object)
+            values[rng.random(len(times)) < MISSING] = ""
+
+            connection.execute("INSERT INTO hobo_pressure_batches_1 VALUES (?, ?, ?)",
+                               (batch_id, site_id, str(batch_end.date())))
+            connection.executemany(
+                "INSERT INTO hobo_pressure_logs_1 VALUES (?, ?, ?, ?, ?)",
+                zip(date_strings(times, rng.choice(DATE_FORMATS)), time_strings(times, rng.random() < 0.5),
+                    values, np.round(rng.normal(8, 2, len(times)), 2), [batch_id] * len(times)))
+            readings += len(times)
+
+            if batch_end >= end:
+                break
+            batch_start = batch_end - pd.Timedelta(days=overlap_days)
+
+        # a discharge measurement about once a month, at a random quarter hour of the day
+        months = int(years * 12)
+        q_batches = range(q_batch_id + 1, q_batch_id + months + 1)
+        q_batch_id += months
+        sampled = first + pd.to_timedelta(np.arange(months) * 30, unit="D") \
+            + pd.to_timedelta(rng.integers(32, 72, months) * 15, unit="min")
+        connection.executemany("INSERT INTO q_batches VALUES (?, ?)", [(q, site_id) for q in q_batches])
+        connection.executemany(
+            "INSERT INTO q_reads VALUES (?, ?, ?, ?, ?)",
+            zip(q_batches, range(months), date_strings(sampled, "mdy"), time_strings(sampled, False),
+                np.round(rng.lognormal(0, 0.5, months), 3)))
+
+    connection.commit()
+    if indexes:
+        create_indexes(connection)
+    connection.close()
+    return readings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic database shaped like the logger database")
+    parser.add_argument("path", help="the SQLite file to write")
+    parser.add_argument("--sites", type=int, default=2, help=f"number of sites, at most {len(SITE_IDS)} (default: 2)")
+    parser.add_argument("--years", type=float, default=3.0, help="years of readings per site (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--indexes", action="store_true", help="also create the indexes maintenance.py recommends")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    readings = build(args.path, args.sites, args.years, args.seed, indexes=args.indexes)
+    print(f"{readings} readings for {min(args.sites, len(SITE_IDS))} sites written to {args.path} "
+          f"in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+# Server-side paging, sorting and filtering for the pressure DataTable.
+#
+# The table only ever receives the rows of the page being looked at. Sorting and filtering run on the server, and the
+# resulting row order is cached per version of the data, so flipping pages doesn't redo them.
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Columns shown in the table, in order
+COLUMNS = ['batch_id', 'datetime', 'pressure_hobo']
+
+# DataTable filter operators, longest first so "<=" isn't read as "<"
+OPERATORS = [
+    ['ge ', '>='],
+    ['le ', '<='],
+    ['lt ', '<'],
+    ['gt ', '>'],
+    ['ne ', '!='],
+    ['eq ', '='],
+    ['contains '],
+    ['datestartswith '],
+]
+
+_orders = OrderedDict()  # (session, version, sort, filter) -> row ids in display order
+_orders_lock = threading.Lock()
+_ORDERS_KEPT = 16
+
+
+def split_filter_part(filter_part):
+    """
+        Splits one clause of a DataTable filter_query, eg. "{pressure_hobo} > 10"
+    :param filter_part: one clause of the query
+    :return: column name, operator, value (all None if the clause can't be read)
+    """
+    for operator_type in OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                quote = value_part[0] if value_part else ''
+                if quote and quote == value_part[-1] and quote in ("'", '"', '`'):
+                    value = value_part[1:-1].replace('\\' + quote, quote)
+                elif operator_type[0] in ('contains ', 'datestartswith '):
+                    value = value_part  # text matches, so "2019" stays "2019" rather than "2019.0"
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                return name, operator_type[0].strip(), value
+
+    return None, None, None
+
+
+def filter_mask(df, filter_query):
+    """
+        Evaluates a DataTable filter_query against the whole frame at once
+    :param df: working dataframe
+    :param filter_query: filter_query property of the DataTable, clauses joined by " && "
+    :return: boolean array, True for rows that pass, or None if there is nothing to filter
+    """
+    if not filter_query:
+        return None
+
+    mask = np.ones(len(df), dtype=bool)
+    for filter_part in filter_query.split(' && '):
+        name, operator, value = split_filter_part(filter_part)
+        if name not in df.columns:
+            continue
+        column = df[name]
+
+        if operator == 'datestartswith' or (operator == 'contains' and column.dtype.kind == 'M'):
+            mask &= column.astype(str).str.startswith(str(value)).values
+        elif operator == 'contains':
+            mask &= column.astype(str).str.contains(str(value), regex=False).values
+        else:
+            value = _as_column_type(column, value)
+            if value is None:  # eg. "{pressure_hobo} > abc", no row can pass it
+                print(f"ERROR: couldn't read {filter_part.strip()!r} as a filter on {name}, showing no rows")
+                mask[:] = False
+                continue
+            comparison = {'eq': column.eq, 'ne': column.ne, 'lt': column.lt,
+                          'le': column.le, 'gt': column.gt, 'ge': column.ge}[operator]
+            mask &= comparison(value).values
+    return mask
+
+
+def _as_column_type(column, value):
+    # the filter's value as the column's type, None if it can't be
+    if column.dtype.kind == 'M':
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)  # a bare year was read as a number, 2019.0
+        value = pd.to_datetime(str(value), errors='coerce')
+    elif column.dtype.kind in 'iuf':
+        value = pd.to_numeric(value, errors='coerce')
+    else:
+        return str(value)
+    return None if pd.isna(value) else value
+
+
+def display_order(df, sort_by, filter_query, token=None):
+    """
+        Returns the row ids in the order the table shows them, or None when that is just the frame's own order
+    :param df: working dataframe, sorted by datetime
+    :param sort_by: sort_by property of the DataTable
+    :param filter_query: filter_query property of the DataTable
+    :param token: store token for df, used to reuse the order until the data changes
+    :return: array of row ids, or None
+    """
+    if not sort_by and not filter_query:
+        return None
+
+    key = None
+    if isinstance(token, dict) and 'session' in token:
+        key = (token['session'], token.get('version'), repr(sort_by), filter_query)
+        with _orders_lock:
+            if key in _orders:
+                _orders.move_to_end(key)
+                return _orders[key]
+
+    mask = filter_mask(df, filter_query)
+    view = df if mask is None else df[mask]
+    if sort_by:
+        view = view.sort_values([column['column_id'] for column in sort_by],
+                                ascending=[column['direction'] == 'asc' for column in sort_by],
+                                kind='mergesort')  # stable, so ties stay in time order
+    order = view.index.values
+
+    if key is not None:
+        with _orders_lock:
+            _orders[key] = order
+            while len(_orders) > _ORDERS_KEPT:
+                _orders.popitem(last=False)
+    return order
+
+
+def table_page(df, page_current, page_size, order=None):
+    """
+        Returns one page of the table
+    :param df: working dataframe
+    :param page_current: zero based page number
+    :param page_size: rows per page
+    :param order: row ids in display order from display_order, None for the frame's own order
+    :return: the page's rows as a dataframe, and the number of pages
+    """
+    total = len(df) if order is None else len(order)
+    page_count = max(int(np.ceil(total / page_size)), 1)
+    start = page_current * page_size
+    if order is None:
+        page = df.iloc[start:start + page_size]
+    else:
+        page = df.loc[order[start:start + page_size]]
+    return page, page_count
+
+
+def page_of_row(df, row_id, page_size, order=None):
+    """
+        Returns the page a row is shown on
+    :param df: working dataframe
+    :param row_id: the row's id (index label)
+    :param page_size: rows per page
+    :param order: row ids in display order from display_order, None for the frame's own order
+    :return: zero based page number, or None if the row isn't shown (eg. filtered out)
+    """
+    if order is None:
+        if row_id not in df.index:
+            return None
+        position = df.index.get_loc(row_id)
+    else:
+        positions = np.flatnonzero(order == row_id)
+        if len(positions) == 0:
+            return None
+        position = positions[0]
+    return int(position) // page_size
+
+
+def page_records(page):
+    """
+        Converts a page of rows into DataTable records, with each row's id so selections can be highlighted
+    :param page: dataframe of the page's rows
+    :return: list of dicts
+    """
+    records = page[COLUMNS].assign(datetime=page['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+    records['id'] = page.index.values
+    return records.to_dict('records')
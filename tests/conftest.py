@@ -0,0 +1,5 @@
+# The app's modules sit at the top of the repository, not in a package
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,70 @@
+# Change records have to replay and undo to the same frame however compactly they are stored: a uniform shift of
+# consecutive rows keeps only its time range, other changes keep their rows.
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from changes import Change, log_changes
+
+
+def loaded_frame(rows=2000):
+    times = pd.date_range("2019-01-01", periods=rows, freq="15min").values
+    times[1000] = times[999]  # two readings at the same time
+    return pd.DataFrame({
+        'batch_id': np.arange(rows) // 500 + 1,
+        'datetime': times,
+        'pressure_hobo': 10 + np.sin(np.arange(rows) / 50),
+    })
+
+
+def logged(df, rows, amount):
+    """The change record of shifting rows of df by amount, as it comes back out of the history store"""
+    change_df = df.loc[rows].copy()
+    change_df['pressure_hobo'] = amount
+    return Change(log_changes([], "shift", change_df, "shifted", data=df)[-1])
+
+
+def test_consecutive_shift_is_stored_as_a_range():
+    df = loaded_frame()
+    change = logged(df, df.index[100:900], 0.5)
+    record = json.loads(change.to_json())
+    assert record['payload'] is None and record['count'] == 800
+    assert [pd.Timestamp(t) for t in record['params']['range']] == list(df['datetime'].iloc[[100, 899]])
+
+
+def test_range_replays_and_undoes_like_the_rows():
+    df = loaded_frame().drop(range(300, 320))  # deleted earlier, the range runs across the gap
+    rows = df.index[200:900]
+    change = logged(df, rows, 0.5)
+    expected = df.copy()
+    expected.loc[rows, 'pressure_hobo'] += 0.5
+
+    assert change.changes_for(df).index.equals(rows)
+    shifted = change.apply(df.copy())
+    pd.testing.assert_frame_equal(shifted, expected)
+    pd.testing.assert_frame_equal(change.revert(shifted), df)
+
+
+def test_delete_reverts_to_the_same_rows():
+    df = loaded_frame()
+    change_df = df.iloc[990:1010]
+    change = Change(log_changes([], "delete", change_df, "deleted")[-1])
+    deleted = change.apply(df.copy())
+    assert len(deleted) == len(df) - 20
+    pd.testing.assert_frame_equal(change.revert(deleted), df)
+
+
+def test_rows_that_share_an_end_time_keep_their_ids():
+    df = loaded_frame()
+    change = logged(df, df.index[500:1000], 0.5)  # ends at 999, which shares its time with 1000
+    assert 'range' not in change.params
+    pd.testing.assert_index_equal(change.changes_for(df).index, df.index[500:1000])
+
+
+def test_scattered_shift_keeps_its_rows():
+    df = loaded_frame()
+    change = logged(df, df.index[100:900:2], 0.5)
+    assert 'range' not in change.params and change.params['shift'] == 0.5
+    assert len(change.changes_for(df)) == 400
@@ -0,0 +1,51 @@
+# A frame packed by encode_frame has to come back from decode_frame with the same values, dtypes and index, whether
+# or not the payload was compressed.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from codec import encode_frame, decode_frame
+
+
+def mixed_frame(rows=500):
+    """A frame with a column of each kind the codec packs differently"""
+    rng = np.random.default_rng(0)
+    missing = rng.random(rows) < 0.1
+    return pd.DataFrame({
+        'batch_id': np.arange(rows) // 100 + 1,
+        'datetime': pd.date_range("2019-01-01", periods=rows, freq="15min"),
+        'pressure_hobo': 10 + np.cumsum(rng.normal(0, 0.01, rows)),
+        'logged': pd.date_range("2019-01-01", periods=rows, freq="15min", tz="America/Denver"),
+        'count': pd.array(np.where(missing, None, np.arange(rows)), dtype="Int64"),
+        'level': pd.array(np.where(missing, None, rng.random(rows)), dtype="Float64"),
+        'checked': pd.array(np.where(missing, None, rng.random(rows) < 0.5), dtype="boolean"),
+        'note': pd.array(np.where(missing, None, "ok"), dtype="string"),
+        'comment': np.where(missing, None, "ok").astype(object),
+    }, index=pd.Index(np.arange(rows) * 2, name="row_id"))
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip_keeps_dtypes(compress):
+    df = mixed_frame()
+    pd.testing.assert_frame_equal(decode_frame(encode_frame(df, compress)), df)
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip_keeps_index(compress):
+    df = mixed_frame()
+    for index in (pd.RangeIndex(len(df), name="row_id"), pd.DatetimeIndex(df['logged'], name="logged")):
+        indexed = df.set_axis(index)
+        decoded = decode_frame(encode_frame(indexed, compress))
+        pd.testing.assert_frame_equal(decoded, indexed)
+        assert decoded.index.name == index.name
+
+
+def test_empty_frame():
+    df = mixed_frame().iloc[0:0]
+    pd.testing.assert_frame_equal(decode_frame(encode_frame(df)), df)
+
+
+def test_unpackable_dtype_is_rejected():
+    with pytest.raises(TypeError, match="category"):
+        encode_frame(pd.DataFrame({'site': pd.Categorical(["BEN", "BLI"])}))
@@ -0,0 +1,133 @@
+# Undo, redo and jumps through an EditLog have to give back exactly the frame that replaying the same edits on the
+# loaded data gives, whichever checkpoints they start from.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from edit_log import EditLog
+from session_store import SessionStore
+
+
+def loaded_frame(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'batch_id': np.arange(rows) // 500 + 1,
+        'datetime': pd.date_range("2019-01-01", periods=rows, freq="15min"),
+        'pressure_hobo': 10 + np.cumsum(rng.normal(0, 0.01, rows)),
+    })
+
+
+def replay(df, edits):
+    """The frame after applying edits to a fresh copy of df with plain pandas"""
+    df = df.copy()
+    for kind, rows, values in edits:
+        if kind == 'delete':
+            df = df.drop(rows)
+        else:
+            df.loc[rows, 'pressure_hobo'] = values
+    return df
+
+
+def record_edits(log, count, seed=1, delete_every=3):
+    """Makes count random edits through log, every delete_every-th a delete, and returns them for replay"""
+    rng = np.random.default_rng(seed)
+    edits = []
+    for number in range(count):
+        start = int(rng.integers(0, log.rows - 50))
+        rows = log.frame.index[start:start + int(rng.integers(1, 50))]
+        if number % delete_every == delete_every - 1:
+            log.delete(rows)
+            edits.append(('delete', rows, None))
+        else:
+            values = log.frame.loc[rows, 'pressure_hobo'].values + rng.normal(0, 0.1, len(rows))
+            log.set_values(rows, values)
+            edits.append(('values', rows, values))
+    return edits
+
+
+def assert_at(log, loaded, edits, step):
+    assert log.position == step
+    expected = replay(loaded, edits[:step])
+    pd.testing.assert_frame_equal(log.frame, expected, check_exact=True)
+    assert log.rows == len(expected)
+
+
+@pytest.mark.parametrize('checkpoint_every', [4, 25])
+def test_undo_and_redo_match_replay(checkpoint_every):
+    loaded = loaded_frame()
+    log = EditLog(loaded.copy(), checkpoint_every=checkpoint_every)
+    edits = record_edits(log, 30)
+
+    for step in range(len(edits) - 1, -1, -1):
+        log.undo()
+        assert_at(log, loaded, edits, step)
+    assert log.undo() is None
+
+    for step in range(1, len(edits) + 1):
+        log.redo()
+        assert_at(log, loaded, edits, step)
+    assert log.redo() is None
+
+
+def test_jumps_match_replay():
+    loaded = loaded_frame()
+    log = EditLog(loaded.copy(), checkpoint_every=4)
+    edits = record_edits(log, 30)
+
+    for step in [0, 30, 3, 4, 5, 17, 16, 29, 1, 12, 30, 8]:
+        log.jump(step)
+        assert_at(log, loaded, edits, step)
+
+
+def test_deletes_around_a_checkpoint():
+    # the third and fourth edits are deletes, the checkpoint after the third lies between them
+    loaded = loaded_frame()
+    log = EditLog(loaded.copy(), checkpoint_every=3)
+    edits = record_edits(log, 7, delete_every=1)
+    assert sorted(log._checkpoints) == [0, 3, 6]
+
+    for step in [3, 2, 4, 3, 6, 0, 7, 5]:
+        log.jump(step)
+        assert_at(log, loaded, edits, step)
+    log.undo()
+    assert_at(log, loaded, edits, 4)
+    log.redo()
+    assert_at(log, loaded, edits, 5)
+
+
+def test_an_edit_after_undoing_drops_the_redo_steps():
+    loaded = loaded_frame()
+    log = EditLog(loaded.copy(), checkpoint_every=4)
+    edits = record_edits(log, 10)
+    log.jump(5)
+    edits = edits[:5] + record_edits(log, 6, seed=2)
+
+    assert len(log) == 11 and max(log._checkpoints) <= 8
+    for step in [11, 0, 9, 4, 7]:
+        log.jump(step)
+        assert_at(log, loaded, edits, step)
+
+
+def test_deletes_leave_the_frame_to_the_next_read():
+    log = EditLog(loaded_frame(), checkpoint_every=4)
+    frame = log.frame
+    log.delete(frame.index[10:20])
+    log.undo()
+    log.redo()
+    assert log._frame is frame  # nothing was rebuilt by the three steps
+    assert log.rows == len(frame) - 10
+    assert len(log.frame) == log.rows
+
+
+def test_store_returns_the_log_frame_after_commit(tmp_path):
+    loaded = loaded_frame()
+    store = SessionStore(tmp_path)
+    token = store.create(loaded.copy())
+    log = store.edit_log(token)
+    token = store.commit(token, log.delete(loaded.index[:100]))
+    token = store.commit(token, log.set_values(loaded.index[100:110], np.zeros(10)))
+
+    expected = replay(loaded, [('delete', loaded.index[:100], None), ('values', loaded.index[100:110], np.zeros(10))])
+    pd.testing.assert_frame_equal(store.get(token), expected, check_exact=True)
+    store.close()
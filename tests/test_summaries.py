@@ -0,0 +1,56 @@
+# A window read by rowid through the summaries has to be exactly the whole site's working frame cut to the window: the
+# same readings, where overlapping batches hold the same time too, under the same row ids.
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from run_query import get_pressure, working_frame
+from summaries import Summaries
+from synth_db import build
+
+
+@pytest.fixture(scope="module")
+def site(tmp_path_factory):
+    """A synthetic site, its whole working frame, and its summaries"""
+    directory = tmp_path_factory.mktemp("summaries")
+    build(directory / "synthetic.db", sites=1, years=1.0, overlap_days=5)
+    connection = sqlite3.connect(directory / "synthetic.db")
+    cursor = connection.cursor()
+    cursor.execute("SELECT MIN(site_id) FROM hobo_pressure_batches_1")
+    site_id = cursor.fetchone()[0]
+    summaries = Summaries(directory / "summaries.db")
+    summaries.update(cursor, site_id)
+    yield cursor, site_id, working_frame(get_pressure(cursor, site_id)), summaries
+    connection.close()
+
+
+@pytest.mark.parametrize("start, days", [(0.0, 3), (0.3, 0.2), (0.5, 20), (0.97, 30)])
+def test_window_frame_is_the_site_cut_to_the_window(site, start, days):
+    cursor, site_id, full, summaries = site
+    t0 = full['datetime'].iloc[int(len(full) * start)] + pd.Timedelta(minutes=7)
+    window = [str(t0), str(t0 + pd.Timedelta(days=days))]
+    expected = full[(full['datetime'] >= pd.Timestamp(window[0])) & (full['datetime'] <= pd.Timestamp(window[1]))]
+    pd.testing.assert_frame_equal(summaries.window_frame(cursor, site_id, window), expected)
+
+
+def test_window_across_overlapping_batches(site):
+    cursor, site_id, full, summaries = site
+    second = full['datetime'][full['batch_id'] != full['batch_id'].iloc[0]]
+    t0 = second.iloc[0] - pd.Timedelta(days=2)
+    window = [str(t0), str(t0 + pd.Timedelta(days=10))]
+    assert len(summaries.rowid_ranges(site_id, window)) > 1
+    expected = full[(full['datetime'] >= t0) & (full['datetime'] <= pd.Timestamp(window[1]))]
+    pd.testing.assert_frame_equal(summaries.window_frame(cursor, site_id, window), expected)
+
+
+def test_sidecar_without_rowids_is_summarized_again(site, tmp_path):
+    cursor, site_id, full, summaries = site
+    old = Summaries(tmp_path / "summaries.db")
+    old.update(cursor, site_id)
+    with sqlite3.connect(old.path) as connection:
+        connection.execute("DELETE FROM rowids")
+    assert old.update(cursor, site_id) > 0
+    window = [str(full['datetime'].iloc[100]), str(full['datetime'].iloc[400])]
+    pd.testing.assert_frame_equal(old.window_frame(cursor, site_id, window), full.iloc[100:401])